@@ -2,9 +2,9 @@
 import streamlit as st
 from dotenv import load_dotenv
 from streamlit_oauth import OAuth2Component
-import requests
-
-from db import create_user, get_user, create_google_user, verify_user
+from db import User, create_user, upsert_google_user, verify_user
+import oauth_utils
+import passwords
 
 
 load_dotenv()
@@ -13,7 +13,13 @@ load_dotenv()
 REDIRECT_URI = st.secrets.get("redirect_uri", "https://similarly-listprice-arbor-paragraph.trycloudflare.com")
 
 
+# How long the Delete button waits for the deletion before saying it's still running
+DELETE_WAIT_SECONDS = 3
+
+
+# openid: Google also returns an ID token naming the user, so no userinfo request is needed
 GOOGLE_SCOPE = (
+    "openid "
     "https://www.googleapis.com/auth/userinfo.email "
     "https://www.googleapis.com/auth/userinfo.profile"
 )
@@ -29,29 +35,22 @@ try:
         token_endpoint="https://oauth2.googleapis.com/token",
     )
 except KeyError:
+    GOOGLE_CLIENT_ID = None
     google = None  # OAuth disabled
 
 def fetch_google_user_info(token_dict: dict) -> dict:
-    """Fetch user info from Google using the access token."""
-    if not isinstance(token_dict, dict):
-        return {}
-
-    access_token = token_dict.get("access_token")
-    if not access_token:
-        return {}
-
-    try:
-        resp = requests.get(
-            "https://www.googleapis.com/oauth2/v2/userinfo",
-            headers={"Authorization": f"Bearer {access_token}"},
-            timeout=5,
-        )
-        if resp.ok:
-            return resp.json()
-    except Exception:
-        pass
+    """User info for a Google token, read from its ID token when there is one."""
+    return oauth_utils.google_user_info(token_dict, GOOGLE_CLIENT_ID)
+
 
-    return {}
+def _start_session(user: User, default_method: str):
+    """Keep the logged-in user in the session, so later reruns need no lookup."""
+    st.session_state["user"] = {
+        "id": user.id,
+        "email": user.email,
+        "name": user.name or user.email,
+        "method": user.method or default_method,
+    }
 
 
 def _handle_google_result(token: dict):
@@ -64,17 +63,8 @@ def _handle_google_result(token: dict):
         st.error("Could not retrieve email from Google account.")
         return
 
-    row = get_user(email)
-    if not row:
-        create_google_user(email, name)
-        row = get_user(email)
-
-    st.session_state["user"] = {
-        "id": row[0],
-        "email": row[1],
-        "name": row[4] or row[1],
-        "method": row[5] or "google",
-    }
+    # One round trip: finds the account or creates it
+    _start_session(upsert_google_user(email, name), "google")
 
     st.session_state["google_token"] = token
 
@@ -127,17 +117,14 @@ def login_view():
     if st.button("Login", type="primary"):
         if not email or not pwd:
             st.warning("Email and password required.")
+        elif (wait := passwords.login_wait_seconds(email, st.context.ip_address)) > 0:
+            st.error(f"Too many failed attempts. Try again in {wait:.0f} seconds.")
         else:
             # Use verify_user for secure password checking
-            user_id = verify_user(email, pwd)
-            if user_id:
-                row = get_user(email)
-                st.session_state["user"] = {
-                    "id": user_id,
-                    "email": row[1],
-                    "name": row[4] or row[1],
-                    "method": row[5] or "manual",
-                }
+            verified = verify_user(email, pwd)
+            passwords.record_login(email, st.context.ip_address, success=verified is not None)
+            if verified:
+                _start_session(verified, "manual")
                 st.success("Logged in.")
                 st.rerun()
             else:
@@ -162,8 +149,12 @@ def login_view():
     else:
         st.info("Already authenticated with Google.")
 
+@st.fragment
 def account_view():
-    """Account management page with logout, change password, and delete account."""
+    """
+    Account management page with logout, change password, and delete account.
+    Runs as a fragment, so its widgets don't rerun the notes tabs.
+    """
     user = st.session_state.get("user")
     if not user:
         st.error("No active session.")
@@ -189,21 +180,27 @@ def account_view():
     if user.get("method") == "manual" or not user.get("method"):
         st.subheader("Change Password")
         
-        current_pwd = st.text_input("Current Password", type="password", key="current_pwd")
-        new_pwd = st.text_input("New Password", type="password", key="new_pwd")
-        confirm_new_pwd = st.text_input("Confirm New Password", type="password", key="confirm_new_pwd")
-        
-        if st.button("Change Password", type="secondary"):
+        # A form: nothing reruns until the button is pressed
+        with st.form("change_password"):
+            current_pwd = st.text_input("Current Password", type="password", key="current_pwd")
+            new_pwd = st.text_input("New Password", type="password", key="new_pwd")
+            confirm_new_pwd = st.text_input("Confirm New Password", type="password", key="confirm_new_pwd")
+            change_clicked = st.form_submit_button("Change Password", type="secondary")
+
+        if change_clicked:
             if not current_pwd or not new_pwd or not confirm_new_pwd:
                 st.warning("Please fill in all password fields.")
             elif new_pwd != confirm_new_pwd:
                 st.error("New passwords do not match.")
+            elif (wait := passwords.login_wait_seconds(user.get("email"), st.context.ip_address)) > 0:
+                st.error(f"Too many failed attempts. Try again in {wait:.0f} seconds.")
             else:
                 # Verify current password
                 from db import verify_user, update_password
-                user_id = verify_user(user.get("email"), current_pwd)
-                if user_id:
-                    if update_password(user_id, new_pwd):
+                verified = verify_user(user.get("email"), current_pwd)
+                passwords.record_login(user.get("email"), st.context.ip_address, success=verified is not None)
+                if verified:
+                    if update_password(verified.id, new_pwd):
                         st.success("Password changed successfully!")
                     else:
                         st.error("Failed to update password. Please try again.")
@@ -220,10 +217,42 @@ def account_view():
     st.warning("⚠️ This action is permanent. All your notes will be deleted.")
     
     if st.button("Delete My Account", type="secondary"):
-        from db import delete_user
-        if delete_user(user["id"]):
-            st.session_state.clear()
-            st.success("Your account has been deleted.")
+        import maintenance
+        future = maintenance.delete_user(user["id"])
+        try:
+            deleted = future.result(timeout=DELETE_WAIT_SECONDS)
+        except TimeoutError:
+            # A big account: it keeps being deleted in the background (see deletion_view)
+            st.session_state["account_deletion"] = future
             st.rerun()
-        else:
-            st.error("Error deleting account. Please try again.")
\ No newline at end of file
+        _finish_deletion(deleted)
+
+
+def deletion_view():
+    """
+    Shown instead of the app while the account is being deleted, so the
+    session can't use it meanwhile; logs out once the deletion is done.
+    """
+    pending = st.session_state["account_deletion"]
+    if pending.done():
+        st.session_state.pop("account_deletion")
+        _finish_deletion(pending.result())
+    else:
+        _deletion_progress()
+
+
+@st.fragment(run_every=1)
+def _deletion_progress():
+    """Poll the pending deletion and refresh the page when it ends."""
+    if st.session_state["account_deletion"].done():
+        st.rerun()
+    st.info("Your account is still being deleted. You will be logged out once it is done.")
+
+
+def _finish_deletion(deleted: bool):
+    if deleted:
+        st.session_state.clear()
+        st.success("Your account has been deleted.")
+        st.rerun()
+    else:
+        st.error("Error deleting account. Please try again.")
@@ -0,0 +1,130 @@
+import asyncio
+import json
+import time
+
+import db
+import llm_utils
+
+# batch_analysis.py
+# Summarizes, rates the sentiment of and extracts keywords from many notes at
+# once. Each note is one request asking for all three results as JSON (instead
+# of three separate calls), requests run concurrently up to a limit and are
+# spaced to stay under a requests-per-minute budget, and every result is saved
+# to the notes table as soon as it arrives.
+
+
+CONCURRENCY = 16             # requests in flight at once
+REQUESTS_PER_MINUTE = 500    # stay below the account's rate limit
+MAX_INPUT_CHARS = 12_000     # long PDFs are cut to keep each request small
+
+SYSTEM_PROMPT = (
+    "You analyse a user's note. Reply with a JSON object with exactly these keys: "
+    '"summary": a short, clear summary in simple, natural language; '
+    '"sentiment": whether the note is positive, negative or neutral, with a brief explanation; '
+    '"keywords": a list of the most important words or short phrases.'
+)
+
+
+class _RateLimiter:
+    """Spaces request start times so no more than `per_minute` begin per minute."""
+
+    def __init__(self, per_minute: int):
+        self.interval = 60.0 / per_minute
+        self.next_start = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_start - now
+            self.next_start = max(now, self.next_start) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def _note_text(title: str, content: str, pdf_text: str | None) -> str:
+    text = f"{title}\n\n{content or ''}"
+    if pdf_text:
+        text += f"\n\n{pdf_text}"
+    return text[:MAX_INPUT_CHARS]
+
+
+def _parse(reply: str) -> tuple[str, str, list[str]]:
+    """Read the model's JSON answer; tolerate keywords given as a string."""
+    data = json.loads(reply)
+    keywords = data.get("keywords") or []
+    if isinstance(keywords, str):
+        keywords = [k.strip() for k in keywords.split(",") if k.strip()]
+    return str(data.get("summary", "")).strip(), str(data.get("sentiment", "")).strip(), keywords
+
+
+async def _analyze_one(client, limiter, slots, note, stats):
+    note_id, title, content, pdf_text = note
+    text = _note_text(title, content, pdf_text)
+
+    # SQLite calls block, so they run on worker threads and the other requests keep going
+    reply = await asyncio.to_thread(llm_utils.cached_reply, SYSTEM_PROMPT, text)
+    from_cache = reply is not None
+    if not from_cache:
+        async with slots:
+            await limiter.wait()
+            try:
+                resp = await client.chat.completions.create(
+                    model=llm_utils.MODEL,
+                    messages=[
+                        {"role": "system", "content": SYSTEM_PROMPT},
+                        {"role": "user", "content": text},
+                    ],
+                    temperature=llm_utils.BASIC_TEMPERATURE,
+                    response_format={"type": "json_object"},
+                )
+                reply = resp.choices[0].message.content
+            except Exception:
+                stats["failed"] += 1
+                return
+        stats["requests"] += 1
+    else:
+        stats["cached"] += 1
+
+    try:
+        summary, sentiment, keywords = _parse(reply)
+    except (ValueError, AttributeError):
+        stats["failed"] += 1
+        return
+    if not from_cache:
+        # Only new replies: storing a hit again would restart its TTL every time
+        await asyncio.to_thread(llm_utils.store_reply, SYSTEM_PROMPT, text, reply)
+    await asyncio.to_thread(db.save_note_analysis, note_id, summary, sentiment, keywords)
+    stats["analyzed"] += 1
+
+
+async def analyze_notes_async(notes, concurrency: int = CONCURRENCY, requests_per_minute: int = REQUESTS_PER_MINUTE) -> dict:
+    """Analyze (id, title, content, pdf_text) rows concurrently; returns counters."""
+    stats = {"notes": len(notes), "analyzed": 0, "requests": 0, "cached": 0, "failed": 0}
+    client = llm_utils.get_async_client()
+    if client is None:
+        stats["failed"] = len(notes)
+        return stats
+
+    limiter = _RateLimiter(requests_per_minute)
+    slots = asyncio.Semaphore(concurrency)
+    try:
+        await asyncio.gather(*(_analyze_one(client, limiter, slots, note, stats) for note in notes))
+    finally:
+        await client.close()
+    return stats
+
+
+def analyze_user_notes(user_id: int, only_missing: bool = True, **kwargs) -> dict:
+    """
+    Analyze all of a user's notes (by default only those not analyzed yet)
+    and store the results. Returns counters: notes, analyzed, requests,
+    cached, failed and seconds.
+    """
+    start = time.perf_counter()
+    notes = db.get_notes_to_analyze(user_id, only_missing)
+    stats = asyncio.run(analyze_notes_async(notes, **kwargs)) if notes else {
+        "notes": 0, "analyzed": 0, "requests": 0, "cached": 0, "failed": 0,
+    }
+    stats["seconds"] = time.perf_counter() - start
+    return stats
@@ -0,0 +1,1595 @@
+"""
+bench.py
+Standalone benchmarks for the app's hot paths.
+
+Every benchmark runs against a throwaway database in a temp folder, so the
+real data/app.db is never touched.
+
+app_flows and db_functions are the regression suite: both run on a database
+made by seed_app_db (users and notes of mixed length, the same for the same
+--seed), app_flows clicks through app.py with Streamlit's AppTest and a stub
+LLM, and db_functions times every public function of db.py. Their medians
+and p95s go into the --json report; --compare prints the change against an
+earlier report and exits with status 1 if a metric got worse by more than
+--threshold percent.
+
+Usage:
+    python bench.py            # run everything
+    python bench.py pool       # run one benchmark
+    python bench.py app_flows db_functions --notes 100000 --json before.json
+    python bench.py app_flows db_functions --notes 100000 --compare before.json
+"""
+import argparse
+import contextlib
+import inspect
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import db
+
+
+BENCHMARKS = {}
+RESULTS = {}        # benchmark name -> {metric: {"value": ..., "unit": ...}}
+NOISE_MS = 0.05     # --compare never calls a smaller difference in time a regression
+_current = None     # name of the running benchmark
+
+
+def benchmark(fn):
+    """Register a benchmark under its function name."""
+    BENCHMARKS[fn.__name__] = fn
+    return fn
+
+
+def record(metric: str, value: float, unit: str = "ms"):
+    """Keep a number of the running benchmark for the JSON report (--json)."""
+    RESULTS.setdefault(_current, {})[metric] = {"value": round(value, 4), "unit": unit}
+
+
+def _fresh_db(folder: str, name: str = "bench.db") -> str:
+    """Point db.py at a new database file and create the schema."""
+    db.DB_PATH = os.path.join(folder, name)
+    db.init_db()
+    return db.DB_PATH
+
+
+def _run_sessions(n_sessions: int, ops: int, work, thread_per_op: bool = False) -> float:
+    """
+    Run `work(session_index, op_index)` from n threads and return ops/sec.
+    With thread_per_op every op runs on a thread of its own, the way
+    Streamlit starts a new script thread for every rerun.
+    """
+    def session(i):
+        for j in range(ops):
+            if thread_per_op:
+                op = threading.Thread(target=work, args=(i, j))
+                op.start()
+                op.join()
+            else:
+                work(i, j)
+
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(n_sessions)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return n_sessions * ops / elapsed
+
+
+@benchmark
+def pool(sessions=(1, 4, 16), ops=200):
+    """Pooled WAL connections vs. a new rollback-journal connection per call."""
+    with tempfile.TemporaryDirectory() as folder:
+        # --- before: one connection per call, default journal mode ---
+        old_path = os.path.join(folder, "old.db")
+        with sqlite3.connect(old_path) as con:
+            con.execute("CREATE TABLE notes(id INTEGER PRIMARY KEY, user_id INTEGER, title TEXT, content TEXT, "
+                        "created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, pdf_path TEXT)")
+
+        def old_write(i, j):
+            with sqlite3.connect(old_path, timeout=30, check_same_thread=False) as con:
+                con.execute("INSERT INTO notes (user_id, title, content) VALUES (?, ?, ?)", (i, f"t{j}", "x" * 200))
+
+        def old_read(i, j):
+            with sqlite3.connect(old_path, timeout=30, check_same_thread=False) as con:
+                con.execute("SELECT id, title, content, created_at, pdf_path FROM notes "
+                            "WHERE user_id = ? ORDER BY created_at DESC", (i,)).fetchall()
+
+        # --- after: the pool in db.py ---
+        _fresh_db(folder)
+        for i in range(max(sessions)):
+            db.create_google_user(f"bench{i}@example.com", f"bench{i}")
+        user_ids = [db.get_user(f"bench{i}@example.com").id for i in range(max(sessions))]
+
+        def new_write(i, j):
+            db.create_note(user_ids[i], f"t{j}", "x" * 200)
+
+        def new_read(i, j):
+            db.get_user_notes.__wrapped__(user_ids[i])  # the query itself, not the read cache
+
+        for n in sessions:
+            print(f"  {n:>3} sessions | "
+                  f"write {_run_sessions(n, ops, old_write):>8.0f} -> {_run_sessions(n, ops, new_write):>8.0f} ops/s | "
+                  f"read {_run_sessions(n, ops, old_read):>8.0f} -> {_run_sessions(n, ops, new_read):>8.0f} ops/s | "
+                  f"read, new thread per call {_run_sessions(n, ops, old_read, True):>8.0f} -> "
+                  f"{_run_sessions(n, ops, new_read, True):>8.0f} ops/s")
+        pool = db._get_pool()
+        print(f"  idle reader connections after all that: {len(pool._idle)} (at most {pool.size} kept)")
+
+
+def _time_per_call(fn, repeat: int) -> float:
+    """Average wall time of fn() in milliseconds."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def _timings(fn, repeat: int, prepare=None) -> list[float]:
+    """Milliseconds of each of `repeat` calls fn(*prepare()); prepare() itself is not timed."""
+    times = []
+    for _ in range(repeat):
+        args = prepare() if prepare else ()
+        start = time.perf_counter()
+        fn(*args)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def _report(label: str, times: list[float]):
+    """Print the median and p95 of some timings and record them."""
+    median = statistics.median(times)
+    p95 = statistics.quantiles(times, n=20)[-1] if len(times) > 1 else times[0]
+    print(f"  {label:<40} median {median:9.3f} ms | p95 {p95:9.3f} ms")
+    record(f"{label} median", median)
+    record(f"{label} p95", p95)
+
+
+@benchmark
+def init_db(repeat=500):
+    """Per-rerun cost of init_db: unversioned schema check vs. migration fast-path."""
+    with tempfile.TemporaryDirectory() as folder:
+        start = time.perf_counter()
+        _fresh_db(folder)
+        print(f"  first call (runs migrations):    {(time.perf_counter() - start) * 1000:8.3f} ms")
+
+        def legacy_rerun():
+            # What every rerun used to do: connect and re-run the schema checks
+            with sqlite3.connect(db.DB_PATH) as con:
+                db._migrate_base_schema(con)
+            con.close()
+
+        print(f"  legacy per-rerun schema check:   {_time_per_call(legacy_rerun, repeat):8.3f} ms")
+        print(f"  init_db per rerun (fast-path):   {_time_per_call(db.init_db, repeat):8.3f} ms")
+
+
+def _seed_notes(n_notes: int, n_users: int = 100, content="x" * 200):
+    """
+    Bulk-insert n_notes spread over n_users straight through the writer.
+    content is a string, or a function of the note number returning one.
+    """
+    make_content = content if callable(content) else (lambda i: content)
+    with db._conn(write=True) as con:
+        con.executemany(
+            "INSERT OR IGNORE INTO users (email, name, method) VALUES (?, ?, 'google')",
+            ((f"seed{u}@example.com", f"seed{u}") for u in range(n_users)),
+        )
+        user_ids = [r[0] for r in con.execute("SELECT id FROM users WHERE email LIKE 'seed%'")]
+        con.executemany(
+            "INSERT INTO notes (user_id, title, content, created_at) "
+            "VALUES (?, ?, ?, datetime('2024-01-01', ? || ' seconds'))",
+            ((user_ids[i % len(user_ids)], f"note {i}", make_content(i), i) for i in range(n_notes)),
+        )
+    # Written behind db.py's back, so its read cache doesn't know
+    db.clear_read_cache()
+    return user_ids
+
+
+SEED_EMAIL = "bench@example.com"
+SEED_PASSWORD = "bench password"
+_WORDS = ("cell membrane protein enzyme lecture exam chapter theorem proof energy market price history "
+          "treaty reaction molecule network signal memory function variable summary essay source").split()
+
+
+def seed_app_db(folder: str, n_users: int = 50, n_notes: int = 10_000, seed: int = 0) -> dict:
+    """
+    Create a synthetic app database in folder and return the session user
+    (as auth_ui keeps it) of SEED_EMAIL, who logs in with SEED_PASSWORD.
+    The n_notes go round-robin to n_users accounts, SEED_EMAIL first: most
+    are a few lines, a quarter a page, one in twenty has a long PDF text.
+    The same arguments give the same database (text from random.Random(seed)).
+    """
+    import random
+
+    rng = random.Random(seed)
+    _fresh_db(folder)
+    db.create_user(SEED_EMAIL, SEED_PASSWORD)
+    with db._conn(write=True) as con:
+        con.executemany(
+            "INSERT INTO users (email, name, method) VALUES (?, ?, 'google')",
+            ((f"user{u}@example.com", f"User {u}") for u in range(1, n_users)),
+        )
+        user_ids = [row[0] for row in con.execute("SELECT id FROM users ORDER BY id")]
+
+    def words(n: int) -> str:
+        return " ".join(rng.choice(_WORDS) for _ in range(n))
+
+    def notes():
+        start = datetime(2024, 1, 1)
+        for i in range(n_notes):
+            kind = rng.random()
+            yield {
+                "user_id": user_ids[i % len(user_ids)],
+                "title": f"{words(3).capitalize()} {i}",
+                "content": words(rng.randint(200, 400) if kind < 0.25 else rng.randint(10, 60)),
+                "created_at": (start + timedelta(minutes=i)).strftime("%Y-%m-%d %H:%M:%S"),
+                "pdf_text": words(2_000) if kind > 0.95 else "",
+            }
+
+    db.import_notes(notes())
+    return {"id": user_ids[0], "email": SEED_EMAIL, "name": SEED_EMAIL, "method": "manual"}
+
+
+def _traced(pool, statements: list):
+    """
+    The pool's connections with statements.append as trace callback: the
+    writer and the idle readers, which single-threaded reads check out.
+    """
+    with pool.reader():
+        pass  # at least one idle reader
+    connections = [pool._writer, *pool._idle]
+    for con in connections:
+        con.set_trace_callback(statements.append)
+    return connections
+
+
+@benchmark
+def indexes(sizes=(10_000, 100_000, 1_000_000), repeat=20):
+    """Listing latency as the notes table grows (per-user list and first page of all notes)."""
+    with tempfile.TemporaryDirectory() as folder:
+        _fresh_db(folder)
+        db.create_google_user("reader@example.com", "reader")
+        reader_id = db.get_user("reader@example.com").id
+        for i in range(50):
+            db.create_note(reader_id, f"mine {i}", "y" * 200)
+
+        seeded = 0
+        for size in sizes:
+            _seed_notes(size - seeded)
+            seeded = size
+
+            def first_page():
+                with db._conn() as con:
+                    con.execute(
+                        "SELECT notes.id, users.email, notes.title, notes.created_at FROM notes "
+                        "JOIN users ON notes.user_id = users.id "
+                        "ORDER BY notes.created_at DESC, notes.id DESC"
+                    ).fetchmany(50)
+
+            print(f"  {size:>9} notes | get_user_notes {_time_per_call(lambda: db.get_user_notes.__wrapped__(reader_id), repeat):7.3f} ms"
+                  f" | all notes first 50 {_time_per_call(first_page, repeat):7.3f} ms")
+
+
+@benchmark
+def note_bodies(n_notes=2_000, pdf_chars=200_000, repeat=20):
+    """Bytes and time per listing page with PDF text inline vs. split out (v4 migration)."""
+    with tempfile.TemporaryDirectory() as folder:
+        # Build a v3 database holding notes the way app.py used to save them
+        db.DB_PATH = os.path.join(folder, "bench.db")
+        with db._conn(write=True) as con:
+            for number, migration in enumerate(db.MIGRATIONS[:3], start=1):
+                migration(con)
+                con.execute(f"PRAGMA user_version = {number}")
+        legacy = "My notes on the lecture.\n\n--- PDF Content ---\n" + "lorem ipsum " * (pdf_chars // 12)
+        _seed_notes(n_notes, n_users=10, content=legacy)
+
+        def legacy_page():
+            with db._conn() as con:
+                return con.execute(
+                    "SELECT notes.id, users.email, notes.title, notes.content, notes.created_at, notes.pdf_path "
+                    "FROM notes JOIN users ON notes.user_id = users.id "
+                    "ORDER BY notes.created_at DESC, notes.id DESC LIMIT ?", (db.PAGE_SIZE,)
+                ).fetchall()
+
+        def page_bytes(rows):
+            return sum(len(str(value)) for row in rows for value in row)
+
+        before_ms = _time_per_call(legacy_page, repeat)
+        before_bytes = page_bytes(legacy_page())
+
+        start = time.perf_counter()
+        with db._conn(write=True) as con:
+            db.MIGRATIONS[3](con)
+            con.execute("PRAGMA user_version = 4")
+        print(f"  v4 migration of {n_notes} notes: {(time.perf_counter() - start):.2f} s")
+        start = time.perf_counter()
+        db.init_db()
+        print(f"  later migrations (v5 to v{len(db.MIGRATIONS)}): {(time.perf_counter() - start):.2f} s")
+
+        after_ms = _time_per_call(lambda: db.get_all_notes_page.__wrapped__(), repeat)
+        after_bytes = page_bytes(db.get_all_notes_page()[0])
+        print(f"  page of {db.PAGE_SIZE}: {before_bytes:>10} -> {after_bytes:>6} bytes | "
+              f"{before_ms:7.3f} -> {after_ms:7.3f} ms")
+
+
+def make_pdf(path: str, pages: int, lines_per_page: int = 40, tag: str = ""):
+    """Write a plain-text PDF with the given number of pages (no extra dependencies)."""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once the page objects are numbered
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for p in range(pages):
+        text = " ".join(
+            f"BT /F1 10 Tf 40 {780 - 18 * i} Td ({tag}Page {p + 1} line {i + 1}: the quick brown fox jumps over the lazy dog) Tj ET"
+            for i in range(lines_per_page)
+        ).encode()
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(text), text))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (len(objects))
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % k for k in kids), pages)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+@benchmark
+def pdf_ingest(n_pdfs=4, pages=300):
+    """Save latency and pages/sec: inline PyPDF2 extraction vs. the background pool."""
+    import pdf_ingest as ingest
+    from PyPDF2 import PdfReader
+
+    with tempfile.TemporaryDirectory() as folder:
+        _fresh_db(folder)
+        db.create_google_user("pdf@example.com", "pdf")
+        user_id = db.get_user("pdf@example.com").id
+        paths = []
+        for i in range(n_pdfs):
+            paths.append(os.path.join(folder, f"doc{i}.pdf"))
+            make_pdf(paths[-1], pages)
+
+        # --- before: extract inside the request, then save ---
+        start = time.perf_counter()
+        for path in paths:
+            text = "\n\n".join(page.extract_text() for page in PdfReader(path).pages)
+            db.create_note(user_id, "inline", "x", path, text)
+        inline = time.perf_counter() - start
+
+        # --- after: save immediately, extract in the pool ---
+        ingest._executors()  # don't count worker start-up
+        start = time.perf_counter()
+        futures = []
+        for path in paths:
+            note_id = db.create_note(user_id, "pooled", "x", path, pdf_status="processing")
+            futures.append(ingest.submit(note_id, path))
+        saved = time.perf_counter() - start
+        for future in futures:
+            future.result()
+        pooled = time.perf_counter() - start
+
+        ready = sum(db.get_pdf_status(n)[0] == "ready" for n in range(n_pdfs + 1, 2 * n_pdfs + 1))
+        total_pages = n_pdfs * pages
+        print(f"  {n_pdfs} PDFs x {pages} pages, {ingest.MAX_WORKERS} workers, {ready}/{n_pdfs} ready")
+        print(f"  save latency per note: {inline / n_pdfs * 1000:9.1f} -> {saved / n_pdfs * 1000:7.2f} ms")
+        print(f"  extraction throughput: {total_pages / inline:9.0f} -> {total_pages / pooled:7.0f} pages/s")
+
+
+@benchmark
+def pdf_dedup(n_users=20, n_pdfs=5, pages=50):
+    """Disk use and extractions when many users upload the same PDFs."""
+    import maintenance
+    import pdf_ingest as ingest
+    import pdf_store
+
+    with tempfile.TemporaryDirectory() as folder:
+        _fresh_db(folder)
+        pdf_store.PDF_DIR = os.path.join(folder, "pdfs")
+        corpus = []
+        for i in range(n_pdfs):
+            path = os.path.join(folder, f"doc{i}.pdf")
+            make_pdf(path, pages, tag=f"doc{i} ")
+            with open(path, "rb") as f:
+                corpus.append(f.read())
+
+        start = time.perf_counter()
+        for u in range(n_users):
+            db.create_google_user(f"dedup{u}@example.com", f"dedup{u}")
+            user_id = db.get_user(f"dedup{u}@example.com").id
+            futures = []
+            for i, data in enumerate(corpus):
+                pdf_hash, pdf_path = pdf_store.put(data)
+                note_id = db.create_note(user_id, f"doc{i}", "x", pdf_path, pdf_status="processing",
+                                         pdf_hash=pdf_hash, pdf_name=f"doc{i}.pdf", pdf_size=len(data))
+                if db.get_pdf_status(note_id)[0] == "processing":
+                    futures.append(ingest.submit(note_id, pdf_path, pdf_hash))
+            for future in futures:
+                future.result()
+        elapsed = time.perf_counter() - start
+
+        stats = db.get_pdf_store_stats()
+        uploaded = n_users * sum(len(data) for data in corpus)
+        print(f"  {n_users} users x {n_pdfs} PDFs in {elapsed:.2f} s")
+        print(f"  uploaded {uploaded:>10} bytes | stored {stats['bytes_stored']:>9} | saved {stats['bytes_saved']:>10}")
+        print(f"  extractions skipped: {stats['extractions_skipped']} of {n_users * n_pdfs}")
+
+        # Every user uploads the same new PDFs at once, before any extraction has finished
+        fresh = []
+        for i in range(n_pdfs):
+            path = os.path.join(folder, f"new{i}.pdf")
+            make_pdf(path, pages, tag=f"new{i} ")
+            with open(path, "rb") as f:
+                fresh.append(f.read())
+        extractions = ingest.get_stats()["extractions"]
+        futures = []
+        for u in range(n_users):
+            user_id = db.get_user(f"dedup{u}@example.com").id
+            for i, data in enumerate(fresh):
+                pdf_hash, pdf_path = pdf_store.put(data)
+                note_id = db.create_note(user_id, f"new{i}", "x", pdf_path, pdf_status="processing",
+                                         pdf_hash=pdf_hash, pdf_name=f"new{i}.pdf", pdf_size=len(data))
+                if db.get_pdf_status(note_id)[0] == "processing":
+                    futures.append(ingest.submit(note_id, pdf_path, pdf_hash))
+        for future in futures:
+            future.result()
+        pending = len(db.get_pending_pdf_notes())
+        print(f"  concurrent uploads: {ingest.get_stats()['extractions'] - extractions} extractions "
+              f"for {n_users * n_pdfs} notes, {pending} left processing")
+
+        for u in range(n_users):
+            db.delete_user(db.get_user(f"dedup{u}@example.com").id)
+        maintenance.collect_pdfs(grace_seconds=0)
+        left = sum(len(files) for _, _, files in os.walk(pdf_store.PDF_DIR))
+        print(f"  after deleting every user: {db.get_pdf_store_stats()['blobs']} blobs, {left} files left")
+
+
+class StubLLM:
+    """
+    Local OpenAI-compatible server for benchmarks.
+    Answers /v1/chat/completions after base_ms plus per_token_ms for every
+    prompt token, then spends per_output_ms on each word of the reply
+    (streamed as server-sent events when the request asks for stream=True).
+    Remembers the size of each prompt it received, and like the real API
+    reports prompt prefixes it has seen before (1024 tokens or more, in steps
+    of 128) as cached tokens.
+    """
+
+    def __init__(self, base_ms: float = 50, per_token_ms: float = 0.01, reply: str = "Stub answer.",
+                 per_output_ms: float = 0):
+        self.base_ms = base_ms
+        self.per_token_ms = per_token_ms
+        self.per_output_ms = per_output_ms
+        self.reply = reply
+        self.prompt_chars = []
+        self.requests = 0
+        self._prompts = []
+        self._prompts_lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True  # avoid 40 ms delayed-ACK stalls on localhost
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                stub.handle(self, body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def handle(self, handler, body: dict):
+        chars = sum(len(m["content"]) for m in body["messages"])
+        self.prompt_chars.append(chars)
+        self.requests += 1
+        prompt_tokens = (chars + 3) // 4
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": 3, "total_tokens": prompt_tokens + 3,
+                 "prompt_tokens_details": {"cached_tokens": self._cached_tokens(body["messages"])}}
+        time.sleep((self.base_ms + self.per_token_ms * prompt_tokens) / 1000)
+        if body.get("stream"):
+            return self._stream(handler, body, usage)
+        time.sleep(self.per_output_ms * len(self.reply.split()) / 1000)
+        payload = json.dumps({
+            "id": "stub", "object": "chat.completion", "created": int(time.time()), "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": self.reply}}],
+            "usage": usage,
+        }).encode()
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(payload)))
+        handler.end_headers()
+        handler.wfile.write(payload)
+
+    def _cached_tokens(self, messages: list[dict]) -> int:
+        prompt = json.dumps(messages)
+        with self._prompts_lock:
+            shared = max((len(os.path.commonprefix([prompt, seen])) for seen in self._prompts), default=0)
+            self._prompts = [*self._prompts[-63:], prompt]
+        tokens = shared // 4
+        return tokens // 128 * 128 if tokens >= 1024 else 0
+
+    def _stream(self, handler, body: dict, usage: dict):
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Connection", "close")
+        handler.end_headers()
+        handler.close_connection = True
+        for word in self.reply.split(" "):
+            time.sleep(self.per_output_ms / 1000)
+            chunk = {
+                "id": "stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": body["model"],
+                "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}],
+            }
+            handler.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            handler.wfile.flush()
+        if body.get("stream_options", {}).get("include_usage"):
+            chunk = {"id": "stub", "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": body["model"], "choices": [], "usage": usage}
+            handler.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        handler.wfile.write(b"data: [DONE]\n\n")
+        handler.wfile.flush()
+
+    def __enter__(self):
+        # llm_utils builds its OpenAI client from these
+        self._env = {k: os.environ.get(k) for k in ("OPENAI_API_KEY", "OPENAI_BASE_URL")}
+        os.environ["OPENAI_API_KEY"] = "sk-stub"
+        os.environ["OPENAI_BASE_URL"] = self.url
+        return self
+
+    def __exit__(self, *exc):
+        for key, value in self._env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        self.server.shutdown()
+
+
+@benchmark
+def chat_context(n_notes=300, pdf_words=3_000, questions=10):
+    """Prompt size and chat latency: every note in the prompt vs. top-k retrieved chunks."""
+    import llm_utils
+    import retrieval
+
+    with tempfile.TemporaryDirectory() as folder, StubLLM() as llm:
+        _fresh_db(folder)
+        db.create_google_user("chat@example.com", "chat")
+        user_id = db.get_user("chat@example.com").id
+        for i in range(n_notes):
+            pdf_text = " ".join(f"topic{i} word{j % 500}" for j in range(pdf_words // 2)) if i % 3 == 0 else ""
+            db.create_note(user_id, f"Note {i}", f"Thoughts about topic{i} and lecture {i % 12}.", pdf_text=pdf_text)
+        asks = [f"What did I write about topic{i * 7}?" for i in range(questions)]
+
+        def legacy_context():
+            notes_context = "\n\nHere are all the user's notes:\n\n"
+            for _, title, content, _, _, pdf_text in db.get_user_notes(user_id):
+                if pdf_text:
+                    content = f"{content}\n\n--- PDF Content ---\n{pdf_text}"
+                notes_context += f"**{title}**\n{content}\n\n"
+            return notes_context
+
+        def retrieved_context(question):
+            chunks = db.search_note_chunks(user_id, retrieval.fts_query(question))
+            return retrieval.build_context(chunks or db.get_recent_note_chunks(user_id))
+
+        saved = llm_utils.CHAT_PROMPT_TOKENS
+        for label, make_context in (("all notes", lambda q: legacy_context()), ("retrieval", retrieved_context)):
+            # The legacy context is measured whole, not cut down to the prompt budget
+            llm_utils.CHAT_PROMPT_TOKENS = 10**9 if label == "all notes" else saved
+            llm.prompt_chars.clear()
+            start = time.perf_counter()
+            for question in asks:
+                llm_utils.chat_reply(question, [], notes_context=make_context(question))
+            llm_utils.CHAT_PROMPT_TOKENS = saved
+            per_turn = (time.perf_counter() - start) / questions * 1000
+            avg_tokens = sum(llm.prompt_chars) / len(llm.prompt_chars) / 4
+            print(f"  {label:<10} | ~{avg_tokens:>9.0f} prompt tokens | {per_turn:8.1f} ms per turn")
+
+
+@benchmark
+def chat_stream(turns=5, words=150):
+    """Time to first visible text: blocking chat_reply vs. chat_reply_stream."""
+    import llm_utils
+
+    reply = " ".join(f"word{i}" for i in range(words))
+    with StubLLM(base_ms=200, per_output_ms=10, reply=reply):
+        blocking = _time_per_call(lambda: llm_utils.chat_reply("hello"), turns)
+
+        first, total = [], []
+        for _ in range(turns):
+            timing = {}
+            text = "".join(llm_utils.chat_reply_stream("hello", timing=timing))
+            assert text.strip() == reply, text[:80]
+            first.append(timing["first_token_ms"])
+            total.append(timing["total_ms"])
+        print(f"  blocking : first text after {blocking:7.1f} ms")
+        print(f"  streaming: first text after {sum(first) / turns:7.1f} ms, done after {sum(total) / turns:7.1f} ms")
+
+
+@benchmark
+def chat_history(turns=100, reply_words=80):
+    """Prompt tokens per turn over a long conversation: whole history vs. summary + recent turns."""
+    import llm_utils
+
+    reply = " ".join(f"answer{i % 37}" for i in range(reply_words))
+    asks = [f"Question {i}: what did my notes say about topic{i} and how does it relate to the last answer?"
+            for i in range(turns)]
+    context = "\n\nRelevant excerpts from the user's notes:\n\n" + "\n\n".join(
+        f"Note {i}: " + " ".join(f"word{j}" for j in range(150)) for i in range(8))
+
+    with tempfile.TemporaryDirectory() as folder, StubLLM(base_ms=5, reply=reply) as llm:
+        _fresh_db(folder)
+        saved = llm_utils.CHAT_PROMPT_TOKENS, llm_utils.HISTORY_TOKENS
+        for label, memory in (("full history", None), ("compacted", {})):
+            if memory is None:
+                # No budget: every earlier message is sent again, as before
+                llm_utils.CHAT_PROMPT_TOKENS = llm_utils.HISTORY_TOKENS = 10**9
+            history, tokens = [], []
+            requests = llm.requests
+            start = time.perf_counter()
+            for ask in asks:
+                timing = {}
+                answer = "".join(llm_utils.chat_reply_stream(ask, history, notes_context=context,
+                                                             timing=timing, memory=memory))
+                tokens.append(timing["prompt_tokens"])
+                history += [{"role": "user", "content": ask}, {"role": "assistant", "content": answer}]
+            per_turn = (time.perf_counter() - start) / turns * 1000
+            llm_utils.CHAT_PROMPT_TOKENS, llm_utils.HISTORY_TOKENS = saved
+            summaries = llm.requests - requests - turns
+            print(f"  {label:<12} | turn 10: {tokens[9]:>6} | turn 50: {tokens[49]:>6} | turn {turns}: "
+                  f"{tokens[-1]:>6} tokens | total {sum(tokens):>8} | {summaries:>3} summary calls "
+                  f"| {per_turn:6.1f} ms per turn")
+
+
+@benchmark
+def prompt_cache(turns=30, big_notes=300):
+    """Cached prompt tokens: notes excerpts in the instructions vs. stable prefix first, per-turn content last."""
+    import llm_utils
+    import retrieval
+
+    def legacy_messages(message, history, notes_context, memory=None, notes=None):
+        # Before: instructions plus this turn's excerpts, then the history
+        return [{"role": "system", "content": llm_utils.CHAT_INSTRUCTIONS + notes_context},
+                *llm_utils.compact_history(history, memory), {"role": "user", "content": message}]
+
+    reply = " ".join(f"answer{i % 37}" for i in range(60))
+    asks = [f"What do my notes say about topic{i * 7 % big_notes} and lecture {i % 4}?" for i in range(turns)]
+    layout = llm_utils._chat_messages
+
+    with tempfile.TemporaryDirectory() as folder, StubLLM(base_ms=5, reply=reply):
+        _fresh_db(folder)
+        users = {}
+        # A handful of notes fits in retrieval.NOTES_PREFIX_TOKENS; hundreds don't
+        for label, n_notes in (("few notes", 6), ("many notes", big_notes)):
+            db.create_google_user(f"{n_notes}@example.com", label)
+            users[label] = db.get_user(f"{n_notes}@example.com").id
+            for i in range(n_notes):
+                words = " ".join(f"topic{i} lecture{i % 4} detail{j}" for j in range(40))
+                db.create_note(users[label], f"Note {i}", words)
+
+        for label, user_id in users.items():
+            for variant in ("legacy", "stable prefix"):
+                sent = []
+
+                def recording(*args, **kwargs):
+                    messages = (legacy_messages if variant == "legacy" else layout)(*args, **kwargs)
+                    sent.append(json.dumps(messages))
+                    return messages
+
+                llm_utils._chat_messages = recording
+                before = llm_utils.get_prompt_cache_stats()
+                history, memory = [], {}
+                try:
+                    for ask in asks:
+                        notes = db.get_notes_context(user_id).text if variant != "legacy" else None
+                        context = "" if notes else retrieval.build_context(
+                            db.search_note_chunks(user_id, retrieval.fts_query(ask)))
+                        answer = "".join(llm_utils.chat_reply_stream(ask, history, notes_context=context,
+                                                                     memory=memory, notes=notes or ""))
+                        history += [{"role": "user", "content": ask}, {"role": "assistant", "content": answer}]
+                finally:
+                    llm_utils._chat_messages = layout
+                after = llm_utils.get_prompt_cache_stats()
+
+                prompt = after["prompt_tokens"] - before["prompt_tokens"]
+                cached = after["cached_tokens"] - before["cached_tokens"]
+                shared = [len(os.path.commonprefix(pair)) // 4 for pair in zip(sent, sent[1:])]
+                same_system = all(json.loads(m)[0] == json.loads(sent[0])[0] for m in sent)
+                if variant != "legacy":
+                    assert same_system, f"{label}: the instructions changed between turns"
+                print(f"  {label:<10} | {variant:<13} | {prompt:>6} prompt tokens, {cached / prompt:6.1%} cached, "
+                      f"{prompt - cached:>6} uncached | ~{sum(shared) / len(shared):5.0f} shared with the previous "
+                      f"turn | same instructions every turn: {same_system}")
+
+
+@benchmark
+def notes_context(sizes=(10, 2_000, 10_000), repeat=50, writes=200):
+    """Notes part of a chat turn: reading and joining every note vs. the per-user notes context."""
+    import retrieval
+
+    for n_notes in sizes:
+        with tempfile.TemporaryDirectory() as folder:
+            _fresh_db(folder)
+            db.create_google_user("ctx@example.com", "ctx")
+            user_id = db.get_user("ctx@example.com").id
+            db.import_notes({"user_id": user_id, "title": f"Note {i}", "content": f"Short thoughts on topic{i}.",
+                             "pdf_text": "page text " * 300 if i % 10 == 0 else ""} for i in range(n_notes))
+
+            def rebuild():
+                rows = db.get_user_notes.__wrapped__(user_id)
+                return "\n\n".join(retrieval.note_entry(title, content, pdf_text or "")
+                                     for _, title, content, _, _, pdf_text in sorted(rows))
+
+            rebuild_ms = _time_per_call(rebuild, repeat)
+            start = time.perf_counter()
+            context = db.get_notes_context.__wrapped__(user_id)
+            build_ms = (time.perf_counter() - start) * 1000
+            lookup_ms = _time_per_call(lambda: db.get_notes_context.__wrapped__(user_id), repeat)
+            cached_ms = _time_per_call(lambda: db.get_notes_context(user_id), repeat)
+
+            # What keeping it up to date adds to each note write
+            start = time.perf_counter()
+            for i in range(writes):
+                db.delete_note(db.create_note(user_id, f"Extra {i}", "More thoughts."), user_id)
+            write_ms = (time.perf_counter() - start) / writes * 1000
+            assert db.get_notes_context(user_id) == context
+
+            sent = "whole" if context.text is not None else "retrieved"
+            print(f"  {n_notes:>6} notes (~{context.tokens:>8} tokens, {sent:>9}) | rebuild {rebuild_ms:8.2f} ms "
+                  f"| lookup {lookup_ms:6.3f} ms | cached {cached_ms:6.4f} ms | first build {build_ms:8.2f} ms "
+                  f"| create+delete {write_ms:5.2f} ms")
+
+
+@benchmark
+def llm_client(calls=200):
+    """Per-call overhead against a zero-latency mock: new client per call vs. the shared pooled client."""
+    import llm_utils
+    from openai import OpenAI
+
+    with StubLLM(base_ms=0, per_token_ms=0):
+        def fresh_client_call():
+            client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+            client.chat.completions.create(model=llm_utils.MODEL, messages=[{"role": "user", "content": "hi"}])
+            client.close()
+
+        before = _time_per_call(fresh_client_call, calls)
+        after = _time_per_call(lambda: llm_utils._basic_call("system", "hi"), calls)
+        print(f"  new client per call: {before:7.3f} ms | shared client: {after:7.3f} ms")
+
+
+@benchmark
+def llm_cache(repeat=20):
+    """Repeated analysis of the same note: first call goes to the (stub) API, the rest hit the cache."""
+    import llm_utils
+
+    with tempfile.TemporaryDirectory() as folder, StubLLM(base_ms=300, reply="a, b, c") as llm:
+        _fresh_db(folder)
+        text = "Notes from the lecture on distributed systems. " * 20
+
+        def analyze():
+            llm_utils.summarize_text(text)
+            llm_utils.analyze_sentiment(text)
+            llm_utils.extract_keywords(text)
+
+        first = _time_per_call(analyze, 1)
+        again = _time_per_call(analyze, repeat)
+        stats = llm_utils.get_cache_stats()
+        print(f"  first analysis {first:8.1f} ms | repeated {again:6.2f} ms | API requests {llm.requests}")
+        print(f"  hits {stats['hits']} ({stats['avg_hit_ms']:.2f} ms) | misses {stats['misses']} ({stats['avg_miss_ms']:.1f} ms)")
+
+
+@benchmark
+def batch_analysis(n_notes=40, latency_ms=100):
+    """Analyzing a notebook: 3 sequential calls per note vs. the async batch engine."""
+    import batch_analysis as batch
+    import llm_utils
+
+    reply = json.dumps({"summary": "A note.", "sentiment": "neutral", "keywords": ["notes", "stub"]})
+    with tempfile.TemporaryDirectory() as folder, StubLLM(base_ms=latency_ms, reply=reply) as llm:
+        _fresh_db(folder)
+        db.create_google_user("batch@example.com", "batch")
+        user_id = db.get_user("batch@example.com").id
+        for i in range(n_notes):
+            db.create_note(user_id, f"Note {i}", f"Content of note number {i}.")
+
+        start = time.perf_counter()
+        for _, title, content, _ in db.get_notes_to_analyze(user_id):
+            text = f"{title}\n\n{content}"
+            llm_utils.summarize_text(text)
+            llm_utils.analyze_sentiment(text)
+            llm_utils.extract_keywords(text)
+        sequential = time.perf_counter() - start
+        sequential_requests = llm.requests
+
+        # Rate limit high enough that only concurrency and latency matter
+        stats = batch.analyze_user_notes(user_id, requests_per_minute=60_000)
+        print(f"  {n_notes} notes, {latency_ms} ms per request")
+        print(f"  sequential: {sequential:6.2f} s, {sequential_requests} requests, {n_notes / sequential:6.1f} notes/s")
+        print(f"  batch     : {stats['seconds']:6.2f} s, {stats['requests']} requests, "
+              f"{stats['analyzed'] / stats['seconds']:6.1f} notes/s ({stats['failed']} failed)")
+        again = batch.analyze_user_notes(user_id, only_missing=False)
+        print(f"  re-run    : {again['seconds']:6.2f} s, {again['cached']} served from cache")
+
+
+@benchmark
+def search(n_notes=1_000_000, repeat=20):
+    """Full-text search latency over a large notes table (per user and across all users)."""
+    import random
+
+    rng = random.Random(42)
+    vocab = [f"term{n}" for n in range(20_000)]
+
+    def content(i):
+        # Zipf-ish: a few common words, a long tail of rare ones
+        return " ".join(vocab[min(int(rng.paretovariate(1.1)) * 7 % len(vocab), len(vocab) - 1)] for _ in range(30))
+
+    with tempfile.TemporaryDirectory() as folder:
+        _fresh_db(folder)
+        start = time.perf_counter()
+        user_ids = _seed_notes(n_notes, content=content)
+        print(f"  seeded {n_notes} notes (FTS kept in sync by triggers) in {time.perf_counter() - start:.1f} s")
+
+        cases = (
+            ("common term", "term7"),           # in almost every note
+            ("two words", "term7 term14"),
+            ("typing a word", "term7 term70"),  # the last word is a prefix
+            ("rare term", "term14007"),
+            ("short prefix", "ter"),            # every word of the vocabulary
+            ("too short", "te"),                # not searched at all
+        )
+        for label, query in cases:
+            per_user = _time_per_call(lambda: db.search_notes.__wrapped__(user_ids[0], query), repeat)
+            everyone = _time_per_call(lambda: db.search_notes.__wrapped__(None, query), repeat)
+            found = len(db.search_notes.__wrapped__(None, query))
+            print(f"  {label:<13} {query!r:<15} | one user {per_user:8.2f} ms | all users {everyone:8.2f} ms | "
+                  f"{found} results")
+            record(f"{label}, one user", per_user)
+            record(f"{label}, all users", everyone)
+
+
+@benchmark
+def read_cache(n_notes=20_000, n_sessions=8, reruns=200, write_every=25):
+    """Script reruns served by the read cache vs. querying SQLite every time."""
+    with tempfile.TemporaryDirectory() as folder:
+        _fresh_db(folder)
+        user_ids = _seed_notes(n_notes, n_users=n_sessions)
+
+        def rerun(session, j, cached):
+            # What one rerun of app.py reads: the user's page, everyone's page, AI results
+            user_page = db.get_user_notes_page if cached else db.get_user_notes_page.__wrapped__
+            all_page = db.get_all_notes_page if cached else db.get_all_notes_page.__wrapped__
+            analyses = db.get_note_analyses if cached else db.get_note_analyses.__wrapped__
+            rows, _ = user_page(user_ids[session])
+            all_page()
+            analyses([row[0] for row in rows])
+            # Now and then somebody saves a note, which invalidates the listings
+            if j % write_every == write_every - 1:
+                db.create_note(user_ids[session], f"new {j}", "fresh content")
+
+        uncached = _run_sessions(n_sessions, reruns, lambda i, j: rerun(i, j, False))
+        before = db.get_read_cache_stats()
+        cached = _run_sessions(n_sessions, reruns, lambda i, j: rerun(i, j, True))
+        after = db.get_read_cache_stats()
+        hits, misses = after["hits"] - before["hits"], after["misses"] - before["misses"]
+        print(f"  {n_sessions} sessions, a note saved every {write_every} reruns")
+        print(f"  reruns/s: {uncached:8.0f} uncached -> {cached:8.0f} cached "
+              f"({hits / (hits + misses):.0%} hit rate, {misses} misses)")
+        for name, counts in after["by_function"].items():
+            if counts["hits"] or counts["misses"]:
+                print(f"    {name:<22} {counts['hits']:>6} hits {counts['misses']:>6} misses")
+
+
+# Rerunning a single region with AppTest: a tiny script that calls only that fragment
+_FRAGMENT_SCRIPT = """
+import streamlit as st
+import notes_ui
+{call}
+"""
+
+
+@benchmark
+def rerun_latency(n_notes=200, n_pdfs=5, repeat=10):
+    """Latency of one interaction: whole-app rerun vs. rerunning only the fragment it belongs to."""
+    import statistics
+
+    import pdf_store
+    from streamlit.testing.v1 import AppTest
+
+    with tempfile.TemporaryDirectory() as folder:
+        _fresh_db(folder)
+        pdf_store.PDF_DIR = os.path.join(folder, "pdfs")
+        db.create_google_user("ui@example.com", "UI")
+        user_id = db.get_user("ui@example.com").id
+        user = {"id": user_id, "email": "ui@example.com", "name": "UI", "method": "google"}
+        for i in range(n_notes):
+            db.create_note(user_id, f"Note {i}", "Some words about the lecture. " * (30 if i % 3 == 0 else 2))
+        pdf_ids, pdf_paths = [], []
+        for i in range(n_pdfs):
+            path = os.path.join(folder, f"doc{i}.pdf")
+            make_pdf(path, 20, tag=str(i))
+            with open(path, "rb") as f:
+                data = f.read()
+            digest, stored = pdf_store.put(data)
+            pdf_ids.append(db.create_note(user_id, f"PDF {i}", "slides", stored, pdf_hash=digest,
+                                          pdf_name=f"doc{i}.pdf", pdf_size=len(data)))
+            pdf_paths.append(stored)
+        long_note = db.get_user_notes_page(user_id, page_size=n_notes)[0][-1]
+
+        def timed(at, state: dict) -> float:
+            """Median milliseconds of at.run() with the given widget state."""
+            times = []
+            for _ in range(repeat):
+                for key, value in state.items():
+                    at.session_state[key] = value
+                start = time.perf_counter()
+                at.run()
+                times.append((time.perf_counter() - start) * 1000)
+                if at.exception:
+                    raise RuntimeError(at.exception[0].value)
+            return statistics.median(times)
+
+        def whole_app(state: dict) -> float:
+            at = AppTest.from_file(os.path.abspath("app.py"), default_timeout=60)
+            at.session_state["user"] = user
+            # Previews that are open elsewhere on the page get re-encoded by full reruns
+            for note_id in pdf_ids:
+                at.session_state[f"preview_{note_id}"] = True
+            return timed(at, state)
+
+        def fragment(call: str, state: dict) -> float:
+            at = AppTest.from_string(_FRAGMENT_SCRIPT.format(call=call), default_timeout=60)
+            at.session_state["user"] = user
+            return timed(at, state)
+
+        interactions = [
+            ("type in the note title", {}, None),
+            ("show a full note", {f"my_full_{long_note[0]}": True},
+             f"notes_ui.show_note_body({long_note[0]}, {long_note[2]!r}, 'my')"),
+            ("toggle a PDF preview", {f"preview_{pdf_ids[0]}": True},
+             f"notes_ui.show_pdf_preview({pdf_ids[0]}, {pdf_paths[0]!r})"),
+            ("search my notes", {"my_search": "lecture"}, "notes_ui.my_notes_view(st.session_state['user'])"),
+            ("load more (all notes)", {"all_notes_pages": 2}, "notes_ui.all_notes_view()"),
+        ]
+        print(f"  {n_notes + n_pdfs} notes, {n_pdfs} PDF previews open, median of {repeat} runs")
+        for label, state, call in interactions:
+            before = whole_app(state)
+            if call is None:
+                # Inside st.form: typing doesn't rerun anything until Save
+                print(f"  {label:<24} {before:8.1f} ms -> no rerun (form)")
+                continue
+            after = fragment(call, state)
+            print(f"  {label:<24} {before:8.1f} ms -> {after:6.1f} ms")
+
+
+@benchmark
+def auth(sessions=(1, 4, 16), logins=4, rounds=10):
+    """Concurrent logins: bcrypt on the script threads vs. the hashing process pool."""
+    import statistics
+
+    import bcrypt
+    import passwords
+
+    passwords.BCRYPT_ROUNDS = rounds
+    with tempfile.TemporaryDirectory() as folder:
+        _fresh_db(folder)
+        for i in range(max(sessions)):
+            db.create_user(f"login{i}@example.com", "correct horse")
+
+        def inline_login(i, j):
+            # What verify_user did before: checkpw on the calling thread
+            with db._conn() as con:
+                stored = con.execute("SELECT password FROM users WHERE email = ?", (f"login{i}@example.com",)).fetchone()[0]
+            bcrypt.checkpw(b"correct horse", stored)
+
+        def pooled_login(i, j):
+            db.verify_user(f"login{i}@example.com", "correct horse")
+
+        def with_probe(n, login):
+            """Logins/s, plus the p95 of a cheap rerun another session does meanwhile."""
+            stop = threading.Event()
+            rerun_ms = []
+
+            def other_session():
+                while not stop.is_set():
+                    start = time.perf_counter()
+                    sum(range(20_000))  # a few ms of Python, like rendering a page
+                    rerun_ms.append((time.perf_counter() - start) * 1000)
+                    time.sleep(0.005)
+
+            probe = threading.Thread(target=other_session)
+            probe.start()
+            try:
+                rate = _run_sessions(n, logins, login)
+            finally:
+                stop.set()
+                probe.join()
+            return rate, statistics.quantiles(rerun_ms, n=20)[-1]
+
+        pooled_login(0, 0)  # start the worker processes
+        print(f"  bcrypt cost {rounds}, {passwords.MAX_WORKERS} hashing worker(s)")
+        for n in sessions:
+            inline_rate, inline_p95 = with_probe(n, inline_login)
+            pooled_rate, pooled_p95 = with_probe(n, pooled_login)
+            print(f"  {n:>3} sessions | logins/s {inline_rate:6.1f} -> {pooled_rate:6.1f} | "
+                  f"other session's rerun p95 {inline_p95:7.1f} -> {pooled_p95:6.1f} ms")
+
+
+@benchmark
+def login_path(n_users=1000, repeat=500):
+    """Database work of one login: SELECT * lookups before vs. typed User records."""
+    import bcrypt
+    import passwords
+
+    passwords.BCRYPT_ROUNDS = 4  # cheapest bcrypt, so the queries are what's measured
+    with tempfile.TemporaryDirectory() as folder:
+        _fresh_db(folder)
+        stored = bcrypt.hashpw(b"pw", bcrypt.gensalt(4))
+        with db._conn(write=True) as con:
+            con.executemany("INSERT INTO users (email, password) VALUES (?, ?)",
+                            ((f"user{i}@example.com", stored) for i in range(n_users)))
+            con.executemany("INSERT INTO users (email, name, method) VALUES (?, ?, 'google')",
+                            ((f"g{i}@example.com", f"G {i}") for i in range(n_users)))
+
+        def select_star(email):
+            with db._conn() as con:
+                return con.execute("SELECT * FROM users WHERE email = ?", (email,)).fetchone()
+
+        # --- before: verify_user looked the row up, then login_view fetched it again ---
+        def old_password_login(i):
+            email = f"user{i % n_users}@example.com"
+            row = select_star(email)
+            if passwords.check_password("pw", row[2]):
+                row = select_star(email)
+                return {"id": row[0], "email": row[1], "name": row[4] or row[1], "method": row[5] or "manual"}
+
+        def old_google_login(i, first_time=False):
+            email = f"new{i}@example.com" if first_time else f"g{i % n_users}@example.com"
+            row = select_star(email)
+            if not row:
+                db.create_google_user(email, email)
+                row = select_star(email)
+            return {"id": row[0], "email": row[1], "name": row[4] or row[1], "method": row[5] or "google"}
+
+        # --- after: one query per login ---
+        def new_password_login(i):
+            return db.verify_user(f"user{i % n_users}@example.com", "pw")
+
+        def new_google_login(i, first_time=False):
+            email = f"new{i}@example.com" if first_time else f"g{i % n_users}@example.com"
+            return db.upsert_google_user(email, email)
+
+        def count_statements(fn) -> int:
+            statements = []
+            connections = _traced(db._get_pool(), statements)
+            try:
+                fn(next(counter))
+            finally:
+                for con in connections:
+                    con.set_trace_callback(None)
+            return len([s for s in statements if not s.startswith(("BEGIN", "COMMIT"))])
+
+        counter = iter(range(10**9))
+
+        def first_time(login):
+            return lambda i: login(i, first_time=True)
+
+        for label, old, new in (("password login", old_password_login, new_password_login),
+                                ("google, returning", old_google_login, new_google_login),
+                                ("google, first time", first_time(old_google_login), first_time(new_google_login))):
+            old_ms = _time_per_call(lambda: old(next(counter)), repeat)
+            new_ms = _time_per_call(lambda: new(next(counter)), repeat)
+            print(f"  {label:<18} {count_statements(old)} -> {count_statements(new)} queries | "
+                  f"{old_ms:6.3f} -> {new_ms:6.3f} ms")
+
+
+class StubUserinfo:
+    """
+    Local stand-in for Google's userinfo endpoint: answers every GET after
+    latency_ms, the first `failures` of them with a 503.
+    """
+
+    def __init__(self, latency_ms: float = 50, failures: int = 0):
+        self.requests = 0
+        self.connections = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                stub.connections += 1
+
+            def do_GET(self):
+                stub.requests += 1
+                time.sleep(latency_ms / 1000)
+                failed = stub.requests <= failures
+                token = self.headers["Authorization"].split()[-1]
+                payload = json.dumps({"email": f"{token}@example.com", "name": token}).encode()
+                self.send_response(503 if failed else 200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/oauth2/v2/userinfo"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+
+
+def _fake_id_token(email: str, client_id: str) -> str:
+    """Unsigned JWT with the claims oauth_utils reads (the signature part is ignored)."""
+    import base64
+
+    def part(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+
+    claims = {"iss": "https://accounts.google.com", "aud": client_id, "exp": time.time() + 3600,
+              "email": email, "name": email.split("@")[0]}
+    return f"{part({'alg': 'RS256'})}.{part(claims)}.signature"
+
+
+@benchmark
+def google_userinfo(logins=50, latency_ms=50):
+    """Resolving a Google login: fresh request each time vs. pooled session, cache and ID token."""
+    import requests
+    import oauth_utils
+
+    with StubUserinfo(latency_ms=latency_ms) as stub:
+        oauth_utils.USERINFO_URL = stub.url
+
+        def fresh_connection(i):
+            # What fetch_google_user_info did before
+            requests.get(stub.url, headers={"Authorization": f"Bearer t{i}"}, timeout=5).json()
+
+        def per_login_ms(resolve) -> tuple[float, int]:
+            before = stub.connections
+            ms = _time_per_call(lambda: resolve(next(counter)), logins)
+            return ms, stub.connections - before
+
+        counter = iter(range(10**9))
+        rows = [
+            ("before: requests.get", fresh_connection),
+            ("pooled session", lambda i: oauth_utils.google_user_info({"access_token": f"t{i}"})),
+            ("same token again", lambda i: oauth_utils.google_user_info({"access_token": "t0"})),
+            ("ID token, no request", lambda i: oauth_utils.google_user_info(
+                {"access_token": f"t{i}", "id_token": _fake_id_token(f"u{i}@example.com", "client")}, "client")),
+        ]
+        print(f"  {logins} logins, userinfo answers after {latency_ms} ms")
+        for label, resolve in rows:
+            ms, connections = per_login_ms(resolve)
+            print(f"  {label:<22} {ms:7.2f} ms per login, {connections:>3} new connections")
+        print(f"  {oauth_utils.get_stats()}")
+
+    with StubUserinfo(latency_ms=0, failures=2) as flaky:
+        oauth_utils.USERINFO_URL = flaky.url
+        info = oauth_utils.google_user_info({"access_token": "retry"})
+        print(f"  two 503s then OK: got {info.get('email')!r} after {flaky.requests} requests")
+
+
+@benchmark
+def bulk_import(n_notes=1_000_000, n_single=5_000):
+    """Notes/second: create_note one at a time vs. bulk.py's batched import, plus streaming export."""
+    import bulk
+
+    with tempfile.TemporaryDirectory() as folder:
+        _fresh_db(folder)
+        db.create_google_user("bulk@example.com", "Bulk")
+        user_id = db.get_user("bulk@example.com").id
+
+        start = time.perf_counter()
+        for i in range(n_single):
+            db.create_note(user_id, f"Single {i}", f"Imported the slow way, note {i}.")
+        single_rate = n_single / (time.perf_counter() - start)
+
+        source = os.path.join(folder, "notes.jsonl")
+        with open(source, "w", encoding="utf-8") as f:
+            for i in range(n_notes):
+                f.write(json.dumps({"title": f"Note {i}", "content": f"Lecture notes number {i} about cells.",
+                                    "created_at": f"2024-01-01 00:00:{i % 60:02d}"}) + "\n")
+
+        start = time.perf_counter()
+        imported = bulk.import_source(source, user_id)
+        bulk_rate = imported / (time.perf_counter() - start)
+        print(f"  create_note x {n_single}: {single_rate:9.0f} notes/s")
+        print(f"  bulk import x {imported}: {bulk_rate:9.0f} notes/s (batches of {db.IMPORT_BATCH_SIZE})")
+
+        start = time.perf_counter()
+        with open(os.devnull, "w", encoding="utf-8") as out:
+            exported = bulk.export_jsonl(out, user_id)
+        print(f"  export x {exported}: {exported / (time.perf_counter() - start):9.0f} notes/s")
+
+
+@benchmark
+def delete_account(n_notes=100_000, n_pdfs=500, pdf_bytes=200_000):
+    """Deleting a 100k-note account: one transaction vs. batches, then PDF cleanup and incremental vacuum."""
+    import maintenance
+    import pdf_store
+
+    for label, batch_size in (("one transaction", 10**9), (f"batches of {db.DELETE_BATCH_SIZE}", db.DELETE_BATCH_SIZE)):
+        with tempfile.TemporaryDirectory() as folder:
+            _fresh_db(folder)
+            pdf_store.PDF_DIR = os.path.join(folder, "pdfs")
+            db.create_google_user("heavy@example.com", "heavy")
+            db.create_google_user("other@example.com", "other")
+            heavy = db.get_user("heavy@example.com").id
+            other = db.get_user("other@example.com").id
+
+            pdfs = [pdf_store.put(os.urandom(pdf_bytes)) for _ in range(n_pdfs)]
+            db.import_notes(
+                {"user_id": heavy, "title": f"Note {i}", "content": f"Lecture notes number {i} about cells. " * 5,
+                 **({"pdf_hash": pdfs[i // 5][0], "pdf_path": pdfs[i // 5][1], "pdf_size": pdf_bytes,
+                     "pdf_name": "x.pdf", "pdf_text": f"page text {i}"} if i < n_pdfs * 5 else {})}
+                for i in range(n_notes))
+            size_before = os.path.getsize(db.DB_PATH)
+
+            # Another session keeps saving notes meanwhile; its slowest save shows how long writes stall
+            stalls, done = [], threading.Event()
+
+            def other_session():
+                while not done.is_set():
+                    start = time.perf_counter()
+                    db.create_note(other, "meanwhile", "still here")
+                    stalls.append((time.perf_counter() - start) * 1000)
+                    time.sleep(0.005)
+
+            writer = threading.Thread(target=other_session)
+            writer.start()
+            start = time.perf_counter()
+            assert db.delete_user(heavy, batch_size)
+            delete_s = time.perf_counter() - start
+            done.set()
+            writer.join()
+
+            start = time.perf_counter()
+            files, freed = maintenance.collect_pdfs(grace_seconds=0)
+            vacuumed = maintenance.reclaim_space()
+            cleanup_s = time.perf_counter() - start
+            print(f"  {label:<19} | delete {delete_s:6.2f} s | other session's slowest save {max(stalls):7.1f} ms "
+                  f"| cleanup {cleanup_s:5.2f} s: {files} PDFs ({freed / 1e6:.0f} MB), {vacuumed / 1e6:.0f} MB of "
+                  f"database pages | app.db {size_before / 1e6:.0f} -> {os.path.getsize(db.DB_PATH) / 1e6:.0f} MB")
+
+
+@benchmark
+def app_flows(n_notes=10_000, n_users=50, repeat=10, seed=0, rounds=4, llm_ms=50):
+    """The app clicked through like a browser (AppTest): login, listing, new note, delete, search, chat."""
+    import passwords
+    import pdf_store
+    from streamlit.testing.v1 import AppTest
+
+    # Logging in should time the app, not bcrypt's deliberate cost (the auth benchmark covers that)
+    passwords.BCRYPT_ROUNDS = rounds
+    reply = " ".join(f"word{i}" for i in range(60))
+    with tempfile.TemporaryDirectory() as folder, StubLLM(base_ms=llm_ms, reply=reply):
+        pdf_store.PDF_DIR = os.path.join(folder, "pdfs")
+        start = time.perf_counter()
+        user = seed_app_db(folder, n_users, n_notes, seed)
+        print(f"  seeded {n_notes} notes of {n_users} users in {time.perf_counter() - start:.1f} s; "
+              f"bcrypt cost {rounds}, stub LLM answers after {llm_ms} ms")
+
+        def app(session_user=None):
+            at = AppTest.from_file(os.path.abspath("app.py"), default_timeout=60)
+            if session_user:
+                at.session_state["user"] = session_user
+            return at
+
+        def timed(action) -> float:
+            """Milliseconds of action(), which reruns the app (and returns the AppTest)."""
+            start = time.perf_counter()
+            at = action()
+            elapsed = (time.perf_counter() - start) * 1000
+            if at.exception:
+                raise RuntimeError(at.exception[0].value)
+            return elapsed
+
+        def widget(widgets, label: str):
+            return next(w for w in widgets if w.label == label)
+
+        app().run()  # the first run imports the app's modules
+        login_page, login = [], []
+        for _ in range(repeat):
+            at = app()
+            login_page.append(timed(at.run))
+            at.text_input(key="li_email").set_value(SEED_EMAIL)
+            at.text_input(key="li_pwd").set_value(SEED_PASSWORD)
+            login.append(timed(widget(at.button, "Login").click().run))
+            assert at.session_state["user"]["id"] == user["id"], "login failed"
+        _report("login page", login_page)
+        _report("log in", login)
+        _report("open app (logged in)", [timed(app(user).run) for _ in range(repeat)])
+
+        at = app(user)
+        at.run()
+        load_more = []
+        for _ in range(repeat):
+            at.session_state["all_notes_pages"] = 1
+            load_more.append(timed(at.button(key="all_notes_pages_more").click().run))
+        _report("load more (all notes)", load_more)
+
+        create, delete = [], []
+        for i in range(repeat):
+            widget(at.text_input, "Title").set_value(f"Bench note {i}")
+            widget(at.text_area, "Content/Description").set_value(f"Written by the benchmark, note {i}.")
+            create.append(timed(widget(at.button, "Save Note").click().run))
+        assert db.get_user_notes_page(user["id"])[0][0][1] == f"Bench note {repeat - 1}", "note not saved"
+        for _ in range(repeat):
+            newest = db.get_user_notes_page(user["id"])[0][0][0]
+            delete.append(timed(at.button(key=f"del_{newest}").click().run))
+            assert db.get_note_content(newest) is None, "note not deleted"
+        _report("save a note", create)
+        _report("delete a note", delete)
+
+        search = [timed(at.text_input(key="my_search").set_value(_WORDS[i % len(_WORDS)]).run)
+                  for i in range(repeat)]
+        at.text_input(key="my_search").set_value("").run()
+        _report("search my notes", search)
+
+        at.chat_input[0].set_value("Hello").run()  # the first turn creates the LLM client
+        chat = [timed(at.chat_input[0].set_value(f"What do my notes say about {_WORDS[i % len(_WORDS)]}?").run)
+                for i in range(repeat)]
+        assert at.session_state["chat_history"][-1]["content"].strip() == reply, "no chat reply"
+        _report("chat turn", chat)
+
+
+@benchmark
+def db_functions(n_notes=10_000, n_users=50, repeat=20, seed=0, rounds=4):
+    """Every public db.py function on a seeded database; cached reads also without the read cache."""
+    from itertools import count
+
+    import passwords
+    import pdf_store
+    import retrieval
+
+    passwords.BCRYPT_ROUNDS = rounds
+    with tempfile.TemporaryDirectory() as folder:
+        pdf_store.PDF_DIR = os.path.join(folder, "pdfs")
+        user = seed_app_db(folder, n_users, n_notes, seed)
+        user_id = user["id"]
+        note_ids = [note[0] for note in db.get_user_notes_page(user_id)[0]]
+        pdf_path = os.path.join(folder, "slides.pdf")
+        pdf_text = " ".join(_WORDS * 100)
+        numbers = count()
+        heavy = max(1, repeat // 5)
+        covered = set()
+        print(f"  {n_notes} notes of {n_users} users, bcrypt cost {rounds}, {repeat} calls each ({heavy} for the slow ones)")
+
+        def run(label, fn, args=(), prepare=None, calls=repeat, covers=None):
+            prepare = prepare or (lambda: args)
+            fn(*prepare())  # warm up (and fill the read cache)
+            _report(label, _timings(fn, calls, prepare))
+            covered.add(covers or fn.__name__)
+
+        def cached(fn, *args, calls=repeat):
+            run(f"{fn.__name__} (query)", fn.__wrapped__, args, calls=calls)
+            run(f"{fn.__name__} (cached)", fn, args, calls=calls)
+
+        def new_note():
+            return db.create_note(user_id, "Scratch", "Deleted again right away.")
+
+        def waiting_pdf_note():
+            return db.create_note(user_id, "Slides", "slides", pdf_path, pdf_status="processing",
+                                  pdf_hash="bench-pdf", pdf_name="slides.pdf", pdf_size=1)
+
+        def user_with_notes():
+            email = f"leaving{next(numbers)}@example.com"
+            db.create_google_user(email, "Leaving")
+            leaving = db.get_user(email).id
+            db.import_notes({"user_id": leaving, "title": f"Note {i}", "content": pdf_text[:400]} for i in range(200))
+            return (leaving,)
+
+        run("init_db", db.init_db)
+        run("create_user", db.create_user, prepare=lambda: (f"new{next(numbers)}@example.com", SEED_PASSWORD))
+        run("add_user", db.add_user, prepare=lambda: (f"new{next(numbers)}@example.com", SEED_PASSWORD))
+        run("create_google_user", db.create_google_user, prepare=lambda: (f"g{next(numbers)}@example.com", "G"))
+        run("upsert_google_user", db.upsert_google_user, ("user1@example.com", "User 1"))
+        run("get_user", db.get_user, (SEED_EMAIL,))
+        run("verify_user", db.verify_user, (SEED_EMAIL, SEED_PASSWORD))
+        run("update_password", db.update_password, (user_id, SEED_PASSWORD))
+
+        run("create_note", db.create_note, (user_id, "Scratch", "A new note from the benchmark."))
+        run("delete_note", db.delete_note, prepare=lambda: (new_note(), user_id))
+        cached(db.get_notes_context, user_id)
+        run("set_pdf_progress", db.set_pdf_progress, (note_ids[0], 3, 10))
+        run("finish_pdf_ingest", db.finish_pdf_ingest, prepare=lambda: (waiting_pdf_note(), pdf_text))
+        run("use_cached_pdf_text", db.use_cached_pdf_text, prepare=lambda: (waiting_pdf_note(),))
+        run("get_pdf_store_stats", db.get_pdf_store_stats)
+        run("get_pdf_status", db.get_pdf_status, (note_ids[0],))
+        run("get_pending_pdf_notes", db.get_pending_pdf_notes)
+
+        cached(db.get_user_notes, user_id)
+        cached(db.get_note_content, note_ids[0])
+        cached(db.get_all_notes, calls=heavy)
+        run("search_note_chunks", db.search_note_chunks, (user_id, retrieval.fts_query("membrane energy")))
+        run("get_recent_note_chunks", db.get_recent_note_chunks, (user_id,))
+        cached(db.get_user_notes_page, user_id)
+        cached(db.get_all_notes_page)
+        cached(db.search_notes, user_id, "membrane")
+        run("search_notes (all users, query)", db.search_notes.__wrapped__, (None, "membrane"))
+
+        batch = [{"user_id": user_id, "title": f"Imported {i}", "content": pdf_text[:400]} for i in range(100)]
+        run("import_notes (100 notes)", db.import_notes, (batch,), calls=heavy)
+        run("export_notes (one user)", lambda: sum(1 for _ in db.export_notes(user_id)), covers="export_notes")
+
+        run("get_notes_to_analyze", db.get_notes_to_analyze, (user_id,))
+        run("save_note_analysis", db.save_note_analysis, (note_ids[0], "A summary.", "neutral", ["cells"]))
+        cached(db.get_note_analyses, note_ids)
+        run("put_cached_response", db.put_cached_response, ("bench-key", "An answer.", 3600, 1000))
+        run("get_cached_response", db.get_cached_response, ("bench-key", 3600))
+        run("clear_read_cache", db.clear_read_cache)
+        run("get_read_cache_stats", db.get_read_cache_stats)
+
+        run("delete_user (200 notes)", db.delete_user, prepare=user_with_notes, calls=heavy)
+        run("release_orphan_pdfs", db.release_orphan_pdfs, (200, 0))
+        run("get_referenced_pdf_paths", db.get_referenced_pdf_paths)
+        run("get_free_pages", db.get_free_pages)
+        run("incremental_vacuum", db.incremental_vacuum, (2048,))
+        run("vacuum", db.vacuum, calls=heavy)
+
+        public = {name for name, fn in inspect.getmembers(db, inspect.isfunction)
+                  if fn.__module__ == db.__name__ and not name.startswith("_")}
+        if missing := sorted(public - covered):
+            print(f"  not benchmarked yet: {', '.join(missing)}")
+
+
+class _Tee:
+    """Writes to a stream and keeps a copy (a benchmark's output for the report)."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.copy = io.StringIO()
+
+    def write(self, text):
+        self.copy.write(text)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def _git_commit() -> str | None:
+    """The commit this checkout is at, with "-dirty" if tracked files changed; None outside git."""
+    import subprocess
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=here,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        changed = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=here,
+                                 capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if changed else "")
+
+
+def compare(baseline: dict, report: dict, threshold: float) -> list[str]:
+    """
+    Print each recorded metric next to its value in an earlier report and
+    return those more than threshold percent worse. Times are better lower,
+    rates (units ending in "/s") higher; differences under NOISE_MS don't
+    count. Benchmarks that ran with other parameters are skipped.
+    """
+    print(f"Compared with {baseline.get('commit')} of {baseline.get('created_at')}:")
+    worse = []
+    for name, result in report["benchmarks"].items():
+        before = baseline.get("benchmarks", {}).get(name)
+        if before is None:
+            continue
+        if before["params"] != result["params"]:
+            print(f"  [{name}] ran with other parameters, not compared")
+            continue
+        for metric, now in result["metrics"].items():
+            old = before["metrics"].get(metric)
+            if not old or not old["value"]:
+                continue
+            change = (now["value"] - old["value"]) / old["value"] * 100
+            regression = -change if now["unit"].endswith("/s") else change
+            flag = ""
+            if regression > threshold and not (now["unit"] == "ms" and abs(change * old["value"] / 100) < NOISE_MS):
+                worse.append(f"{name}: {metric}")
+                flag = "  << worse"
+            print(f"  [{name}] {metric:<44} {old['value']:10.3f} -> {now['value']:10.3f} {now['unit']:<5} "
+                  f"{change:+7.1f}%{flag}")
+    return worse
+
+
+def main(argv):
+    global _current
+    parser = argparse.ArgumentParser(prog="bench.py", description="Benchmarks for the app's hot paths.")
+    parser.add_argument("names", nargs="*", metavar="benchmark",
+                        help=f"what to run (default: everything): {', '.join(BENCHMARKS)}")
+    parser.add_argument("--notes", type=int, help="n_notes of every benchmark that has one (database size)")
+    parser.add_argument("--users", type=int, help="n_users of every benchmark that has one")
+    parser.add_argument("--repeat", type=int, help="timed calls per measurement, where a benchmark takes it")
+    parser.add_argument("--seed", type=int, help="random seed of the seeded database")
+    parser.add_argument("--json", metavar="PATH", help="write the results to PATH as JSON")
+    parser.add_argument("--compare", metavar="PATH", help="compare the results with an earlier --json report")
+    parser.add_argument("--threshold", type=float, default=20,
+                        help="with --compare: exit with status 1 if a metric got this many percent worse (default 20)")
+    args = parser.parse_args(argv)
+
+    names = args.names or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"Unknown benchmark: {name}. Choose from: {', '.join(BENCHMARKS)}")
+            return 1
+
+    overrides = {"n_notes": args.notes, "n_users": args.users, "repeat": args.repeat, "seed": args.seed}
+    report = {
+        "commit": _git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "benchmarks": {},
+    }
+    for name in names:
+        fn = BENCHMARKS[name]
+        params = {key: p.default for key, p in inspect.signature(fn).parameters.items()}
+        params.update({key: value for key, value in overrides.items() if key in params and value is not None})
+        print(f"[{name}] {fn.__doc__}")
+        _current = name
+        out = _Tee(sys.stdout)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(out):
+            fn(**params)
+        report["benchmarks"][name] = {
+            "params": json.loads(json.dumps(params)),   # tuples as lists, as read back from a file
+            "seconds": round(time.perf_counter() - start, 3),
+            "metrics": RESULTS.get(name, {}),
+            "output": out.copy.getvalue().splitlines(),
+        }
+    _current = None
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            worse = compare(json.load(f), report, args.threshold)
+        if worse:
+            print(f"{len(worse)} metric(s) more than {args.threshold:g}% worse: {'; '.join(worse)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,240 @@
+import argparse
+import contextlib
+import csv
+import datetime
+import io
+import json
+import os
+import sys
+import time
+import zipfile
+
+import db
+import pdf_ingest
+import pdf_store
+
+# bulk.py
+# Moves notes in and out of the app in bulk, e.g. to restore a backup or
+# migrate from another tool. Input is read as a stream and inserted in
+# batches (see db.import_notes); exports iterate the database cursor and
+# write as they go, so neither side holds all notes in memory.
+#
+#   python bulk.py import notes.jsonl --user me@example.com
+#   python bulk.py import backup.zip
+#   python bulk.py export backup.zip
+#   python bulk.py export - --user me@example.com > my-notes.jsonl
+#
+# Sources: a JSONL file (one {"title", "content", ...} object per line), a CSV
+# file with title and content columns, a folder of Markdown files (a PDF with
+# the same name is attached) or a zip written by `export`. Records may name a
+# PDF ("pdf", relative to the source), a "created_at" (ISO 8601, stored as UTC
+# "YYYY-MM-DD HH:MM:SS" like the app's own) and, without --user, the owner's
+# "email".
+
+
+def read_jsonl(lines):
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_csv(lines):
+    yield from csv.DictReader(lines)
+
+
+def read_markdown_dir(folder: str):
+    """One note per .md file: the first "# " heading is the title (else the file name)."""
+    for name in sorted(os.listdir(folder)):
+        stem, ext = os.path.splitext(name)
+        if ext.lower() != ".md":
+            continue
+        with open(os.path.join(folder, name), encoding="utf-8") as f:
+            text = f.read()
+        title, body = stem, text
+        first, _, rest = text.partition("\n")
+        if first.startswith("# "):
+            title, body = first[2:].strip(), rest.lstrip("\n")
+        record = {"title": title, "content": body}
+        if os.path.exists(os.path.join(folder, f"{stem}.pdf")):
+            record["pdf"] = f"{stem}.pdf"
+        yield record
+
+
+def _open_source(source: str, stack: contextlib.ExitStack):
+    """
+    (records, read_pdf) for a source; read_pdf(relative_path) returns the PDF
+    bytes. Files opened on the way are closed when the stack is.
+    """
+    if os.path.isdir(source):
+        return read_markdown_dir(source), _file_reader(source)
+
+    if source.endswith(".zip"):
+        archive = stack.enter_context(zipfile.ZipFile(source))
+        lines = stack.enter_context(io.TextIOWrapper(archive.open("notes.jsonl"), encoding="utf-8"))
+        return read_jsonl(lines), archive.read
+
+    lines = stack.enter_context(open(source, encoding="utf-8", newline=""))
+    records = read_csv(lines) if source.endswith(".csv") else read_jsonl(lines)
+    return records, _file_reader(os.path.dirname(os.path.abspath(source)))
+
+
+def _file_reader(folder: str):
+    def read_pdf(relative_path: str) -> bytes:
+        with open(os.path.join(folder, relative_path), "rb") as f:
+            return f.read()
+    return read_pdf
+
+
+def _created_at(record: dict) -> str | None:
+    """A record's created_at in the format SQLite's CURRENT_TIMESTAMP writes, so it sorts with the rest."""
+    value = record.get("created_at")
+    if not value:
+        return None
+    try:
+        moment = datetime.datetime.fromisoformat(str(value).strip())
+    except ValueError:
+        raise ValueError(f"Bad created_at {value!r} for note {record.get('title')!r}; "
+                         "expected YYYY-MM-DD HH:MM:SS") from None
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return moment.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _notes_for_import(records, read_pdf, user_id: int | None):
+    """Turns source records into db.import_notes rows, storing their PDFs on the way."""
+    owners = {}
+    for record in records:
+        if user_id is not None:
+            owner = user_id
+        else:
+            email = record.get("email")
+            if email not in owners:
+                user = db.get_user(email) if email else None
+                if user is None:
+                    raise ValueError(f"No user {email!r} for note {record.get('title')!r}; pass --user")
+                owners[email] = user.id
+            owner = owners[email]
+
+        note = {
+            "user_id": owner,
+            "title": record.get("title") or "Untitled",
+            "content": record.get("content") or "",
+            "created_at": _created_at(record),
+            "pdf_text": record.get("pdf_text") or "",
+        }
+        if record.get("pdf"):
+            data = read_pdf(record["pdf"])
+            note["pdf_hash"], note["pdf_path"] = pdf_store.put(data)
+            note["pdf_size"] = len(data)
+            note["pdf_name"] = record.get("pdf_name") or os.path.basename(record["pdf"])
+        yield note
+
+
+def import_source(source: str, user_id: int | None = None, batch_size: int = db.IMPORT_BATCH_SIZE,
+                  extract_pdfs: bool = True) -> int:
+    """
+    Imports every note of a source and returns how many were added.
+    With extract_pdfs, waits until the text of the imported PDFs is extracted.
+    """
+    pending = []
+    with contextlib.ExitStack() as stack:
+        records, read_pdf = _open_source(source, stack)
+        imported = db.import_notes(_notes_for_import(records, read_pdf, user_id), batch_size, pending)
+    if extract_pdfs:
+        futures = [pdf_ingest.submit(note_id, path, pdf_hash) for note_id, path, pdf_hash in pending]
+        for future in futures:
+            future.result()
+    return imported
+
+
+def export_jsonl(out, user_id: int | None = None) -> int:
+    """Writes notes as JSONL (PDF text included, files not) and returns how many."""
+    count = 0
+    for note in db.export_notes(user_id):
+        record = {key: note[key] for key in ("email", "title", "content", "created_at", "pdf_text", "pdf_name")}
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        count += 1
+    return count
+
+
+def export_zip(path: str, user_id: int | None = None) -> int:
+    """
+    Writes notes.jsonl plus every attached PDF (once per distinct file) to a
+    zip that `import` reads back. Returns the number of notes.
+    """
+    pdfs = {}   # name in the zip -> file on disk
+    count = 0
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        with archive.open("notes.jsonl", "w") as raw:
+            out = io.TextIOWrapper(raw, encoding="utf-8")
+            for note in db.export_notes(user_id):
+                record = {key: note[key] for key in ("email", "title", "content", "created_at", "pdf_text", "pdf_name")}
+                if note["pdf_path"] and os.path.exists(note["pdf_path"]):
+                    name = f"pdfs/{note['pdf_hash'] or count}.pdf"
+                    pdfs[name] = note["pdf_path"]
+                    record["pdf"] = name
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                count += 1
+            out.flush()
+            out.detach()
+        # PDFs are already compressed; they are copied from disk in chunks
+        for name, pdf_path in pdfs.items():
+            archive.write(pdf_path, name, compress_type=zipfile.ZIP_STORED)
+    return count
+
+
+def main(argv) -> int:
+    parser = argparse.ArgumentParser(prog="bulk.py", description="Bulk import and export of notes.")
+    parser.add_argument("--db", default=db.DB_PATH, help=f"database file (default {db.DB_PATH})")
+    parser.add_argument("--pdf-dir", default=pdf_store.PDF_DIR, help=f"PDF folder of that database (default {pdf_store.PDF_DIR})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    importer = commands.add_parser("import", help="import notes from a JSONL/CSV file, Markdown folder or export zip")
+    importer.add_argument("source")
+    importer.add_argument("--user", help="email of the account that gets the notes (default: each record's email)")
+    importer.add_argument("--batch-size", type=int, default=db.IMPORT_BATCH_SIZE)
+    importer.add_argument("--no-extract", action="store_true", help="leave PDF text extraction to the app")
+
+    exporter = commands.add_parser("export", help="export notes to a .zip (with PDFs) or JSONL file ('-' for stdout)")
+    exporter.add_argument("dest")
+    exporter.add_argument("--user", help="only this account's notes")
+
+    args = parser.parse_args(argv)
+    db.DB_PATH = args.db
+    pdf_store.PDF_DIR = args.pdf_dir
+    db.init_db()
+
+    user_id = None
+    if args.user:
+        user = db.get_user(args.user)
+        if user is None:
+            print(f"No user {args.user!r}", file=sys.stderr)
+            return 1
+        user_id = user.id
+
+    start = time.perf_counter()
+    if args.command == "import":
+        try:
+            count = import_source(args.source, user_id, args.batch_size, extract_pdfs=not args.no_extract)
+        except (OSError, ValueError, KeyError) as e:
+            # Batches before the bad record stay imported
+            print(f"Import stopped: {e}", file=sys.stderr)
+            return 1
+        verb = "Imported"
+    elif args.dest == "-":
+        count = export_jsonl(sys.stdout, user_id)
+        verb = "Exported"
+    elif args.dest.endswith(".zip"):
+        count = export_zip(args.dest, user_id)
+        verb = "Exported"
+    else:
+        with open(args.dest, "w", encoding="utf-8") as f:
+            count = export_jsonl(f, user_id)
+        verb = "Exported"
+    elapsed = time.perf_counter() - start
+    print(f"{verb} {count} notes in {elapsed:.1f} s ({count / elapsed if elapsed else 0:.0f} notes/s)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
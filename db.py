@@ -1,150 +1,1474 @@
 
+import json
+import logging
 import sqlite3
 import os
-import bcrypt
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import wraps
+from itertools import islice
+
+import passwords
+import retrieval
 
 DB_PATH = "data/app.db"
 os.makedirs("data", exist_ok=True)
 
+_log = logging.getLogger(__name__)
 
-def _conn():
-    return sqlite3.connect(DB_PATH, check_same_thread=False)
 
+# ---------- CONNECTION POOL ----------
 
-def init_db():
-    with _conn() as con:
-        # 1) Ensure basic users table exists (old schema compatible)
-        con.execute("""
-        CREATE TABLE IF NOT EXISTS users(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT UNIQUE,
-            password TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
-
-        # 2) Check existing columns and add missing ones (name, method)
-        cur = con.execute("PRAGMA table_info(users)")
-        cols = [row[1] for row in cur.fetchall()]
-
-        if "name" not in cols:
-            con.execute("ALTER TABLE users ADD COLUMN name TEXT")
-
-        if "method" not in cols:
-            con.execute("ALTER TABLE users ADD COLUMN method TEXT DEFAULT 'manual'")
-
-        # 3) Notes table
-        con.execute("""
-        CREATE TABLE IF NOT EXISTS notes(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            title TEXT,
-            content TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY(user_id) REFERENCES users(id)
+# Applied to every connection the pool opens. WAL lets readers run while the
+# writer commits; NORMAL sync is safe under WAL and avoids an fsync per commit.
+_PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA cache_size = -16000",      # ~16 MB page cache per connection
+    "PRAGMA mmap_size = 134217728",    # 128 MB memory-mapped I/O
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA foreign_keys = ON",        # deleting a user or note cascades to what belongs to it
+)
+
+
+READER_POOL_SIZE = 8    # idle reader connections kept open for the next read
+
+
+class _ConnectionPool:
+    """
+    Shares SQLite connections across Streamlit sessions.
+
+    Reads check a connection out of a pool of idle readers and put it back
+    afterwards, so they reuse connections whichever script thread runs them
+    (Streamlit starts a new one for every rerun). At most READER_POOL_SIZE
+    idle readers are kept; a burst of concurrent reads beyond that opens
+    extra connections that are closed after use, so a read never waits for
+    another. All writes go through a single writer connection guarded by a
+    lock, so sessions never fight over the database write lock.
+    """
+
+    def __init__(self, path: str, size: int = READER_POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = []                 # reader connections ready for checkout (last returned on top)
+        self._idle_lock = threading.Lock()
+        self._closed = False
+        self._write_lock = threading.Lock()
+        self._writer = self._open()
+        # Only takes effect in a new database file; init_db converts older ones
+        self._writer.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self._writer.execute("PRAGMA journal_mode = WAL")
+
+    def _open(self):
+        con = sqlite3.connect(self.path, check_same_thread=False)
+        for pragma in _PRAGMAS:
+            con.execute(pragma)
+        return con
+
+    @contextmanager
+    def reader(self):
+        with self._idle_lock:
+            con = self._idle.pop() if self._idle else None
+        if con is None:
+            con = self._open()
+        try:
+            yield con
+        finally:
+            with self._idle_lock:
+                if not self._closed and len(self._idle) < self.size:
+                    self._idle.append(con)
+                    con = None
+            if con is not None:
+                con.close()
+
+    @contextmanager
+    def writer(self):
+        with self._write_lock:
+            with self._writer as con:
+                yield con
+
+    def close(self):
+        """Close the writer and the idle readers; readers in use are closed when returned."""
+        with self._idle_lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for con in idle:
+            con.close()
+        with self._write_lock:
+            self._writer.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> _ConnectionPool:
+    """Return the process-wide pool, (re)creating it if DB_PATH changed."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.path != DB_PATH:
+            if _pool is not None:
+                _pool.close()
+            _pool = _ConnectionPool(DB_PATH)
+        return _pool
+
+
+@contextmanager
+def _conn(write: bool = False):
+    """
+    Yield a pooled connection.
+    Pass write=True for anything that modifies the database; the block then
+    runs as one transaction on the shared writer connection.
+    """
+    pool = _get_pool()
+    if write:
+        with pool.writer() as con:
+            yield con
+    else:
+        with pool.reader() as con:
+            yield con
+
+
+# ---------- READ CACHE ----------
+
+# Streamlit reruns the whole script on every click, so the listing reads are
+# kept in memory and served again until a write touches the data they came
+# from. Every cached read names its scope ("notes" for everyone's notes,
+# "user:<id>" for one user's, "analysis" for AI results); writes bump the
+# version of the scopes they change, which makes older entries miss.
+# Writes made by other processes show up after READ_CACHE_TTL_SECONDS.
+READ_CACHE_MAX_ENTRIES = 1024
+READ_CACHE_TTL_SECONDS = 60
+
+_read_cache = OrderedDict()     # key -> (scope, version, stored_at, result)
+_read_versions = {}             # scope -> version
+_read_stats = {}                # function name -> {"hits": n, "misses": n}
+_read_cache_lock = threading.Lock()
+
+
+def _cached_read(scope):
+    """
+    Cache a read function's results. scope is the scope they depend on, or a
+    function of the call's arguments returning it. Results are shared between
+    sessions, so callers must not modify them.
+    """
+    scope_of = scope if callable(scope) else (lambda *args, **kwargs: scope)
+
+    def decorate(func):
+        stats = _read_stats.setdefault(func.__name__, {"hits": 0, "misses": 0})
+
+        @wraps(func)
+        def cached(*args, **kwargs):
+            key_args = tuple(tuple(a) if isinstance(a, list) else a for a in args)
+            key = (func.__name__, DB_PATH, key_args, tuple(sorted(kwargs.items())))
+            name = scope_of(*args, **kwargs)
+            now = time.monotonic()
+            with _read_cache_lock:
+                version = _read_versions.get(name, 0)
+                entry = _read_cache.get(key)
+                if entry is not None and entry[1] == version and now - entry[2] < READ_CACHE_TTL_SECONDS:
+                    _read_cache.move_to_end(key)
+                    stats["hits"] += 1
+                    return entry[3]
+                stats["misses"] += 1
+
+            # The version was taken before reading, so a write landing meanwhile
+            # leaves this entry already out of date rather than wrongly fresh
+            result = func(*args, **kwargs)
+            with _read_cache_lock:
+                _read_cache[key] = (name, version, now, result)
+                _read_cache.move_to_end(key)
+                while len(_read_cache) > READ_CACHE_MAX_ENTRIES:
+                    _read_cache.popitem(last=False)
+            return result
+
+        return cached
+    return decorate
+
+
+def _invalidate(*scopes):
+    """Mark cached reads of these scopes as out of date (call after the write commits)."""
+    with _read_cache_lock:
+        for name in scopes:
+            _read_versions[name] = _read_versions.get(name, 0) + 1
+
+
+def _user_scope(user_id, *args, **kwargs) -> str:
+    return f"user:{user_id}"
+
+
+def clear_read_cache():
+    """Drop every cached read (e.g. after changing the database from outside db.py)."""
+    with _read_cache_lock:
+        _read_cache.clear()
+
+
+def get_read_cache_stats() -> dict:
+    """Hits, misses and hit rate of the read cache, overall and per function."""
+    with _read_cache_lock:
+        by_function = {name: dict(counts) for name, counts in _read_stats.items()}
+        entries = len(_read_cache)
+    hits = sum(counts["hits"] for counts in by_function.values())
+    misses = sum(counts["misses"] for counts in by_function.values())
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+        "entries": entries,
+        "by_function": by_function,
+    }
+
+
+# ---------- SCHEMA MIGRATIONS ----------
+
+def _migrate_base_schema(con):
+    """v1: users and notes tables (also upgrades databases from before versioning)."""
+    # 1) Ensure basic users table exists (old schema compatible)
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS users(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        email TEXT UNIQUE,
+        password TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+    # 2) Check existing columns and add missing ones (name, method)
+    cur = con.execute("PRAGMA table_info(users)")
+    cols = [row[1] for row in cur.fetchall()]
+
+    if "name" not in cols:
+        con.execute("ALTER TABLE users ADD COLUMN name TEXT")
+
+    if "method" not in cols:
+        con.execute("ALTER TABLE users ADD COLUMN method TEXT DEFAULT 'manual'")
+
+    # 3) Notes table
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS notes(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        title TEXT,
+        content TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    )
+    """)
+    
+    # Add pdf_path column if it doesn't exist
+    cur = con.execute("PRAGMA table_info(notes)")
+    cols = [row[1] for row in cur.fetchall()]
+    if "pdf_path" not in cols:
+        con.execute("ALTER TABLE notes ADD COLUMN pdf_path TEXT")
+
+
+def _migrate_notes_user_index(con):
+    """v2: index notes by owner, used by get_user_notes, delete_note and delete_user."""
+    con.execute("CREATE INDEX IF NOT EXISTS idx_notes_user_id ON notes(user_id)")
+
+
+def _migrate_notes_listing_indexes(con):
+    """v3: composite indexes so note listings are index walks instead of sorts."""
+    # Leads with user_id, so it also serves every lookup idx_notes_user_id did
+    con.execute("DROP INDEX IF EXISTS idx_notes_user_id")
+    con.execute(
+        "CREATE INDEX IF NOT EXISTS idx_notes_user_created "
+        "ON notes(user_id, created_at DESC, id DESC)"
+    )
+    con.execute(
+        "CREATE INDEX IF NOT EXISTS idx_notes_created "
+        "ON notes(created_at DESC, id DESC)"
+    )
+
+
+# Marker app.py used to glue extracted PDF text onto the user's content
+_LEGACY_PDF_MARKER = "--- PDF Content ---"
+
+# Characters of content kept in notes.preview for listings
+PREVIEW_CHARS = 300
+
+
+def _make_preview(content: str) -> str:
+    """Short version of a note body; ends with '…' when it was cut."""
+    content = (content or "").strip()
+    if len(content) <= PREVIEW_CHARS:
+        return content
+    return content[:PREVIEW_CHARS].rstrip() + "…"
+
+
+def _migrate_split_note_bodies(con):
+    """
+    v4: keep listings light by splitting note bodies.
+    notes.content holds only what the user typed, notes.preview a short
+    version of it, and extracted PDF text moves to its own table.
+    """
+    con.execute("ALTER TABLE notes ADD COLUMN preview TEXT")
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS note_pdf_text(
+        note_id INTEGER PRIMARY KEY,
+        text TEXT,
+        FOREIGN KEY(note_id) REFERENCES notes(id)
+    )
+    """)
+
+    rows = con.execute("SELECT id, content FROM notes").fetchall()
+    for note_id, content in rows:
+        content = content or ""
+        if _LEGACY_PDF_MARKER in content:
+            content, pdf_text = content.split(_LEGACY_PDF_MARKER, 1)
+            content = content.strip()
+            con.execute(
+                "INSERT INTO note_pdf_text (note_id, text) VALUES (?, ?)",
+                (note_id, pdf_text.strip()),
+            )
+        con.execute(
+            "UPDATE notes SET content = ?, preview = ? WHERE id = ?",
+            (content, _make_preview(content), note_id),
         )
-        """)
-        
-        # Add pdf_path column if it doesn't exist
-        cur = con.execute("PRAGMA table_info(notes)")
-        cols = [row[1] for row in cur.fetchall()]
-        if "pdf_path" not in cols:
-            con.execute("ALTER TABLE notes ADD COLUMN pdf_path TEXT")
+
+
+def _migrate_pdf_ingest_status(con):
+    """v5: track background PDF text extraction per note."""
+    con.execute("ALTER TABLE notes ADD COLUMN pdf_status TEXT")
+    con.execute("ALTER TABLE notes ADD COLUMN pdf_pages_done INTEGER DEFAULT 0")
+    con.execute("ALTER TABLE notes ADD COLUMN pdf_pages_total INTEGER DEFAULT 0")
+    con.execute("UPDATE notes SET pdf_status = 'ready' WHERE pdf_path IS NOT NULL")
+
+
+def _migrate_pdf_blobs(con):
+    """
+    v6: content-addressed PDFs (see pdf_store.py).
+    One pdf_blobs row per distinct file with its reference count and the
+    extracted text, which doubles as the extraction cache.
+    Older notes keep their per-user file and note_pdf_text row.
+    """
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS pdf_blobs(
+        hash TEXT PRIMARY KEY,
+        path TEXT NOT NULL,
+        size INTEGER,
+        ref_count INTEGER DEFAULT 0,
+        text TEXT,
+        extractions_skipped INTEGER DEFAULT 0
+    )
+    """)
+    con.execute("ALTER TABLE notes ADD COLUMN pdf_hash TEXT")
+    con.execute("ALTER TABLE notes ADD COLUMN pdf_name TEXT")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_notes_pdf_hash ON notes(pdf_hash) WHERE pdf_hash IS NOT NULL")
+    # Lets delete_note / delete_user find unreferenced blobs without a scan
+    con.execute("CREATE INDEX IF NOT EXISTS idx_pdf_blobs_orphans ON pdf_blobs(hash) WHERE ref_count <= 0")
+
+
+def _migrate_note_chunks(con):
+    """
+    v7: chunks of note text and PDF text for the chatbot's retrieval
+    (see retrieval.py), with an FTS5 index kept in sync by triggers.
+    """
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS note_chunks(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        note_id INTEGER,
+        user_id INTEGER,
+        text TEXT,
+        FOREIGN KEY(note_id) REFERENCES notes(id)
+    )
+    """)
+    con.execute("CREATE INDEX IF NOT EXISTS idx_note_chunks_note ON note_chunks(note_id)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_note_chunks_user ON note_chunks(user_id, note_id)")
+    con.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS note_chunks_fts USING fts5(
+        text, content='note_chunks', content_rowid='id', tokenize='porter unicode61'
+    )
+    """)
+    con.execute("""
+    CREATE TRIGGER IF NOT EXISTS note_chunks_ai AFTER INSERT ON note_chunks BEGIN
+        INSERT INTO note_chunks_fts(rowid, text) VALUES (new.id, new.text);
+    END
+    """)
+    con.execute("""
+    CREATE TRIGGER IF NOT EXISTS note_chunks_ad AFTER DELETE ON note_chunks BEGIN
+        INSERT INTO note_chunks_fts(note_chunks_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    END
+    """)
+    for (note_id,) in con.execute("SELECT id FROM notes").fetchall():
+        _index_note(con, note_id)
+
+
+def _migrate_llm_cache(con):
+    """v8: persistent cache of LLM responses (see llm_utils._basic_call)."""
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS llm_cache(
+        key TEXT PRIMARY KEY,
+        response TEXT,
+        created_at REAL,
+        last_used REAL
+    )
+    """)
+    con.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache(last_used)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_created ON llm_cache(created_at)")
+
+
+def _migrate_note_analysis(con):
+    """v9: AI analysis results per note (filled by batch_analysis.py)."""
+    con.execute("ALTER TABLE notes ADD COLUMN summary TEXT")
+    con.execute("ALTER TABLE notes ADD COLUMN sentiment TEXT")
+    con.execute("ALTER TABLE notes ADD COLUMN keywords TEXT")
+    con.execute("ALTER TABLE notes ADD COLUMN analyzed_at TIMESTAMP")
+
+
+def _migrate_notes_fts(con):
+    """
+    v10: full-text search over note titles, bodies and PDF text.
+    notes_fts rows share the note's id and are maintained by triggers, so
+    every write path (including background PDF extraction) stays in sync.
+    """
+    con.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
+        title, body, pdf_text, tokenize='porter unicode61'
+    )
+    """)
+    con.execute("""
+    CREATE TRIGGER IF NOT EXISTS notes_fts_ai AFTER INSERT ON notes BEGIN
+        INSERT INTO notes_fts(rowid, title, body, pdf_text)
+        VALUES (new.id, new.title, new.content, (SELECT text FROM pdf_blobs WHERE hash = new.pdf_hash));
+    END
+    """)
+    con.execute("""
+    CREATE TRIGGER IF NOT EXISTS notes_fts_au AFTER UPDATE OF title, content ON notes BEGIN
+        UPDATE notes_fts SET title = new.title, body = new.content WHERE rowid = new.id;
+    END
+    """)
+    con.execute("""
+    CREATE TRIGGER IF NOT EXISTS notes_fts_ad AFTER DELETE ON notes BEGIN
+        DELETE FROM notes_fts WHERE rowid = old.id;
+    END
+    """)
+    con.execute("""
+    CREATE TRIGGER IF NOT EXISTS notes_fts_pdf_text AFTER INSERT ON note_pdf_text BEGIN
+        UPDATE notes_fts SET pdf_text = new.text WHERE rowid = new.note_id;
+    END
+    """)
+    con.execute("""
+    CREATE TRIGGER IF NOT EXISTS notes_fts_pdf_blob AFTER UPDATE OF text ON pdf_blobs BEGIN
+        UPDATE notes_fts SET pdf_text = new.text WHERE rowid IN (SELECT id FROM notes WHERE pdf_hash = new.hash);
+    END
+    """)
+    con.execute("""
+    INSERT INTO notes_fts(rowid, title, body, pdf_text)
+    SELECT notes.id, notes.title, notes.content, COALESCE(note_pdf_text.text, pdf_blobs.text)
+    FROM notes LEFT JOIN note_pdf_text ON note_pdf_text.note_id = notes.id
+    LEFT JOIN pdf_blobs ON pdf_blobs.hash = notes.pdf_hash
+    """)
+
+
+def _migrate_notes_context(con):
+    """
+    v11: each user's notes as the chatbot sends them (see get_notes_context).
+    Rows are built on first use and then kept up to date by the note writes.
+    """
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS notes_context(
+        user_id INTEGER PRIMARY KEY,
+        tokens INTEGER NOT NULL,
+        text TEXT,
+        offsets TEXT
+    )
+    """)
+
+
+def _rebuild_with_cascade(con, table: str, column: str, parent: str):
+    """
+    Recreate a table so that `column` references parent(id) ON DELETE CASCADE.
+    SQLite can't alter a foreign key, so the rows are copied into a new table
+    (ids, AUTOINCREMENT counter, indexes and triggers are kept).
+    """
+    sql = con.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()[0]
+    extras = [row[0] for row in con.execute(
+        "SELECT sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+        (table,),
+    )]
+    sequence = con.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+    columns = ", ".join(row[1] for row in con.execute(f"PRAGMA table_info({table})"))
+
+    foreign_key = f"FOREIGN KEY({column}) REFERENCES {parent}(id)"
+    if foreign_key in sql:
+        sql = sql.replace(foreign_key, f"{foreign_key} ON DELETE CASCADE")
+    else:
+        sql = sql[:sql.rindex(")")] + f", {foreign_key} ON DELETE CASCADE)"
+    con.execute(sql.replace(table, f"{table}_rebuild", 1))
+    con.execute(f"INSERT INTO {table}_rebuild ({columns}) SELECT {columns} FROM {table}")
+    con.execute(f"DROP TABLE {table}")
+    con.execute(f"ALTER TABLE {table}_rebuild RENAME TO {table}")
+    for extra in extras:
+        con.execute(extra)
+    if sequence is not None:
+        con.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (sequence[0], table))
+
+
+def _migrate_cascading_deletes(con):
+    """
+    v12: deleting a user deletes their notes, and deleting a note deletes its
+    PDF text, chunks and its reference on a shared PDF (files are removed
+    later by maintenance.py). Rows whose owner is already gone are dropped,
+    and how many of each is logged as a warning.
+    """
+    con.execute("""
+    CREATE TRIGGER IF NOT EXISTS notes_release_pdf AFTER DELETE ON notes WHEN old.pdf_hash IS NOT NULL BEGIN
+        UPDATE pdf_blobs SET ref_count = ref_count - 1 WHERE hash = old.pdf_hash;
+    END
+    """)
+    orphans = {
+        table: con.execute(f"DELETE FROM {table} WHERE {column} NOT IN (SELECT id FROM {parent})").rowcount
+        for table, column, parent in (("notes", "user_id", "users"), ("note_pdf_text", "note_id", "notes"),
+                                      ("note_chunks", "note_id", "notes"), ("notes_context", "user_id", "users"))
+    }
+    if any(orphans.values()):
+        _log.warning("v12: removed rows whose user or note no longer exists: %s",
+                     ", ".join(f"{count} from {table}" for table, count in orphans.items() if count))
+
+    # Renaming must not re-check triggers that mention a table mid-rebuild
+    con.execute("PRAGMA legacy_alter_table = ON")
+    _rebuild_with_cascade(con, "notes", "user_id", "users")
+    _rebuild_with_cascade(con, "note_pdf_text", "note_id", "notes")
+    _rebuild_with_cascade(con, "note_chunks", "note_id", "notes")
+    _rebuild_with_cascade(con, "notes_context", "user_id", "users")
+    con.execute("PRAGMA legacy_alter_table = OFF")
+
+
+def _migrate_bulk_index_guard(con):
+    """
+    v13: bulk imports index their rows in one statement per batch instead of
+    row by row. While a batch's transaction has a row in bulk_import, the
+    two insert triggers skip; nobody else ever sees that row, so no schema
+    changes are needed and every other writer keeps its triggers.
+    """
+    con.execute("CREATE TABLE IF NOT EXISTS bulk_import(active INTEGER)")
+    con.execute("DROP TRIGGER IF EXISTS notes_fts_ai")
+    con.execute("""
+    CREATE TRIGGER notes_fts_ai AFTER INSERT ON notes WHEN NOT EXISTS (SELECT 1 FROM bulk_import) BEGIN
+        INSERT INTO notes_fts(rowid, title, body, pdf_text)
+        VALUES (new.id, new.title, new.content, (SELECT text FROM pdf_blobs WHERE hash = new.pdf_hash));
+    END
+    """)
+    con.execute("DROP TRIGGER IF EXISTS note_chunks_ai")
+    con.execute("""
+    CREATE TRIGGER note_chunks_ai AFTER INSERT ON note_chunks WHEN NOT EXISTS (SELECT 1 FROM bulk_import) BEGIN
+        INSERT INTO note_chunks_fts(rowid, text) VALUES (new.id, new.text);
+    END
+    """)
+
+
+def _migrate_notes_fts_owner(con):
+    """
+    v14: notes_fts gets an owner column holding a "u<user id>" token, so a
+    search of one user's notes only ever ranks that user's matches, and
+    indexes of 3 to 6 letter prefixes: without them FTS5 merges the lists of
+    every word starting with the prefix being typed before returning a row.
+    """
+    con.execute("DROP TABLE notes_fts")
+    con.execute("""
+    CREATE VIRTUAL TABLE notes_fts USING fts5(
+        title, body, pdf_text, owner, tokenize='porter unicode61', prefix='3 4 5 6'
+    )
+    """)
+    con.execute("DROP TRIGGER IF EXISTS notes_fts_ai")
+    con.execute("""
+    CREATE TRIGGER notes_fts_ai AFTER INSERT ON notes WHEN NOT EXISTS (SELECT 1 FROM bulk_import) BEGIN
+        INSERT INTO notes_fts(rowid, title, body, pdf_text, owner)
+        VALUES (new.id, new.title, new.content, (SELECT text FROM pdf_blobs WHERE hash = new.pdf_hash),
+                'u' || new.user_id);
+    END
+    """)
+    con.execute("""
+    INSERT INTO notes_fts(rowid, title, body, pdf_text, owner)
+    SELECT notes.id, notes.title, notes.content, COALESCE(note_pdf_text.text, pdf_blobs.text), 'u' || notes.user_id
+    FROM notes LEFT JOIN note_pdf_text ON note_pdf_text.note_id = notes.id
+    LEFT JOIN pdf_blobs ON pdf_blobs.hash = notes.pdf_hash
+    """)
+
+
+# Each entry upgrades the schema by one version, and PRAGMA user_version stores
+# how many have been applied. Only ever append to this list.
+MIGRATIONS = [
+    _migrate_base_schema,
+    _migrate_notes_user_index,
+    _migrate_notes_listing_indexes,
+    _migrate_split_note_bodies,
+    _migrate_pdf_ingest_status,
+    _migrate_pdf_blobs,
+    _migrate_note_chunks,
+    _migrate_llm_cache,
+    _migrate_note_analysis,
+    _migrate_notes_fts,
+    _migrate_notes_context,
+    _migrate_cascading_deletes,
+    _migrate_bulk_index_guard,
+    _migrate_notes_fts_owner,
+]
+
+# DB_PATH whose schema is known to be current in this process
+_migrated_path = None
+
+
+def init_db():
+    """
+    Applies any pending migrations, and switches an older database file to
+    incremental auto-vacuum (see enable_incremental_vacuum).
+    Runs the migrations at most once per process; later calls (one per
+    Streamlit rerun) return immediately.
+    """
+    global _migrated_path
+    if _migrated_path == DB_PATH:
+        return
+
+    with _conn(write=True) as con:
+        # Off while migrating: rebuilding a table must not cascade to its children
+        con.execute("PRAGMA foreign_keys = OFF")
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            version = con.execute("PRAGMA user_version").fetchone()[0]
+            for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                migration(con)
+                con.execute(f"PRAGMA user_version = {number}")
+            con.commit()
+        finally:
+            con.rollback()
+            con.execute("PRAGMA foreign_keys = ON")
+
+    # Not inside the migration transaction: VACUUM can't run in one
+    enable_incremental_vacuum()
+    _migrated_path = DB_PATH
 
 
 # ---------- USER FUNCTIONS ----------
 
+@dataclass(frozen=True, slots=True)
+class User:
+    """One row of the users table (without the password)."""
+    id: int
+    email: str
+    name: str | None
+    method: str | None
+    created_at: str
+
+
+# Columns in User field order, so rows can be unpacked straight into User(*row)
+_USER_COLUMNS = "id, email, name, method, created_at"
+
+
 def create_user(email: str, password: str):
     """Creates a MANUAL (email/password) user with hashed password."""
-    with _conn() as con:
-        # Hash the password using bcrypt
-        hashed_pwd = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
+    # Hash the password in the hashing pool (outside the write lock, it is slow)
+    hashed_pwd = passwords.hash_password(password)
+    with _conn(write=True) as con:
         con.execute(
             "INSERT INTO users (email, password) VALUES (?, ?)",
             (email, hashed_pwd),
         )
 
 
-def get_user(email: str):
+def get_user(email: str) -> User | None:
     """Retrieves a user by email."""
     with _conn() as con:
-        cur = con.execute("SELECT * FROM users WHERE email = ?", (email,))
-        return cur.fetchone()
+        row = con.execute(f"SELECT {_USER_COLUMNS} FROM users WHERE email = ?", (email,)).fetchone()
+    return User(*row) if row else None
 
 
 def create_google_user(email: str, name: str):
     """Creates a GOOGLE user."""
-    with _conn() as con:
+    with _conn(write=True) as con:
         con.execute(
             "INSERT INTO users (email, name, method) VALUES (?, ?, ?)",
             (email, name, "google"),
         )
 
 
+def upsert_google_user(email: str, name: str) -> User:
+    """
+    Returns the user with this email, creating a GOOGLE user first if there
+    is none (one statement). An existing account keeps its login method.
+    """
+    with _conn(write=True) as con:
+        row = con.execute(
+            "INSERT INTO users (email, name, method) VALUES (?, ?, 'google') "
+            "ON CONFLICT(email) DO UPDATE SET name = COALESCE(users.name, excluded.name) "
+            f"RETURNING {_USER_COLUMNS}",
+            (email, name),
+        ).fetchone()
+    return User(*row)
+
+
 # ---------- NOTE FUNCTIONS ----------
 
-def create_note(user_id: int, title: str, content: str, pdf_path: str = None):
-    """Creates a note for a user."""
+def create_note(user_id: int, title: str, content: str, pdf_path: str = None, pdf_text: str = "",
+                pdf_status: str = None, pdf_hash: str = None, pdf_name: str = None, pdf_size: int = None) -> int:
+    """
+    Creates a note for a user and returns its ID.
+    Text extracted from the PDF is stored separately. pdf_status is
+    "processing" while pdf_ingest extracts the text in the background.
+
+    PDFs saved through pdf_store pass their pdf_hash: the note then takes a
+    reference on the shared file, and if that file's text was extracted
+    before, the note is "ready" straight away.
+    """
+    if pdf_path and pdf_status is None:
+        pdf_status = "ready"
+    with _conn(write=True) as con:
+        if pdf_hash:
+            con.execute(
+                "INSERT INTO pdf_blobs (hash, path, size, ref_count) VALUES (?, ?, ?, 1) "
+                "ON CONFLICT(hash) DO UPDATE SET ref_count = ref_count + 1",
+                (pdf_hash, pdf_path, pdf_size),
+            )
+            if _has_cached_pdf_text(con, pdf_hash):
+                pdf_status = "ready"
+        cur = con.execute(
+            "INSERT INTO notes (user_id, title, content, preview, pdf_path, pdf_status, pdf_hash, pdf_name) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (user_id, title, content, _make_preview(content), pdf_path, pdf_status, pdf_hash, pdf_name),
+        )
+        if pdf_text:
+            con.execute(
+                "INSERT INTO note_pdf_text (note_id, text) VALUES (?, ?)",
+                (cur.lastrowid, pdf_text),
+            )
+        _index_note(con, cur.lastrowid)
+        _context_add(con, user_id, cur.lastrowid)
+    _invalidate("notes", f"user:{user_id}")
+    return cur.lastrowid
+
+
+def _index_note(con, note_id: int):
+    """(Re)builds the retrieval chunks of one note from its content and PDF text."""
+    con.execute("DELETE FROM note_chunks WHERE note_id = ?", (note_id,))
+    row = con.execute(
+        "SELECT notes.user_id, notes.title, notes.content, COALESCE(note_pdf_text.text, pdf_blobs.text) "
+        "FROM notes LEFT JOIN note_pdf_text ON note_pdf_text.note_id = notes.id "
+        "LEFT JOIN pdf_blobs ON pdf_blobs.hash = notes.pdf_hash AND notes.pdf_status = 'ready' "
+        "WHERE notes.id = ?",
+        (note_id,),
+    ).fetchone()
+    if row is None:
+        return
+    user_id, title, content, pdf_text = row
+    con.executemany(
+        "INSERT INTO note_chunks (note_id, user_id, text) VALUES (?, ?, ?)",
+        ((note_id, user_id, chunk) for chunk in retrieval.note_chunks(title, content, pdf_text)),
+    )
+
+
+# ---------- CHAT NOTES CONTEXT ----------
+
+# A user's notes are sent whole with every chat message while they fit in
+# retrieval.NOTES_PREFIX_TOKENS. Rather than reading every note again each
+# turn, notes_context keeps them written out (note_entry per note, sorted by
+# ID, joined by blank lines) with each entry's offsets and the token count.
+# The note writes below splice single entries in and out. Past the limit only
+# the token count is kept; the chatbot then retrieves excerpts instead.
+_ENTRY_SEPARATOR = "\n\n"
+
+
+@dataclass(frozen=True, slots=True)
+class NotesContext:
+    """A user's notes as the chatbot sends them."""
+    tokens: int                 # retrieval.count_tokens of all entries
+    text: str | None            # None once tokens > retrieval.NOTES_PREFIX_TOKENS
+    offsets: tuple              # (note_id, start, end) of each entry in text, by note ID
+
+
+def _note_entry(con, note_id: int, user_id: int) -> str | None:
+    row = con.execute(
+        "SELECT notes.title, notes.content, COALESCE(note_pdf_text.text, pdf_blobs.text) "
+        "FROM notes LEFT JOIN note_pdf_text ON note_pdf_text.note_id = notes.id "
+        "LEFT JOIN pdf_blobs ON pdf_blobs.hash = notes.pdf_hash AND notes.pdf_status = 'ready' "
+        "WHERE notes.id = ? AND notes.user_id = ?",
+        (note_id, user_id),
+    ).fetchone()
+    return retrieval.note_entry(row[0], row[1], row[2] or "") if row else None
+
+
+def _load_context(con, user_id: int) -> NotesContext | None:
+    row = con.execute("SELECT tokens, text, offsets FROM notes_context WHERE user_id = ?", (user_id,)).fetchone()
+    if row is None:
+        return None
+    tokens, text, offsets = row
+    return NotesContext(tokens, text, tuple(tuple(o) for o in json.loads(offsets)) if offsets else ())
+
+
+def _save_context(con, user_id: int, tokens: int, text: str | None, offsets):
+    if text is None or tokens > retrieval.NOTES_PREFIX_TOKENS:
+        text, offsets = None, ()
+    con.execute(
+        "INSERT OR REPLACE INTO notes_context (user_id, tokens, text, offsets) VALUES (?, ?, ?, ?)",
+        (user_id, tokens, text, json.dumps(offsets) if text is not None else None),
+    )
+
+
+def _build_context(con, user_id: int) -> NotesContext:
+    tokens, entries, offsets, end = 0, [], [], 0
+    cur = con.execute(
+        "SELECT notes.id, notes.title, notes.content, COALESCE(note_pdf_text.text, pdf_blobs.text) "
+        "FROM notes LEFT JOIN note_pdf_text ON note_pdf_text.note_id = notes.id "
+        "LEFT JOIN pdf_blobs ON pdf_blobs.hash = notes.pdf_hash AND notes.pdf_status = 'ready' "
+        "WHERE notes.user_id = ? ORDER BY notes.id",
+        (user_id,),
+    )
+    for note_id, title, content, pdf_text in cur:
+        entry = retrieval.note_entry(title, content, pdf_text or "")
+        tokens += retrieval.count_tokens(entry)
+        if entries is None:
+            continue
+        if tokens > retrieval.NOTES_PREFIX_TOKENS:
+            entries = None      # too big to send whole; keep counting
+            continue
+        start = end + len(_ENTRY_SEPARATOR) if entries else 0
+        entries.append(entry)
+        offsets.append((note_id, start, start + len(entry)))
+        end = start + len(entry)
+    text = _ENTRY_SEPARATOR.join(entries) if entries is not None else None
+    _save_context(con, user_id, tokens, text, offsets)
+    return _load_context(con, user_id)
+
+
+def _context_add(con, user_id: int, note_id: int):
+    """Splice a new (or changed) note into its owner's notes context."""
+    context = _load_context(con, user_id)
+    if context is None:
+        return
+    entry = _note_entry(con, note_id, user_id)
+    if entry is None:
+        return
+    text, offsets = context.text, list(context.offsets)
+    tokens = context.tokens + retrieval.count_tokens(entry)
+    if text is not None and tokens <= retrieval.NOTES_PREFIX_TOKENS:
+        position = next((i for i, o in enumerate(offsets) if o[0] > note_id), len(offsets))
+        if not offsets:
+            text, start = entry, 0
+        elif position == len(offsets):
+            start = len(text) + len(_ENTRY_SEPARATOR)
+            text = text + _ENTRY_SEPARATOR + entry
+        else:
+            start = offsets[position][1]
+            text = text[:start] + entry + _ENTRY_SEPARATOR + text[start:]
+            shift = len(entry) + len(_ENTRY_SEPARATOR)
+            offsets[position:] = [(i, s + shift, e + shift) for i, s, e in offsets[position:]]
+        offsets.insert(position, (note_id, start, start + len(entry)))
+    _save_context(con, user_id, tokens, text, offsets)
+
+
+def _context_remove(con, user_id: int, note_id: int):
+    """Take a note out of its owner's notes context (call before deleting or changing it)."""
+    context = _load_context(con, user_id)
+    if context is None:
+        return
+    if context.text is None:
+        entry = _note_entry(con, note_id, user_id)
+        if entry is None:
+            return
+        tokens = context.tokens - retrieval.count_tokens(entry)
+        if tokens <= retrieval.NOTES_PREFIX_TOKENS:
+            # Small enough to send whole again: rebuild on next use
+            con.execute("DELETE FROM notes_context WHERE user_id = ?", (user_id,))
+        else:
+            _save_context(con, user_id, tokens, None, ())
+        return
+
+    offsets = list(context.offsets)
+    position = next((i for i, o in enumerate(offsets) if o[0] == note_id), None)
+    if position is None:
+        return
+    _, start, end = offsets.pop(position)
+    text = context.text
+    tokens = context.tokens - retrieval.count_tokens(text[start:end])
+    if position == len(offsets):
+        text = text[:max(0, start - len(_ENTRY_SEPARATOR))]
+    else:
+        text = text[:start] + text[end + len(_ENTRY_SEPARATOR):]
+        shift = end + len(_ENTRY_SEPARATOR) - start
+        offsets[position:] = [(i, s - shift, e - shift) for i, s, e in offsets[position:]]
+    _save_context(con, user_id, tokens, text, offsets)
+
+
+@_cached_read(_user_scope)
+def get_notes_context(user_id: int) -> NotesContext:
+    """
+    The user's notes as the chatbot sends them: one lookup, built from the
+    notes only the first time (or after a bulk import).
+    """
     with _conn() as con:
+        context = _load_context(con, user_id)
+    if context is None:
+        with _conn(write=True) as con:
+            context = _build_context(con, user_id)
+    return context
+
+
+# ---------- PDF INGESTION STATUS ----------
+
+def set_pdf_progress(note_id: int, pages_done: int, pages_total: int):
+    """Records how many pages of a note's PDF have been extracted so far."""
+    with _conn(write=True) as con:
         con.execute(
-            "INSERT INTO notes (user_id, title, content, pdf_path) VALUES (?, ?, ?, ?)",
-            (user_id, title, content, pdf_path),
+            "UPDATE notes SET pdf_pages_done = ?, pdf_pages_total = ? WHERE id = ?",
+            (pages_done, pages_total, note_id),
         )
 
 
+def _has_cached_pdf_text(con, pdf_hash: str) -> bool:
+    """True (and counted as a skipped extraction) if this PDF's text is already known."""
+    cur = con.execute(
+        "UPDATE pdf_blobs SET extractions_skipped = extractions_skipped + 1 WHERE hash = ? AND text IS NOT NULL",
+        (pdf_hash,),
+    )
+    return cur.rowcount > 0
+
+
+def use_cached_pdf_text(note_id: int) -> bool:
+    """
+    Marks a note "ready" if its PDF's text is already in the extraction cache
+    (e.g. the same file finished extracting for another note meanwhile).
+    """
+    with _conn(write=True) as con:
+        row = con.execute("SELECT pdf_hash, user_id FROM notes WHERE id = ?", (note_id,)).fetchone()
+        if row is None or row[0] is None or not _has_cached_pdf_text(con, row[0]):
+            return False
+        _context_remove(con, row[1], note_id)
+        con.execute("UPDATE notes SET pdf_status = 'ready' WHERE id = ?", (note_id,))
+        _index_note(con, note_id)
+        _context_add(con, row[1], note_id)
+    _invalidate("notes", f"user:{row[1]}")
+    return True
+
+
+def finish_pdf_ingest(note_id: int, pdf_text: str, status: str = "ready"):
+    """
+    Stores the extracted text (unless the note was deleted meanwhile) and the final status.
+    For content-addressed PDFs the text goes into the extraction cache, and
+    every note still waiting on the same file is finished too.
+    """
+    with _conn(write=True) as con:
+        row = con.execute("SELECT pdf_hash, user_id FROM notes WHERE id = ?", (note_id,)).fetchone()
+        if row is None:
+            return
+        pdf_hash, user_id = row
+        if pdf_hash is None:
+            _context_remove(con, user_id, note_id)
+            if pdf_text:
+                con.execute(
+                    "INSERT OR REPLACE INTO note_pdf_text (note_id, text) VALUES (?, ?)",
+                    (note_id, pdf_text),
+                )
+            con.execute("UPDATE notes SET pdf_status = ? WHERE id = ?", (status, note_id))
+            _index_note(con, note_id)
+            _context_add(con, user_id, note_id)
+            owners = {user_id}
+        else:
+            waiting = con.execute(
+                "SELECT id, user_id FROM notes WHERE pdf_hash = ? AND (id = ? OR pdf_status = 'processing')",
+                (pdf_hash, note_id),
+            ).fetchall()
+            for waiting_id, owner in waiting:
+                _context_remove(con, owner, waiting_id)
+            if status == "ready":
+                con.execute("UPDATE pdf_blobs SET text = ? WHERE hash = ?", (pdf_text, pdf_hash))
+            for waiting_id, owner in waiting:
+                con.execute("UPDATE notes SET pdf_status = ? WHERE id = ?", (status, waiting_id))
+                _index_note(con, waiting_id)
+                _context_add(con, owner, waiting_id)
+            owners = {owner for _, owner in waiting}
+    _invalidate("notes", *(f"user:{owner}" for owner in owners))
+
+
+def get_pdf_store_stats() -> dict:
+    """Deduplication metrics for the content-addressed PDF store."""
+    with _conn() as con:
+        blobs, stored, saved, skipped = con.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(size * (ref_count - 1)), 0), "
+            "COALESCE(SUM(extractions_skipped), 0) FROM pdf_blobs WHERE ref_count > 0"
+        ).fetchone()
+        orphans, orphan_bytes = con.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pdf_blobs WHERE ref_count <= 0"
+        ).fetchone()
+    return {
+        "blobs": blobs,
+        "bytes_stored": stored,
+        "bytes_saved": saved,
+        "extractions_skipped": skipped,
+        "orphans": orphans,            # unreferenced, waiting for maintenance.collect_pdfs
+        "bytes_orphaned": orphan_bytes,
+    }
+
+
+def get_pdf_status(note_id: int):
+    """Returns (pdf_status, pages_done, pages_total) for a note, or None if it doesn't exist."""
+    with _conn() as con:
+        return con.execute(
+            "SELECT pdf_status, pdf_pages_done, pdf_pages_total FROM notes WHERE id = ?",
+            (note_id,),
+        ).fetchone()
+
+
+def get_pending_pdf_notes():
+    """Returns (id, pdf_path, pdf_hash) of notes whose PDF extraction never finished."""
+    with _conn() as con:
+        return con.execute(
+            "SELECT id, pdf_path, pdf_hash FROM notes WHERE pdf_status = 'processing'"
+        ).fetchall()
+
+
+@_cached_read(_user_scope)
 def get_user_notes(user_id: int):
-    """Retrieves all notes for a user."""
+    """
+    Retrieves all notes for a user, including extracted PDF text.
+    Rows are (id, title, content, created_at, pdf_path, pdf_text).
+    """
     with _conn() as con:
         cur = con.execute(
-            "SELECT id, title, content, created_at, pdf_path FROM notes WHERE user_id = ? ORDER BY created_at DESC",
+            "SELECT notes.id, notes.title, notes.content, notes.created_at, notes.pdf_path, COALESCE(note_pdf_text.text, pdf_blobs.text) "
+            "FROM notes LEFT JOIN note_pdf_text ON note_pdf_text.note_id = notes.id LEFT JOIN pdf_blobs ON pdf_blobs.hash = notes.pdf_hash "
+            "WHERE notes.user_id = ? ORDER BY notes.created_at DESC, notes.id DESC",
             (user_id,),
         )
         return cur.fetchall()
 
 
+@_cached_read("notes")
+def get_note_content(note_id: int) -> str | None:
+    """Retrieves the full body of one note (for expanding a preview)."""
+    with _conn() as con:
+        row = con.execute("SELECT content FROM notes WHERE id = ?", (note_id,)).fetchone()
+        return row[0] if row else None
+
+
+def search_note_chunks(user_id: int, query: str, limit: int = retrieval.TOP_K) -> list[str]:
+    """
+    Retrieves the user's note chunks that best match an FTS5 query, best first
+    (BM25 ranking). Build the query with retrieval.fts_query.
+    """
+    if not query:
+        return []
+    with _conn() as con:
+        cur = con.execute(
+            "SELECT note_chunks.text FROM note_chunks_fts JOIN note_chunks ON note_chunks.id = note_chunks_fts.rowid "
+            "WHERE note_chunks_fts MATCH ? AND note_chunks.user_id = ? ORDER BY bm25(note_chunks_fts) LIMIT ?",
+            (query, user_id, limit),
+        )
+        return [row[0] for row in cur.fetchall()]
+
+
+def get_recent_note_chunks(user_id: int, limit: int = retrieval.TOP_K) -> list[str]:
+    """Retrieves chunks from the user's newest notes (used when nothing matches)."""
+    with _conn() as con:
+        cur = con.execute(
+            "SELECT text FROM note_chunks WHERE user_id = ? ORDER BY note_id DESC, id LIMIT ?",
+            (user_id, limit),
+        )
+        return [row[0] for row in cur.fetchall()]
+
+
+@_cached_read("notes")
 def get_all_notes():
     """Retrieves all notes from all users."""
     with _conn() as con:
         cur = con.execute(
-            "SELECT notes.id, users.email, notes.title, notes.content, notes.created_at, notes.pdf_path FROM notes JOIN users ON notes.user_id = users.id ORDER BY notes.created_at DESC"
+            "SELECT notes.id, users.email, notes.title, notes.content, notes.created_at, notes.pdf_path FROM notes JOIN users ON notes.user_id = users.id ORDER BY notes.created_at DESC, notes.id DESC"
         )
         return cur.fetchall()
 
 
+# ---------- PAGINATED NOTE LISTINGS ----------
+
+PAGE_SIZE = 20
+
+
+def _keyset_page(select: str, where: str, params: tuple, cursor, page_size: int, direction: str, created_at_index: int):
+    """
+    Runs one keyset-paginated listing query over notes, newest first.
+
+    cursor is the (created_at, id) of the row the page continues from, or None
+    for the first page. direction "older" continues past the cursor, "newer"
+    goes back towards the start. The SELECT must return notes.id first and
+    notes.created_at at created_at_index.
+
+    Returns (rows, next_cursor); next_cursor is None when there are no more
+    rows in that direction.
+    """
+    if direction not in ("older", "newer"):
+        raise ValueError(f"direction must be 'older' or 'newer', not {direction!r}")
+
+    conditions = [where] if where else []
+    if cursor is not None:
+        op = "<" if direction == "older" else ">"
+        conditions.append(f"(notes.created_at, notes.id) {op} (?, ?)")
+        params = (*params, *cursor)
+    order = "DESC" if direction == "older" else "ASC"
+
+    sql = select
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += f" ORDER BY notes.created_at {order}, notes.id {order} LIMIT ?"
+
+    with _conn() as con:
+        # One extra row tells us whether another page exists
+        rows = con.execute(sql, (*params, page_size + 1)).fetchall()
+
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        next_cursor = (last[created_at_index], last[0])
+    if direction == "newer":
+        rows.reverse()
+    return rows, next_cursor
+
+
+@_cached_read(_user_scope)
+def get_user_notes_page(user_id: int, cursor=None, page_size: int = PAGE_SIZE, direction: str = "older"):
+    """
+    Retrieves one page of a user's notes, newest first.
+    Rows are (id, title, preview, created_at, pdf_path, pdf_status, pdf_name). Returns (rows, next_cursor).
+    """
+    return _keyset_page(
+        "SELECT id, title, preview, created_at, pdf_path, pdf_status, pdf_name FROM notes",
+        "notes.user_id = ?",
+        (user_id,),
+        cursor,
+        page_size,
+        direction,
+        created_at_index=3,
+    )
+
+
+@_cached_read("notes")
+def get_all_notes_page(cursor=None, page_size: int = PAGE_SIZE, direction: str = "older"):
+    """
+    Retrieves one page of all users' notes, newest first.
+    Rows are (id, email, title, preview, created_at, pdf_path, pdf_name). Returns (rows, next_cursor).
+    """
+    return _keyset_page(
+        "SELECT notes.id, users.email, notes.title, notes.preview, notes.created_at, notes.pdf_path, notes.pdf_name FROM notes JOIN users ON notes.user_id = users.id",
+        "",
+        (),
+        cursor,
+        page_size,
+        direction,
+        created_at_index=4,
+    )
+
+
+# ---------- FULL-TEXT SEARCH ----------
+
+_SEARCH_WORD = re.compile(r"\w+", re.UNICODE)
+
+SEARCH_MIN_CHARS = 3        # shorter input finds nothing; the last word is a prefix from this length on
+SEARCH_RANK_LIMIT = 200     # newest matches ranked per search
+
+
+def _fts_match(query: str, user_id: int | None) -> str:
+    """
+    Turn what the user typed into an FTS5 query: every word must match, and
+    the last one, which may still be being typed, also matches as a prefix.
+    Returns "" (nothing to search) for input under SEARCH_MIN_CHARS.
+    """
+    words = _SEARCH_WORD.findall(query.lower())
+    if sum(map(len, words)) < SEARCH_MIN_CHARS:
+        return ""
+    terms = [f'"{word}"' for word in words]
+    if len(words[-1]) >= SEARCH_MIN_CHARS:
+        terms[-1] += "*"
+    match = "{title body pdf_text} : (" + " ".join(terms) + ")"
+    if user_id is not None:
+        match = f"owner : u{int(user_id)} AND {match}"
+    return match
+
+
+@_cached_read(lambda user_id, *args, **kwargs: "notes" if user_id is None else f"user:{user_id}")
+def search_notes(user_id: int | None, query: str, limit: int = PAGE_SIZE):
+    """
+    Full-text search over titles, contents and PDF text, best matches first.
+    Pass user_id=None to search every user's notes.
+    Rows are (id, email, title, snippet, created_at, pdf_path, pdf_name);
+    the snippet marks matches in **bold**.
+
+    Of the newest SEARCH_RANK_LIMIT matches, those whose title matches more
+    often come first, newer notes first otherwise. FTS5 stops reading after
+    them, so a word found in most notes costs no more than a rare one (bm25
+    would first count every note containing each word).
+    """
+    match = _fts_match(query, user_id)
+    if not match:
+        return []
+    with _conn() as con:
+        candidates = con.execute(
+            "SELECT rowid, highlight(notes_fts, 0, char(1), '') FROM notes_fts WHERE notes_fts MATCH ? "
+            "ORDER BY rowid DESC LIMIT ?",
+            (match, SEARCH_RANK_LIMIT),
+        ).fetchall()
+        ranked = [note_id for note_id, title in sorted(candidates, key=lambda row: -row[1].count("\x01"))][:limit]
+        if not ranked:
+            return []
+        # One pass over the candidates' rowid range; "+" keeps SQLite from looking the
+        # ids up one by one, which runs the match (and merges prefix terms) once per id
+        rows = con.execute(
+            "SELECT notes.id, users.email, notes.title, snippet(notes_fts, -1, '**', '**', '…', 16), "
+            "notes.created_at, notes.pdf_path, notes.pdf_name "
+            "FROM notes_fts JOIN notes ON notes.id = notes_fts.rowid JOIN users ON users.id = notes.user_id "
+            "WHERE notes_fts MATCH ? AND notes_fts.rowid BETWEEN ? AND ? "
+            f"AND +notes_fts.rowid IN ({', '.join('?' * len(ranked))})",
+            (match, min(ranked), max(ranked), *ranked),
+        ).fetchall()
+    order = {note_id: position for position, note_id in enumerate(ranked)}
+    return sorted(rows, key=lambda row: order[row[0]])
+
+
 def delete_note(note_id: int, user_id: int) -> bool:
-    """Deletes a note if it belongs to the user. Returns True if successful."""
+    """
+    Deletes a note if it belongs to the user. Returns True if successful.
+    Its PDF text, chunks and PDF reference go with it (ON DELETE CASCADE).
+    """
     try:
-        with _conn() as con:
-            con.execute(
-                "DELETE FROM notes WHERE id = ? AND user_id = ?",
-                (note_id, user_id),
-            )
+        with _conn(write=True) as con:
+            _context_remove(con, user_id, note_id)
+            con.execute("DELETE FROM notes WHERE id = ? AND user_id = ?", (note_id, user_id))
+        _invalidate("notes", f"user:{user_id}")
         return True
     except Exception:
         return False
 
 
+# ---------- BULK IMPORT / EXPORT ----------
+
+IMPORT_BATCH_SIZE = 5000
+
+
+def _import_batch(con, batch: list[dict]) -> list[int]:
+    """
+    Inserts one batch of notes with a handful of executemany calls and
+    returns their ids. FTS5 flushes its pending index data at the savepoint
+    every trigger opens, so indexing row by row through the insert triggers
+    is several times slower than one INSERT ... SELECT: the row in
+    bulk_import switches them off for this transaction only (see v13).
+    """
+    con.execute("INSERT INTO bulk_import (active) VALUES (1)")
+
+    with_pdf = [note for note in batch if note.get("pdf_hash")]
+    con.executemany(
+        "INSERT INTO pdf_blobs (hash, path, size, ref_count) VALUES (?, ?, ?, 1) "
+        "ON CONFLICT(hash) DO UPDATE SET ref_count = ref_count + 1",
+        ((note["pdf_hash"], note["pdf_path"], note.get("pdf_size")) for note in with_pdf),
+    )
+    # Text that came with the PDF saves extracting it again
+    con.executemany(
+        "UPDATE pdf_blobs SET text = ? WHERE hash = ? AND text IS NULL",
+        ((note["pdf_text"], note["pdf_hash"]) for note in with_pdf if note.get("pdf_text")),
+    )
+
+    def pdf_status(note):
+        if not note.get("pdf_path"):
+            return None
+        return "ready" if note.get("pdf_text") or not note.get("pdf_hash") else "processing"
+
+    # We hold the write lock, so the new rows are exactly those above the current maximum ids
+    last_note = con.execute("SELECT COALESCE(MAX(id), 0) FROM notes").fetchone()[0]
+    last_chunk = con.execute("SELECT COALESCE(MAX(id), 0) FROM note_chunks").fetchone()[0]
+    con.executemany(
+        "INSERT INTO notes (user_id, title, content, preview, created_at, pdf_path, pdf_status, pdf_hash, pdf_name) "
+        "VALUES (?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?, ?, ?, ?)",
+        ((note["user_id"], note["title"], note["content"], _make_preview(note["content"]), note.get("created_at"),
+          note.get("pdf_path"), pdf_status(note), note.get("pdf_hash"), note.get("pdf_name")) for note in batch),
+    )
+    ids = [row[0] for row in con.execute("SELECT id FROM notes WHERE id > ? ORDER BY id", (last_note,))]
+
+    con.executemany(
+        "INSERT INTO note_pdf_text (note_id, text) VALUES (?, ?)",
+        ((note_id, note["pdf_text"]) for note_id, note in zip(ids, batch)
+         if note.get("pdf_text") and not note.get("pdf_hash")),
+    )
+    con.executemany(
+        "INSERT INTO note_chunks (note_id, user_id, text) VALUES (?, ?, ?)",
+        ((note_id, note["user_id"], chunk) for note_id, note in zip(ids, batch)
+         for chunk in retrieval.note_chunks(note["title"], note["content"], note.get("pdf_text") or "")),
+    )
+
+    # What the two triggers would have done, for the whole batch at once
+    con.execute(
+        "INSERT INTO notes_fts(rowid, title, body, pdf_text, owner) "
+        "SELECT notes.id, notes.title, notes.content, COALESCE(note_pdf_text.text, pdf_blobs.text), 'u' || notes.user_id "
+        "FROM notes LEFT JOIN note_pdf_text ON note_pdf_text.note_id = notes.id "
+        "LEFT JOIN pdf_blobs ON pdf_blobs.hash = notes.pdf_hash WHERE notes.id > ?",
+        (last_note,),
+    )
+    con.execute(
+        "INSERT INTO note_chunks_fts(rowid, text) SELECT id, text FROM note_chunks WHERE id > ?",
+        (last_chunk,),
+    )
+    con.execute("DELETE FROM bulk_import")
+
+    # Rebuilt from the notes the next time each owner chats
+    con.executemany(
+        "DELETE FROM notes_context WHERE user_id = ?",
+        ((owner,) for owner in {note["user_id"] for note in batch}),
+    )
+    return ids
+
+
+def import_notes(notes, batch_size: int = IMPORT_BATCH_SIZE, pending_pdfs: list | None = None) -> int:
+    """
+    Bulk-inserts notes and returns how many were imported.
+    notes is any iterable (e.g. a generator reading a file) of dicts with
+    user_id, title and content, and optionally created_at, pdf_text and a PDF
+    already saved with pdf_store (pdf_path, pdf_hash, pdf_name, pdf_size).
+    Each batch is its own transaction, so the app's writes can go in between.
+    PDFs without text are left "processing" for pdf_ingest; pass a list as
+    pending_pdfs to get their (id, pdf_path, pdf_hash) appended to it.
+    """
+    imported = 0
+    iterator = iter(notes)
+    while batch := list(islice(iterator, batch_size)):
+        with _conn(write=True) as con:
+            con.execute("BEGIN IMMEDIATE")
+            ids = _import_batch(con, batch)
+        if pending_pdfs is not None:
+            pending_pdfs.extend(
+                (note_id, note["pdf_path"], note.get("pdf_hash")) for note_id, note in zip(ids, batch)
+                if note.get("pdf_path") and note.get("pdf_hash") and not note.get("pdf_text")
+            )
+        _invalidate("notes", "analysis", *{f"user:{note['user_id']}" for note in batch})
+        imported += len(batch)
+    return imported
+
+
+def export_notes(user_id: int | None = None):
+    """
+    Yields every note (of one user, or of everyone) oldest first, as dicts
+    with email, title, content, created_at, pdf_text, pdf_path, pdf_hash
+    and pdf_name. Rows are read from the cursor as they are consumed.
+    """
+    where, params = ("WHERE notes.user_id = ?", (user_id,)) if user_id is not None else ("", ())
+    with _conn() as con:
+        cur = con.execute(
+            "SELECT users.email, notes.title, notes.content, notes.created_at, "
+            "COALESCE(note_pdf_text.text, pdf_blobs.text), notes.pdf_path, notes.pdf_hash, notes.pdf_name "
+            "FROM notes JOIN users ON users.id = notes.user_id "
+            "LEFT JOIN note_pdf_text ON note_pdf_text.note_id = notes.id "
+            "LEFT JOIN pdf_blobs ON pdf_blobs.hash = notes.pdf_hash "
+            f"{where} ORDER BY notes.created_at, notes.id",
+            params,
+        )
+        for email, title, content, created_at, pdf_text, pdf_path, pdf_hash, pdf_name in cur:
+            yield {
+                "email": email, "title": title, "content": content, "created_at": created_at,
+                "pdf_text": pdf_text, "pdf_path": pdf_path, "pdf_hash": pdf_hash, "pdf_name": pdf_name,
+            }
+
+
+# ---------- NOTE ANALYSIS ----------
+
+def get_notes_to_analyze(user_id: int, only_missing: bool = True):
+    """
+    Retrieves (id, title, content, pdf_text) of the user's notes for batch analysis.
+    With only_missing, notes analyzed since they were saved are skipped.
+    """
+    with _conn() as con:
+        cur = con.execute(
+            "SELECT notes.id, notes.title, notes.content, COALESCE(note_pdf_text.text, pdf_blobs.text) "
+            "FROM notes LEFT JOIN note_pdf_text ON note_pdf_text.note_id = notes.id "
+            "LEFT JOIN pdf_blobs ON pdf_blobs.hash = notes.pdf_hash "
+            "WHERE notes.user_id = ?" + (" AND notes.analyzed_at IS NULL" if only_missing else "") +
+            " ORDER BY notes.created_at DESC, notes.id DESC",
+            (user_id,),
+        )
+        return cur.fetchall()
+
+
+def save_note_analysis(note_id: int, summary: str, sentiment: str, keywords: list[str]):
+    """Stores the AI summary, sentiment and keywords of a note."""
+    with _conn(write=True) as con:
+        con.execute(
+            "UPDATE notes SET summary = ?, sentiment = ?, keywords = ?, analyzed_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (summary, sentiment, ", ".join(keywords), note_id),
+        )
+    _invalidate("analysis")
+
+
+@_cached_read("analysis")
+def get_note_analyses(note_ids: list[int]) -> dict:
+    """Retrieves {note_id: (summary, sentiment, keywords)} for the analyzed notes among note_ids."""
+    if not note_ids:
+        return {}
+    placeholders = ", ".join("?" for _ in note_ids)
+    with _conn() as con:
+        cur = con.execute(
+            f"SELECT id, summary, sentiment, keywords FROM notes WHERE id IN ({placeholders}) AND analyzed_at IS NOT NULL",
+            tuple(note_ids),
+        )
+        return {row[0]: row[1:] for row in cur.fetchall()}
+
+
+# ---------- LLM RESPONSE CACHE ----------
+
+def get_cached_response(key: str, ttl_seconds: float) -> str | None:
+    """Returns a cached LLM response younger than ttl_seconds, or None."""
+    now = time.time()
+    with _conn() as con:
+        row = con.execute(
+            "SELECT response FROM llm_cache WHERE key = ? AND created_at >= ?",
+            (key, now - ttl_seconds),
+        ).fetchone()
+    if row is None:
+        return None
+    with _conn(write=True) as con:
+        con.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+    return row[0]
+
+
+def put_cached_response(key: str, response: str, ttl_seconds: float, max_entries: int):
+    """Stores an LLM response, then drops expired entries and the least recently used beyond max_entries."""
+    now = time.time()
+    with _conn(write=True) as con:
+        con.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, response, created_at, last_used) VALUES (?, ?, ?, ?)",
+            (key, response, now, now),
+        )
+        con.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - ttl_seconds,))
+        con.execute(
+            "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (max_entries,),
+        )
+
+
 # ---------- ADDITIONAL USER FUNCTIONS (for compatibility) ----------
 
-def verify_user(email: str, password: str) -> int | None:
-    """Verifies user credentials with bcrypt. Returns user ID if valid, None otherwise."""
-    row = get_user(email)
+def verify_user(email: str, password: str) -> User | None:
+    """
+    Verifies user credentials with bcrypt. Returns the user if valid, None otherwise.
+    Legacy plaintext passwords and hashes made with an older cost factor are
+    re-hashed with the current settings after a successful login.
+    """
+    with _conn() as con:
+        row = con.execute(
+            f"SELECT {_USER_COLUMNS}, password FROM users WHERE email = ?", (email,)
+        ).fetchone()
     if row is None:
         return None
-    
-    user_id, _, stored_hash = row[0], row[1], row[2]
-    
-    # Handle both old plaintext passwords and new bcrypt hashes
-    if isinstance(stored_hash, str):
-        # Old plaintext password
-        if password == stored_hash:
-            return user_id
-    else:
-        # New bcrypt hash (bytes)
-        if bcrypt.checkpw(password.encode("utf-8"), stored_hash):
-            return user_id
-    
-    return None
+
+    user, stored_hash = User(*row[:-1]), row[-1]
+    if not passwords.check_password(password, stored_hash):
+        return None
+
+    if passwords.needs_rehash(stored_hash):
+        new_hash = passwords.hash_password(password)
+        with _conn(write=True) as con:
+            # Only if the password wasn't changed meanwhile
+            con.execute(
+                "UPDATE users SET password = ? WHERE id = ? AND password = ?",
+                (new_hash, user.id, stored_hash),
+            )
+    return user
 
 
 def add_user(email: str, password: str) -> bool:
@@ -162,8 +1486,8 @@ def update_password(user_id: int, new_password: str) -> bool:
     Returns True if successful, False otherwise.
     """
     try:
-        with _conn() as con:
-            hashed_pwd = bcrypt.hashpw(new_password.encode("utf-8"), bcrypt.gensalt())
+        hashed_pwd = passwords.hash_password(new_password)
+        with _conn(write=True) as con:
             con.execute(
                 "UPDATE users SET password = ? WHERE id = ?",
                 (hashed_pwd, user_id),
@@ -173,14 +1497,113 @@ def update_password(user_id: int, new_password: str) -> bool:
         return False
 
 
-def delete_user(user_id: int) -> bool:
-    """Deletes a user and all their notes. Returns True if successful."""
+# Notes deleted per transaction by delete_user, so other writes go in between
+DELETE_BATCH_SIZE = 2000
+
+
+def delete_user(user_id: int, batch_size: int = DELETE_BATCH_SIZE) -> bool:
+    """
+    Deletes a user and all their notes. Returns True if successful.
+    Notes go batch_size at a time (each batch cascades to their PDF text,
+    chunks and PDF references), then the account itself. PDF files nobody
+    references any more are removed later by maintenance.collect_pdfs.
+    """
     try:
-        with _conn() as con:
-            # Delete all notes for this user
-            con.execute("DELETE FROM notes WHERE user_id = ?", (user_id,))
-            # Delete the user
+        while True:
+            with _conn(write=True) as con:
+                deleted = con.execute(
+                    "DELETE FROM notes WHERE id IN (SELECT id FROM notes WHERE user_id = ? LIMIT ?)",
+                    (user_id, batch_size),
+                ).rowcount
+            _invalidate("notes", f"user:{user_id}")
+            if deleted < batch_size:
+                break
+        with _conn(write=True) as con:
             con.execute("DELETE FROM users WHERE id = ?", (user_id,))
+        _invalidate("notes", f"user:{user_id}")
         return True
     except Exception:
-        return False
\ No newline at end of file
+        return False
+
+
+# ---------- MAINTENANCE ----------
+
+def release_orphan_pdfs(batch_size: int, grace_seconds: float) -> tuple[int, int]:
+    """
+    Removes up to batch_size PDF files no note references any more, with
+    their pdf_blobs rows. Returns (files removed, bytes freed).
+    Files touched in the last grace_seconds are kept: pdf_store.put touches
+    an existing file before the note that re-uses it is saved.
+    """
+    removed = freed = 0
+    with _conn(write=True) as con:
+        rows = con.execute(
+            "SELECT hash, path, size FROM pdf_blobs WHERE ref_count <= 0 LIMIT ?", (batch_size,)
+        ).fetchall()
+        for blob_hash, path, size in rows:
+            try:
+                if time.time() - os.path.getmtime(path) < grace_seconds:
+                    continue
+                os.remove(path)
+            except FileNotFoundError:
+                size = 0
+            except OSError:
+                continue
+            con.execute("DELETE FROM pdf_blobs WHERE hash = ? AND ref_count <= 0", (blob_hash,))
+            removed += 1
+            freed += size or 0
+    return removed, freed
+
+
+def get_referenced_pdf_paths() -> set[str]:
+    """Every PDF path a note or pdf_blobs row points to (normalized)."""
+    with _conn() as con:
+        cur = con.execute("SELECT pdf_path FROM notes WHERE pdf_path IS NOT NULL UNION SELECT path FROM pdf_blobs")
+        return {os.path.normpath(row[0]) for row in cur}
+
+
+def get_free_pages() -> tuple[int, int]:
+    """(free pages, page size) of the database file."""
+    with _conn() as con:
+        free = con.execute("PRAGMA freelist_count").fetchone()[0]
+        page_size = con.execute("PRAGMA page_size").fetchone()[0]
+    return free, page_size
+
+
+def enable_incremental_vacuum() -> bool:
+    """
+    Switches a database file created before incremental auto-vacuum to it,
+    which takes rewriting the file (VACUUM) once; writes wait meanwhile.
+    Returns whether the file has it. A failed rewrite (a full disk, say) is
+    logged rather than raised; maintenance.reclaim_space tries again.
+    """
+    with _conn(write=True) as con:
+        if con.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return True
+        try:
+            con.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            con.execute("VACUUM")
+        except sqlite3.Error as e:
+            _log.warning("Could not switch %s to incremental auto-vacuum: %s", DB_PATH, e)
+            return False
+    return True
+
+
+def incremental_vacuum(pages: int) -> int:
+    """Gives up to `pages` free pages back to the file system; returns how many."""
+    with _conn(write=True) as con:
+        if con.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+        before = con.execute("PRAGMA freelist_count").fetchone()[0]
+        # execute() would step the pragma once, giving back a single page
+        con.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+        return before - con.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+def vacuum():
+    """
+    Rewrites the whole database file compactly. Writes wait until it is done,
+    so run it off-peak.
+    """
+    with _conn(write=True) as con:
+        con.execute("VACUUM")
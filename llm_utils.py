@@ -1,8 +1,16 @@
 
+import hashlib
+import json
 import os # Lets you interact with files, folders, and environment variables
-from openai import OpenAI # openai is the official Python client library for the OpenAI API (installed it with pip install openai), we use "OpenAI" for the functions
+import threading
+import time
+import httpx # HTTP library the OpenAI client uses; we configure its connection pool
+from openai import AsyncOpenAI, OpenAI # openai is the official Python client library for the OpenAI API (installed it with pip install openai), we use "OpenAI" for the functions
 # os gets API keys, openai connects to the AI API
 
+import db
+from retrieval import count_tokens
+
 # llm_utils.py
 # Handles AI features: summarize / sentiment / keywords / chat
 
@@ -10,43 +18,192 @@ from openai import OpenAI # openai is the official Python client library for the
 MODEL = "gpt-4o-mini"   # model used
 
 
+# Client settings (shared by every Streamlit session in this process)
+TIMEOUT_SECONDS = 60            # whole request; connecting gets CONNECT_TIMEOUT_SECONDS
+CONNECT_TIMEOUT_SECONDS = 5
+MAX_RETRIES = 3                 # retried with exponential backoff by the OpenAI client
+MAX_CONNECTIONS = 20            # HTTP connections kept open to the API
+MAX_CONCURRENT_REQUESTS = 8     # requests in flight at once; the rest wait their turn
+
+_client = None
+_client_settings = None         # (api_key, base_url) the client was built with
+_client_lock = threading.Lock()
+_request_slots = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
+# Response cache for summarize / sentiment / keywords (stored in app.db)
+BASIC_TEMPERATURE = 0.4
+CACHE_TTL_SECONDS = 7 * 24 * 3600
+CACHE_MAX_ENTRIES = 5000
+
+_cache_stats = {"hits": 0, "misses": 0, "hit_ms": 0.0, "miss_ms": 0.0}
+_cache_stats_lock = threading.Lock()
+
+# Chat prompt budget (tokens, counted locally with retrieval.count_tokens)
+CHAT_PROMPT_TOKENS = 4000       # whole prompt: instructions, notes excerpts, history and message
+HISTORY_TOKENS = 1200           # of which earlier turns: the running summary plus recent messages
+RECENT_MESSAGES = 6             # latest messages, always kept word for word while they fit
+SUMMARY_BATCH = 6               # older messages are folded into the summary this many at a time
+MESSAGE_TOKENS = 4              # per-message overhead of the chat format
+
+# Prompt caching: the provider bills repeated prompt prefixes at a discount,
+# so chat prompts put what stays the same first (see _chat_messages)
+_usage_stats = {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0}
+_usage_stats_lock = threading.Lock()
+
+_NOT_LOADED = object()
+_secrets_key = _NOT_LOADED      # OPENAI_API_KEY from secrets.py, read once
+
+
 def _get_api_key():
     """
     1) Try environment variable OPENAI_API_KEY
-    2) If not found, try secrets.py (local file, not in git)
+    2) If not found, try secrets.py (local file, not in git); it is only
+       read the first time
     """
     key = os.getenv("OPENAI_API_KEY")
     if key:
         return key
 
-    try:
-        # Import from local secrets.py file
-        import sys
-        import importlib.util
-        spec = importlib.util.spec_from_file_location("secrets", "secrets.py")
-        if spec and spec.loader:
-            secrets_module = importlib.util.module_from_spec(spec)
-            spec.loader.exec_module(secrets_module)
-            return secrets_module.OPENAI_API_KEY
-    except Exception:
-        pass
+    global _secrets_key
+    if _secrets_key is _NOT_LOADED:
+        _secrets_key = None
+        try:
+            # Import from local secrets.py file
+            import importlib.util
+            spec = importlib.util.spec_from_file_location("secrets", "secrets.py")
+            if spec and spec.loader:
+                secrets_module = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(secrets_module)
+                _secrets_key = secrets_module.OPENAI_API_KEY
+        except Exception:
+            pass
     
-    return None
+    return _secrets_key
 
 
 def _get_client():
-    """Return an OpenAI client, or None if no API key is configured."""
+    """
+    Return the shared OpenAI client, or None if no API key is configured.
+    The client keeps HTTP connections alive between calls, so only the
+    first request pays for the connection and TLS handshake.
+    """
+    global _client, _client_settings
     api_key = _get_api_key()
     if not api_key:
         return None
-    return OpenAI(api_key=api_key)
+
+    settings = (api_key, os.getenv("OPENAI_BASE_URL"))
+    with _client_lock:
+        if _client is None or _client_settings != settings:
+            _client = OpenAI(
+                api_key=api_key,
+                timeout=httpx.Timeout(TIMEOUT_SECONDS, connect=CONNECT_TIMEOUT_SECONDS),
+                max_retries=MAX_RETRIES,
+                http_client=httpx.Client(
+                    limits=httpx.Limits(
+                        max_connections=MAX_CONNECTIONS,
+                        max_keepalive_connections=MAX_CONNECTIONS,
+                    ),
+                ),
+            )
+            _client_settings = settings
+        return _client
+
+
+def _cache_key(system_prompt: str, user_input: str) -> str:
+    raw = json.dumps([MODEL, BASIC_TEMPERATURE, system_prompt, user_input])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def cached_reply(system_prompt: str, user_input: str) -> str | None:
+    """The stored reply to this prompt and input, if younger than CACHE_TTL_SECONDS."""
+    return db.get_cached_response(_cache_key(system_prompt, user_input), CACHE_TTL_SECONDS)
+
+
+def store_reply(system_prompt: str, user_input: str, reply: str):
+    """Remember a reply the API just gave (at MODEL and BASIC_TEMPERATURE) for cached_reply."""
+    db.put_cached_response(_cache_key(system_prompt, user_input), reply, CACHE_TTL_SECONDS, CACHE_MAX_ENTRIES)
+
+
+def _count_cache(hit: bool, started: float):
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    with _cache_stats_lock:
+        if hit:
+            _cache_stats["hits"] += 1
+            _cache_stats["hit_ms"] += elapsed_ms
+        else:
+            _cache_stats["misses"] += 1
+            _cache_stats["miss_ms"] += elapsed_ms
+
+
+def get_cache_stats() -> dict:
+    """Hit/miss counts and average latency of the _basic_call response cache."""
+    with _cache_stats_lock:
+        stats = dict(_cache_stats)
+    stats["avg_hit_ms"] = stats["hit_ms"] / stats["hits"] if stats["hits"] else 0.0
+    stats["avg_miss_ms"] = stats["miss_ms"] / stats["misses"] if stats["misses"] else 0.0
+    return stats
+
+
+def _record_usage(usage, timing: dict | None = None):
+    """Count the prompt tokens of a response, and how many the provider served from its prompt cache."""
+    if usage is None:
+        return
+    prompt = usage.prompt_tokens or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) or 0
+    with _usage_stats_lock:
+        _usage_stats["requests"] += 1
+        _usage_stats["prompt_tokens"] += prompt
+        _usage_stats["cached_tokens"] += cached
+    if timing is not None:
+        timing["cached_tokens"] = cached
+
+
+def get_prompt_cache_stats() -> dict:
+    """Prompt tokens sent so far, split into cached and uncached (as reported by the API)."""
+    with _usage_stats_lock:
+        stats = dict(_usage_stats)
+    stats["uncached_tokens"] = stats["prompt_tokens"] - stats["cached_tokens"]
+    stats["cached_share"] = stats["cached_tokens"] / stats["prompt_tokens"] if stats["prompt_tokens"] else 0.0
+    return stats
+
+
+def get_async_client():
+    """
+    Return a new AsyncOpenAI client with the same settings as _get_client,
+    or None if no API key is configured. Async clients are tied to the event
+    loop that uses them, so the caller owns it and must close() it.
+    """
+    api_key = _get_api_key()
+    if not api_key:
+        return None
+    return AsyncOpenAI(
+        api_key=api_key,
+        timeout=httpx.Timeout(TIMEOUT_SECONDS, connect=CONNECT_TIMEOUT_SECONDS),
+        max_retries=MAX_RETRIES,
+        http_client=httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_CONNECTIONS,
+            ),
+        ),
+    )
 
 
 def _basic_call(system_prompt: str, user_input: str) -> str:
     """
     Helper function: sends text to the model and returns its reply as a string.
     Used by summarize_text, analyze_sentiment and extract_keywords.
+    The reply only depends on the model, prompt and text, so answers are
+    cached and the same request is served from app.db for CACHE_TTL_SECONDS.
     """
+    started = time.perf_counter()
+    cached = cached_reply(system_prompt, user_input)
+    if cached is not None:
+        _count_cache(True, started)
+        return cached
+
     client = _get_client()
     if client is None:
         return (
@@ -55,18 +212,24 @@ def _basic_call(system_prompt: str, user_input: str) -> str:
         )
 
     try:
-        resp = client.chat.completions.create(
-            model=MODEL,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_input},
-            ],
-            temperature=0.4,
-        )
-        return resp.choices[0].message.content.strip()
+        with _request_slots:
+            resp = client.chat.completions.create(
+                model=MODEL,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_input},
+                ],
+                temperature=BASIC_TEMPERATURE,
+            )
+        _record_usage(resp.usage)
+        reply = resp.choices[0].message.content.strip()
     except Exception as e:
         return f"[LLM error] {e}"
 
+    store_reply(system_prompt, user_input, reply)
+    _count_cache(False, started)
+    return reply
+
 
 #Public functions used by Streamlit#
 
@@ -106,18 +269,159 @@ def extract_keywords(text: str) -> list[str]:
     return parts
 
 
-def chat_reply(message: str, history: list[dict] | None = None, notes_context: str = "") -> str:
+def _summarize_turns(summary: str, messages: list[dict]) -> str | None:
+    """
+    Running summary of a conversation: the previous summary with more messages
+    folded in. Goes through _basic_call, so the same step is never paid twice.
+    None if the model can't be reached (the messages are then just dropped).
+    """
+    if _get_client() is None:
+        return None
+    system = (
+        "You keep a running summary of a conversation between a user and the assistant "
+        "of a notes app. Update the summary with the new messages. Keep names, facts, "
+        "decisions and open questions; drop small talk. At most 150 words."
+    )
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    text = f"Summary so far:\n{summary or '(none)'}\n\nNew messages:\n{transcript}"
+    reply = _basic_call(system, text)
+    if reply.startswith("[LLM error]"):
+        return None
+    return reply
+
+
+def compact_history(history: list[dict] | None, memory: dict | None = None,
+                    budget: int | None = None) -> list[dict]:
+    """
+    The part of a chat history that is sent with the next message: a summary
+    of older turns followed by the most recent messages, within `budget`
+    tokens (HISTORY_TOKENS by default).
+
+    memory is a dict the caller keeps between turns (e.g. in st.session_state);
+    it holds the running summary ("summary") and how many messages of history
+    it covers ("summarized"). Without it, older turns are simply left out.
+    """
+    history = history or []
+    budget = HISTORY_TOKENS if budget is None else budget
+    if memory is not None and memory.get("summarized", 0) > len(history):
+        # The history was cleared or replaced
+        memory.clear()
+    summarized = memory.get("summarized", 0) if memory else 0
+
+    # Fold messages that have left the recent window into the summary, in batches
+    older = len(history) - RECENT_MESSAGES
+    if memory is not None and older - summarized >= SUMMARY_BATCH:
+        summary = _summarize_turns(memory.get("summary", ""), history[summarized:older])
+        if summary is not None:
+            memory["summary"], memory["summarized"] = summary, older
+            summarized = older
+
+    summary = memory.get("summary", "") if memory else ""
+    if summary:
+        budget -= count_tokens(summary) + MESSAGE_TOKENS
+
+    # Newest messages first, until the budget is used
+    kept = []
+    for msg in reversed(history[summarized:]):
+        cost = count_tokens(msg["content"]) + MESSAGE_TOKENS
+        if cost > budget:
+            break
+        kept.append(msg)
+        budget -= cost
+    kept.reverse()
+
+    if summary:
+        kept.insert(0, {"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+    return kept
+
+
+def _fit_context(notes_context: str, budget: int) -> str:
+    """Drop the last (lowest-ranked) excerpts of notes_context until it fits in budget tokens."""
+    if count_tokens(notes_context) <= budget:
+        return notes_context
+    header, _, body = notes_context.rpartition(":\n\n")
+    picked, used = [], count_tokens(header) + 1
+    for excerpt in body.split("\n\n"):
+        cost = count_tokens(excerpt) + 1
+        if used + cost > budget:
+            break
+        picked.append(excerpt)
+        used += cost
+    if not picked:
+        return ""
+    return f"{header}:\n\n" + "\n\n".join(picked)
+
+
+CHAT_INSTRUCTIONS = (
+    "You are a friendly, helpful assistant inside a notes app. "
+    "Answer in a natural, simple way. Be short and to the point. "
+    "You have access to the user's notes and can reference them to answer questions."
+)
+
+
+def notes_block(notes: str) -> str:
+    """
+    The notes section of the chat instructions. notes is a user's notes as
+    db.get_notes_context writes them (sorted by ID), so the same notes always
+    give the same bytes and a new note only adds to the end.
+    """
+    return f"\n\nHere are the user's notes:\n\n{notes}" if notes else ""
+
+
+def _chat_messages(message: str, history: list[dict] | None, notes_context: str,
+                   memory: dict | None = None, notes: str = "") -> list[dict]:
+    """
+    Build the message list sent by chat_reply and chat_reply_stream.
+
+    Stable content comes first so consecutive turns share a byte-identical
+    prefix the provider can serve from its prompt cache: the instructions
+    with the user's notes (see notes_block), then the summary of older turns
+    and the recent messages, which only grow between summary updates. What
+    changes every turn, the excerpts retrieved for this message and the
+    message itself, goes last.
+
+    The prompt stays within CHAT_PROMPT_TOKENS: earlier turns are compacted
+    (see compact_history) and excerpts that don't fit are left out.
+    """
+    system_message = CHAT_INSTRUCTIONS + notes_block(notes)
+    past = compact_history(history, memory)
+
+    tail = []
+    if notes_context:
+        used = prompt_tokens([{"content": system_message}, *past, {"content": message}]) + MESSAGE_TOKENS
+        excerpts = _fit_context(notes_context, CHAT_PROMPT_TOKENS - used).lstrip()
+        if excerpts:
+            tail.append({"role": "system", "content": excerpts})
+
+    return [
+        {
+            "role": "system",
+            "content": system_message,
+        },
+        *past,
+        *tail,
+        {"role": "user", "content": message},
+    ]
+
+
+def prompt_tokens(messages: list[dict]) -> int:
+    """Local estimate of the prompt tokens of a message list."""
+    return sum(count_tokens(m["content"]) + MESSAGE_TOKENS for m in messages)
+
+
+def chat_reply(message: str, history: list[dict] | None = None, notes_context: str = "",
+               memory: dict | None = None, notes: str = "") -> str:
     """
     Simple chatbot reply with notes context.
 
     history is a list of previous messages:
         [{"role": "user", "content": "hi"},
          {"role": "assistant", "content": "hello"}]
-    notes_context is a string containing all the user's notes
+    notes_context is a string containing the parts of the user's notes relevant
+    to this message; notes, if given, are all of the user's notes, sent with
+    every message (see notes_block)
+    memory keeps the running summary of older turns between calls (see compact_history)
     """
-    if history is None:
-        history = []
-
     client = _get_client()
     if client is None:
         return (
@@ -125,30 +429,70 @@ def chat_reply(message: str, history: list[dict] | None = None, notes_context: s
             "variable or create secrets.py with OPENAI_API_KEY."
         )
 
-    system_message = (
-        "You are a friendly, helpful assistant inside a notes app. "
-        "Answer in a natural, simple way. Be short and to the point. "
-        "You have access to the user's notes and can reference them to answer questions."
-    )
-    
-    if notes_context:
-        system_message += notes_context
+    try:
+        # Built before taking a slot: compacting the history may call _basic_call, which takes one too
+        messages = _chat_messages(message, history, notes_context, memory, notes)
+        with _request_slots:
+            resp = client.chat.completions.create(
+                model=MODEL,
+                messages=messages,
+                temperature=0.6,
+            )
+        _record_usage(resp.usage)
+        return resp.choices[0].message.content.strip()
+    except Exception as e:
+        return f"[LLM error] {e}"
 
-    messages = [
-        {
-            "role": "system",
-            "content": system_message,
-        },
-        *history,
-        {"role": "user", "content": message},
-    ]
 
-    try:
-        resp = client.chat.completions.create(
-            model=MODEL,
-            messages=messages,
-            temperature=0.6,
+def chat_reply_stream(message: str, history: list[dict] | None = None, notes_context: str = "",
+                      timing: dict | None = None, memory: dict | None = None, notes: str = ""):
+    """
+    Same as chat_reply, but yields the answer piece by piece as it is generated
+    (for st.write_stream).
+
+    If a timing dict is passed it is filled with "prompt_tokens" (local
+    estimate), "cached_tokens" (how many of them the provider had cached),
+    "first_token_ms" (time until the first piece of text arrived) and "total_ms".
+    """
+    start = time.perf_counter()
+
+    def record(key):
+        if timing is not None:
+            timing[key] = (time.perf_counter() - start) * 1000
+
+    client = _get_client()
+    if client is None:
+        yield (
+            "[LLM not configured] Set OPENAI_API_KEY as an environment "
+            "variable or create secrets.py with OPENAI_API_KEY."
         )
-        return resp.choices[0].message.content.strip()
+        return
+
+    messages = _chat_messages(message, history, notes_context, memory, notes)
+    if timing is not None:
+        timing["prompt_tokens"] = prompt_tokens(messages)
+
+    try:
+        # The slot is held until the whole answer has streamed in
+        with _request_slots:
+            stream = client.chat.completions.create(
+                model=MODEL,
+                messages=messages,
+                temperature=0.6,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            for chunk in stream:
+                if not chunk.choices:
+                    # The last chunk carries the token usage
+                    _record_usage(chunk.usage, timing)
+                    continue
+                piece = chunk.choices[0].delta.content
+                if piece:
+                    if timing is not None and "first_token_ms" not in timing:
+                        record("first_token_ms")
+                    yield piece
     except Exception as e:
-        return f"[LLM error] {e}"
\ No newline at end of file
+        yield f"[LLM error] {e}"
+    finally:
+        record("total_ms")
@@ -0,0 +1,174 @@
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+import pdf_store
+
+# maintenance.py
+# Background housekeeping for the app process. Deleting an account, removing
+# PDF files no note references any more and giving the pages freed by deletes
+# back to the file system all run on one worker thread, so the page never
+# waits for them and they never compete with each other for the write lock.
+# start() schedules a pass every INTERVAL_SECONDS; it can also run by hand:
+#
+#   python maintenance.py            # one pass
+#   python maintenance.py --vacuum   # and rewrite the database file (VACUUM)
+
+
+INTERVAL_SECONDS = 600          # between housekeeping passes
+GC_BATCH_SIZE = 200             # PDF files removed per write transaction
+GRACE_SECONDS = 3600            # files written or re-used more recently are left alone
+VACUUM_MIN_FREE_PAGES = 1024    # free pages before giving them back is worth it
+VACUUM_STEP_PAGES = 2048        # pages given back per write transaction
+
+_worker = None
+_lock = threading.Lock()
+_started = False
+
+_stats = {"passes": 0, "users_deleted": 0, "files_removed": 0, "bytes_removed": 0, "bytes_vacuumed": 0}
+_stats_lock = threading.Lock()
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _worker
+    with _lock:
+        if _worker is None:
+            _worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="maintenance")
+        return _worker
+
+
+def _count(**amounts):
+    with _stats_lock:
+        for key, amount in amounts.items():
+            _stats[key] += amount
+
+
+def collect_pdfs(grace_seconds: float = GRACE_SECONDS) -> tuple[int, int]:
+    """
+    Removes PDF files that no note references: shared files whose last note
+    was deleted (in batches of GC_BATCH_SIZE), then any other file under
+    pdf_store.PDF_DIR the database doesn't know, such as per-user files of
+    notes deleted before PDFs were shared. Returns (files, bytes).
+    """
+    files = freed = 0
+    while True:
+        removed, size = db.release_orphan_pdfs(GC_BATCH_SIZE, grace_seconds)
+        files += removed
+        freed += size
+        if removed < GC_BATCH_SIZE:
+            break
+
+    referenced = db.get_referenced_pdf_paths()
+    now = time.time()
+    for folder, _, names in os.walk(pdf_store.PDF_DIR):
+        for name in names:
+            path = os.path.join(folder, name)
+            if os.path.normpath(path) in referenced:
+                continue
+            try:
+                size = os.path.getsize(path)
+                if now - os.path.getmtime(path) < grace_seconds:
+                    continue
+                os.remove(path)
+            except OSError:
+                continue
+            files += 1
+            freed += size
+
+    _count(files_removed=files, bytes_removed=freed)
+    return files, freed
+
+
+def reclaim_space() -> int:
+    """
+    Gives free database pages back to the file system, VACUUM_STEP_PAGES per
+    transaction, once at least VACUUM_MIN_FREE_PAGES are free. Returns bytes.
+    Needs incremental auto-vacuum, which db.init_db turns on; if that failed,
+    this tries again first.
+    """
+    if not db.enable_incremental_vacuum():
+        return 0
+    free, page_size = db.get_free_pages()
+    if free < VACUUM_MIN_FREE_PAGES:
+        return 0
+    pages = 0
+    while released := db.incremental_vacuum(VACUUM_STEP_PAGES):
+        pages += released
+    _count(bytes_vacuumed=pages * page_size)
+    return pages * page_size
+
+
+def run_once(grace_seconds: float = GRACE_SECONDS) -> dict:
+    """One housekeeping pass; returns what it removed."""
+    files, freed = collect_pdfs(grace_seconds)
+    vacuumed = reclaim_space()
+    _count(passes=1)
+    return {"files_removed": files, "bytes_removed": freed, "bytes_vacuumed": vacuumed}
+
+
+def _delete_user(user_id: int) -> bool:
+    if not db.delete_user(user_id):
+        return False
+    _count(users_deleted=1)
+    # A job of its own, so the caller hears about the deletion without waiting for the cleanup
+    _executor().submit(run_once)
+    return True
+
+
+def delete_user(user_id: int):
+    """
+    Delete an account on the maintenance thread (see db.delete_user). Returns
+    a Future resolving to True once it was deleted; a housekeeping pass to
+    clean up after it is queued behind.
+    """
+    return _executor().submit(_delete_user, user_id)
+
+
+def _schedule():
+    while True:
+        time.sleep(INTERVAL_SECONDS)
+        _executor().submit(run_once)
+
+
+def start():
+    """Run a housekeeping pass every INTERVAL_SECONDS (once per process)."""
+    global _started
+    with _lock:
+        if _started:
+            return
+        _started = True
+    threading.Thread(target=_schedule, name="maintenance-timer", daemon=True).start()
+
+
+def get_stats() -> dict:
+    """What maintenance has done in this process so far."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def main(argv) -> int:
+    parser = argparse.ArgumentParser(prog="maintenance.py", description="Remove unreferenced PDFs and reclaim disk space.")
+    parser.add_argument("--db", default=db.DB_PATH, help=f"database file (default {db.DB_PATH})")
+    parser.add_argument("--pdf-dir", default=pdf_store.PDF_DIR, help=f"PDF folder of that database (default {pdf_store.PDF_DIR})")
+    parser.add_argument("--grace", type=float, default=GRACE_SECONDS, help="keep files touched in the last GRACE seconds")
+    parser.add_argument("--vacuum", action="store_true", help="also rewrite the database file; writes wait meanwhile")
+    args = parser.parse_args(argv)
+    db.DB_PATH = args.db
+    pdf_store.PDF_DIR = args.pdf_dir
+    db.init_db()
+
+    size_before = os.path.getsize(db.DB_PATH)
+    result = run_once(args.grace)
+    if args.vacuum:
+        db.vacuum()
+    print(f"Removed {result['files_removed']} PDF files ({result['bytes_removed']} bytes); "
+          f"database file {size_before} -> {os.path.getsize(db.DB_PATH)} bytes", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
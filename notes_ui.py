@@ -0,0 +1,300 @@
+import base64
+import os
+import sqlite3
+
+import streamlit as st
+
+from db import (
+    create_note,
+    get_user_notes_page,
+    get_all_notes_page,
+    get_note_content,
+    get_notes_context,
+    get_pdf_status,
+    delete_note,
+    search_note_chunks,
+    get_recent_note_chunks,
+    get_note_analyses,
+    search_notes,
+)
+from llm_utils import chat_reply_stream
+from batch_analysis import analyze_user_notes
+import pdf_ingest
+import pdf_store
+import retrieval
+
+# notes_ui.py
+# The My Notes, All Notes and Chatbot tabs. Each tab (and each per-note
+# toggle) is a st.fragment, so clicking or typing in one of them reruns only
+# that part of the page instead of the whole app. Changes other tabs must
+# see (saving or deleting a note) still rerun the whole app.
+
+
+def load_pages(state_key: str, fetch_page):
+    """
+    Fetch as many keyset pages as the user has asked to see.
+    st.session_state[state_key] holds the number of pages shown; returns
+    (rows, next_cursor) where next_cursor is None once everything is loaded.
+    """
+    pages = st.session_state.setdefault(state_key, 1)
+    rows, cursor = [], None
+    for _ in range(pages):
+        page, cursor = fetch_page(cursor)
+        rows.extend(page)
+        if cursor is None:
+            break
+    return rows, cursor
+
+
+def _show_more(state_key: str):
+    st.session_state[state_key] += 1
+
+
+def load_more_button(state_key: str):
+    """Show one more page of the listing (the surrounding fragment reruns)."""
+    st.button("Load more", key=f"{state_key}_more", on_click=_show_more, args=(state_key,))
+
+
+@st.fragment
+def show_note_body(note_id: int, preview: str, key_prefix: str):
+    """Show a note's preview, fetching the full body only when asked to."""
+    if not preview:
+        return
+    if preview.endswith("…") and st.toggle("Show full note", key=f"{key_prefix}_full_{note_id}"):
+        st.write(get_note_content(note_id))
+    else:
+        st.write(preview)
+
+
+@st.fragment(run_every=1)
+def pdf_progress(note_id: int):
+    """Poll a note's background PDF extraction and refresh the page when it ends."""
+    status = get_pdf_status(note_id)
+    if status is None or status[0] != "processing":
+        st.rerun()
+    _, done, total = status
+    st.progress(done / total if total else 0.0, text=f"Extracting PDF text… {done}/{total or '?'} pages")
+
+
+# Previews bigger than this are not inlined into the page
+MAX_PREVIEW_BYTES = 2 * 1024 * 1024
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def pdf_preview(pdf_path: str) -> bytes:
+    """First page of a PDF as its own small PDF (cached across reruns)."""
+    return pdf_store.first_page_pdf(pdf_path)
+
+
+def pdf_download_button(note_id: int, pdf_path: str, file_name: str, key_prefix: str):
+    """Download button that only reads the file when it is clicked."""
+    def read_pdf():
+        with open(pdf_path, "rb") as f:
+            return f.read()
+
+    st.download_button("📄 Download PDF", read_pdf, file_name=file_name, mime="application/pdf",
+                       key=f"{key_prefix}_download_{note_id}", on_click="ignore")
+
+
+@st.fragment
+def show_pdf_preview(note_id: int, pdf_path: str):
+    """Inline the first page of a PDF, only once the user asks for it."""
+    if not st.toggle("Preview PDF", key=f"preview_{note_id}"):
+        return
+    try:
+        preview = pdf_preview(pdf_path)
+    except Exception as e:
+        st.warning(f"Could not preview PDF: {e}")
+        return
+    if len(preview) > MAX_PREVIEW_BYTES:
+        st.info("This PDF is too large to preview; download it instead.")
+        return
+    base64_pdf = base64.b64encode(preview).decode("utf-8")
+    pdf_display = f'<iframe src="data:application/pdf;base64,{base64_pdf}" width="700" height="500" type="application/pdf"></iframe>'
+    st.markdown(pdf_display, unsafe_allow_html=True)
+
+
+def show_search_results(results, show_author: bool):
+    """List full-text search hits with the matching snippet."""
+    if not results:
+        st.info("No notes match your search.")
+        return
+    for note_id, email, title, snippet, created_at, pdf_path, pdf_name in results:
+        st.markdown(f"### {title}  \n*by {email}*" if show_author else f"### {title}")
+        st.markdown(snippet)
+        st.caption(f"Created at: {created_at}")
+        st.markdown("---")
+
+
+def note_editor(user: dict):
+    """Form for a new note; nothing reruns while the user types, only on Save."""
+    st.subheader("Create a new note")
+
+    with st.form("new_note"):
+        title = st.text_input("Title")
+        content = st.text_area("Content/Description")
+        uploaded_file = st.file_uploader("Attach PDF (optional)", type=["pdf"])
+        submitted = st.form_submit_button("Save Note")
+
+    if submitted:
+        if not title.strip():
+            st.warning("Please provide a title.")
+        elif not content.strip():
+            st.warning("Please provide a description/content.")
+        elif user.get("id") is None:
+            st.error("Could not find your user ID. Try logging out and back in.")
+        else:
+            pdf = {}
+            if uploaded_file is not None:
+                try:
+                    # Save PDF file (deduplicated by content); its text is extracted in the background
+                    data = uploaded_file.getvalue()
+                    pdf_hash, pdf_path = pdf_store.put(data)
+                    pdf = dict(pdf_path=pdf_path, pdf_hash=pdf_hash, pdf_name=uploaded_file.name,
+                               pdf_size=len(data), pdf_status="processing")
+                except Exception as e:
+                    st.warning(f"Could not save PDF: {e}")
+
+            try:
+                note_id = create_note(user["id"], title, content, **pdf)
+            except sqlite3.IntegrityError:
+                # The account was deleted (from another session); log this one out too
+                st.session_state.pop("user", None)
+                st.session_state.pop("google_token", None)
+                st.error("Your account no longer exists, so the note was not saved. Please log in again.")
+                return
+            if pdf and get_pdf_status(note_id)[0] == "processing":
+                pdf_ingest.submit(note_id, pdf["pdf_path"], pdf["pdf_hash"])
+            st.success("Note saved!")
+            # The new note also shows up in All Notes, so rerun the whole app
+            st.rerun()
+
+
+@st.fragment
+def my_notes_view(user: dict):
+    note_editor(user)
+
+    st.subheader("Your Notes")
+    my_search = st.text_input("🔍 Search your notes", key="my_search").strip()
+
+    if user.get("id") is not None and not my_search:
+        notes, more_notes = load_pages("my_notes_pages", lambda cursor: get_user_notes_page(user["id"], cursor))
+    else:
+        notes, more_notes = [], None
+
+    if my_search and user.get("id") is not None:
+        show_search_results(search_notes(user["id"], my_search), show_author=False)
+    elif notes:
+        if st.button("✨ Analyze my notes", help="Summary, sentiment and keywords for notes not analyzed yet"):
+            with st.spinner("Analyzing your notes…"):
+                stats = analyze_user_notes(user["id"])
+            if stats["failed"]:
+                st.warning(f"Analyzed {stats['analyzed']} notes; {stats['failed']} could not be analyzed.")
+            else:
+                st.success(f"Analyzed {stats['analyzed']} notes in {stats['seconds']:.1f} s.")
+
+        analyses = get_note_analyses([note[0] for note in notes])
+        for note_id, note_title, note_preview, created_at, pdf_path, pdf_status, pdf_name in notes:
+            col1, col2 = st.columns([6, 1])
+            with col1:
+                st.markdown(f"### {note_title}")
+            with col2:
+                if st.button("🗑️", key=f"del_{note_id}"):
+                    if delete_note(note_id, user["id"]):
+                        st.success("Note deleted!")
+                        st.rerun()
+                    else:
+                        st.error("Failed to delete note.")
+            show_note_body(note_id, note_preview, "my")
+            if note_id in analyses:
+                summary, sentiment, keywords = analyses[note_id]
+                with st.expander("✨ AI analysis"):
+                    st.write(summary)
+                    st.caption(f"Sentiment: {sentiment}")
+                    st.caption(f"Keywords: {keywords}")
+            if pdf_status == "processing":
+                pdf_progress(note_id)
+            elif pdf_status == "failed":
+                st.caption("⚠️ Could not read text from this PDF; the chatbot won't see it.")
+            if pdf_path and os.path.exists(pdf_path):
+                pdf_download_button(note_id, pdf_path, pdf_name or os.path.basename(pdf_path), "my")
+            st.caption(f"Created at: {created_at}")
+            st.markdown("---")
+        if more_notes:
+            load_more_button("my_notes_pages")
+    else:
+        st.info("You have no notes yet.")
+
+
+@st.fragment
+def all_notes_view():
+    st.subheader("All Notes (All Users)")
+    all_search = st.text_input("🔍 Search all notes", key="all_search").strip()
+    if all_search:
+        all_notes, more_all_notes = [], None
+    else:
+        all_notes, more_all_notes = load_pages("all_notes_pages", get_all_notes_page)
+
+    if all_search:
+        show_search_results(search_notes(None, all_search), show_author=True)
+    elif all_notes:
+        for note_id, email, title, preview, created_at, pdf_path, pdf_name in all_notes:
+            st.markdown(f"### {title}  \n*by {email}*")
+            show_note_body(note_id, preview, "all")
+            if pdf_path and os.path.exists(pdf_path):
+                show_pdf_preview(note_id, pdf_path)
+                pdf_download_button(note_id, pdf_path, pdf_name or os.path.basename(pdf_path), "all")
+            st.caption(f"Created at: {created_at}")
+            st.markdown("---")
+        if more_all_notes:
+            load_more_button("all_notes_pages")
+    else:
+        st.info("No notes available.")
+
+
+@st.fragment
+def chatbot_view(user: dict):
+    st.subheader("Chatbot")
+
+    st.info("💬 This AI chatbot looks up the parts of your notes relevant to each question and can answer questions about them. Ask to summarize notes, find specific information, or get insights from your content.")
+
+    if "chat_history" not in st.session_state:
+        st.session_state.chat_history = []
+    # Running summary of older turns, so long conversations keep a bounded prompt
+    memory = st.session_state.setdefault("chat_memory", {})
+
+    # Display chat history
+    for msg in st.session_state.chat_history:
+        with st.chat_message(msg["role"]):
+            st.write(msg["content"])
+
+    # User input
+    if prompt := st.chat_input("Ask me anything..."):
+        # Notes that fit in retrieval.NOTES_PREFIX_TOKENS are sent whole (kept
+        # ready by db.py); otherwise only the excerpts most relevant to the
+        # question go into the prompt
+        notes = get_notes_context(user["id"]).text
+        notes_context = ""
+        if notes is None:
+            chunks = search_note_chunks(user["id"], retrieval.fts_query(prompt))
+            if not chunks:
+                chunks = get_recent_note_chunks(user["id"])
+            notes_context = retrieval.build_context(chunks)
+
+        # Add user message to history
+        st.session_state.chat_history.append({"role": "user", "content": prompt})
+        with st.chat_message("user"):
+            st.write(prompt)
+
+        # Stream the AI response with notes context as it is generated
+        with st.chat_message("assistant"):
+            timing = {}
+            response = st.write_stream(
+                chat_reply_stream(prompt, st.session_state.chat_history[:-1], notes_context=notes_context,
+                                  timing=timing, memory=memory, notes=notes or "")
+            )
+            if "first_token_ms" in timing:
+                tokens = f"~{timing['prompt_tokens']} prompt tokens ({timing.get('cached_tokens', 0)} cached)"
+                st.caption(f"{tokens} · first token after {timing['first_token_ms']:.0f} ms · "
+                           f"done in {timing['total_ms']:.0f} ms")
+        st.session_state.chat_history.append({"role": "assistant", "content": response})
@@ -0,0 +1,139 @@
+import base64
+import hashlib
+import json
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# oauth_utils.py
+# Works out who signed in with Google. The ID token Google returns with the
+# access token already names the user, so it is read locally and no request
+# is made at all. Only without one is the userinfo endpoint called, over a
+# shared keep-alive session with retries, and the answer is remembered for a
+# few minutes per access token.
+
+
+USERINFO_URL = "https://www.googleapis.com/oauth2/v2/userinfo"
+GOOGLE_ISSUERS = ("https://accounts.google.com", "accounts.google.com")
+
+TIMEOUT_SECONDS = 5
+RETRIES = 2                     # on connection errors and 429/5xx, with backoff
+USERINFO_TTL_SECONDS = 300
+USERINFO_CACHE_MAX = 1000
+
+_session = None
+_session_lock = threading.Lock()
+
+_userinfo_cache = {}            # sha256(access token) -> (fetched_at, userinfo)
+_cache_lock = threading.Lock()
+_stats = {"id_token": 0, "cache_hits": 0, "requests": 0}
+
+
+def _get_session() -> requests.Session:
+    """Shared HTTP session: connections to Google are reused between logins."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=RETRIES,
+                backoff_factor=0.3,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=("GET",),
+            )
+            _session = requests.Session()
+            _session.mount("https://", HTTPAdapter(max_retries=retry, pool_maxsize=10))
+            _session.mount("http://", HTTPAdapter(max_retries=retry, pool_maxsize=10))
+        return _session
+
+
+def _unverified(info: dict) -> bool:
+    """Whether Google says the email is not verified (ID token claims or userinfo v2)."""
+    return info.get("email_verified") is False or info.get("verified_email") is False
+
+
+def decode_id_token(id_token: str, client_id: str | None = None) -> dict:
+    """
+    Claims of a Google ID token, or {} if it is malformed, expired, from
+    another issuer, for another client or for an email Google hasn't
+    verified (it could name someone else's password account).
+
+    The signature is not checked: the token comes straight from Google's
+    token endpoint over TLS (the app exchanged the code itself), which
+    OpenID Connect accepts in place of signature validation.
+    """
+    try:
+        payload = id_token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+    except (AttributeError, IndexError, ValueError):
+        return {}
+    if not isinstance(claims, dict) or claims.get("iss") not in GOOGLE_ISSUERS:
+        return {}
+    if client_id and claims.get("aud") != client_id:
+        return {}
+    if claims.get("exp", 0) < time.time() or _unverified(claims):
+        return {}
+    return claims
+
+
+def fetch_userinfo(access_token: str) -> dict:
+    """
+    Userinfo for an access token; cached for USERINFO_TTL_SECONDS, {} on
+    failure or if the email is not verified.
+    """
+    key = hashlib.sha256(access_token.encode("utf-8")).hexdigest()
+    now = time.monotonic()
+    with _cache_lock:
+        entry = _userinfo_cache.get(key)
+        if entry is not None and now - entry[0] < USERINFO_TTL_SECONDS:
+            _stats["cache_hits"] += 1
+            return entry[1]
+        _stats["requests"] += 1
+
+    try:
+        resp = _get_session().get(
+            USERINFO_URL,
+            headers={"Authorization": f"Bearer {access_token}"},
+            timeout=TIMEOUT_SECONDS,
+        )
+        if not resp.ok:
+            return {}
+        info = resp.json()
+    except (requests.RequestException, ValueError):
+        return {}
+    if not isinstance(info, dict) or _unverified(info):
+        return {}
+
+    with _cache_lock:
+        if len(_userinfo_cache) >= USERINFO_CACHE_MAX:
+            _userinfo_cache.clear()
+        _userinfo_cache[key] = (now, info)
+    return info
+
+
+def google_user_info(token: dict, client_id: str | None = None) -> dict:
+    """
+    {"email": ..., "name": ...} for the user a Google token belongs to
+    (taken from the ID token when possible), or {} if it can't be found.
+    """
+    if not isinstance(token, dict):
+        return {}
+
+    claims = decode_id_token(token.get("id_token"), client_id) if token.get("id_token") else {}
+    if claims.get("email"):
+        with _cache_lock:
+            _stats["id_token"] += 1
+        return {"email": claims["email"], "name": claims.get("name", "")}
+
+    access_token = token.get("access_token")
+    if not access_token:
+        return {}
+    return fetch_userinfo(access_token)
+
+
+def get_stats() -> dict:
+    """How logins were resolved: from the ID token, the cache or a request."""
+    with _cache_lock:
+        return dict(_stats)
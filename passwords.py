@@ -0,0 +1,131 @@
+import hmac
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+# passwords.py
+# Password hashing and login throttling. bcrypt is deliberately slow (it
+# releases the GIL while it works, but keeps a core busy), so hashes are
+# computed in a small process pool: a burst of logins queues there and can
+# take at most MAX_WORKERS cores, leaving the rest to the Streamlit script
+# threads. Hashes made with an older cost (or legacy plaintext passwords) are
+# replaced on the next successful login, see db.verify_user.
+
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))   # cost factor; each +1 doubles the work
+MAX_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+
+# Failed logins allowed per WINDOW_SECONDS before further attempts are refused
+MAX_FAILURES_PER_EMAIL = 5
+MAX_FAILURES_PER_IP = 20
+WINDOW_SECONDS = 300
+MAX_TRACKED_KEYS = 10_000   # expired entries are swept once this many are tracked
+
+_workers = None
+_lock = threading.Lock()
+
+_failures = {}              # ("email" | "ip", value) -> deque of failure times
+_failures_lock = threading.Lock()
+
+
+def _hash(password: bytes, rounds: int) -> bytes:
+    """Runs in a worker process."""
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _check(password: bytes, hashed: bytes) -> bool:
+    """Runs in a worker process."""
+    return bcrypt.checkpw(password, hashed)
+
+
+def _executor() -> ProcessPoolExecutor:
+    global _workers
+    with _lock:
+        if _workers is None:
+            # spawn: forking the threaded Streamlit server is not safe
+            _workers = ProcessPoolExecutor(
+                max_workers=MAX_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _workers
+
+
+def hash_password(password: str) -> bytes:
+    """bcrypt hash of a password with the current BCRYPT_ROUNDS."""
+    return _executor().submit(_hash, password.encode("utf-8"), BCRYPT_ROUNDS).result()
+
+
+def check_password(password: str, stored) -> bool:
+    """
+    True if password matches the stored value: a bcrypt hash (bytes), or a
+    legacy plaintext password (str) from before passwords were hashed.
+    """
+    if isinstance(stored, str):
+        return hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8"))
+    if not stored:
+        return False
+    try:
+        return _executor().submit(_check, password.encode("utf-8"), stored).result()
+    except ValueError:
+        return False
+
+
+def needs_rehash(stored) -> bool:
+    """True for plaintext passwords and hashes made with a different cost factor."""
+    if not isinstance(stored, bytes):
+        return True
+    try:
+        # $2b$12$... : the cost sits between the second and third "$"
+        return int(stored.split(b"$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+
+# ---------- LOGIN RATE LIMIT ----------
+
+def _recent(key, now: float) -> deque:
+    times = _failures.get(key)
+    if times is None:
+        return deque()
+    while times and times[0] <= now - WINDOW_SECONDS:
+        times.popleft()
+    if not times:
+        del _failures[key]
+    return times
+
+
+def login_wait_seconds(email: str, ip: str | None = None) -> float:
+    """
+    Seconds until another login attempt for this email (or from this IP) is
+    allowed; 0 when it may go ahead.
+    """
+    now = time.monotonic()
+    wait = 0.0
+    with _failures_lock:
+        for key, limit in ((("email", email.lower()), MAX_FAILURES_PER_EMAIL), (("ip", ip), MAX_FAILURES_PER_IP)):
+            if key[1] is None:
+                continue
+            times = _recent(key, now)
+            if len(times) >= limit:
+                wait = max(wait, times[-limit] + WINDOW_SECONDS - now)
+    return wait
+
+
+def record_login(email: str, ip: str | None, success: bool):
+    """Count a failed attempt, or forget the email's failures after a successful one."""
+    now = time.monotonic()
+    with _failures_lock:
+        if success:
+            _failures.pop(("email", email.lower()), None)
+            return
+        for key in (("email", email.lower()), ("ip", ip)):
+            if key[1] is not None:
+                _failures.setdefault(key, deque()).append(now)
+        if len(_failures) > MAX_TRACKED_KEYS:
+            for key in list(_failures):
+                _recent(key, now)
@@ -0,0 +1,145 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+import db
+
+# pdf_ingest.py
+# Extracts text from uploaded PDFs in the background, so saving a note never
+# waits for PyPDF2. Pages are extracted in a process pool (big PDFs are split
+# into page ranges that run in parallel) and progress is written to the notes
+# table as chunks finish. A file already being extracted for one note is not
+# extracted again for another: that note just waits for the same job.
+
+
+PAGES_PER_TASK = 25      # page range handled by one worker task
+MAX_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+MAX_JOBS = 4             # PDFs being coordinated at the same time
+
+_workers = None          # ProcessPoolExecutor doing the extraction
+_jobs = None             # ThreadPoolExecutor running one coordinator per PDF
+_lock = threading.Lock()
+_resumed = False
+_in_flight = {}          # pdf_hash -> Future of the job extracting that file
+_stats = {"extractions": 0, "joined": 0}
+
+
+def _extract_pages(pdf_path: str, start: int, stop: int) -> list[str]:
+    """Runs in a worker process: extract the text of pages [start, stop)."""
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(pdf_path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def _count_pages(pdf_path: str) -> int:
+    from PyPDF2 import PdfReader
+
+    return len(PdfReader(pdf_path).pages)
+
+
+def _executors():
+    """Create the worker and coordinator pools on first use."""
+    global _workers, _jobs
+    with _lock:
+        if _workers is None:
+            # spawn: forking the threaded Streamlit server is not safe
+            _workers = ProcessPoolExecutor(
+                max_workers=MAX_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            _jobs = ThreadPoolExecutor(max_workers=MAX_JOBS, thread_name_prefix="pdf-ingest")
+        return _workers, _jobs
+
+
+def _ingest(note_id: int, pdf_path: str):
+    """Coordinate one PDF: fan page ranges out to workers, record progress, store the text."""
+    workers, _ = _executors()
+    try:
+        # Same file finished extracting for another note while this one queued
+        if db.use_cached_pdf_text(note_id):
+            return
+
+        with _lock:
+            _stats["extractions"] += 1
+        total = _count_pages(pdf_path)
+        db.set_pdf_progress(note_id, 0, total)
+
+        ranges = [(start, min(start + PAGES_PER_TASK, total)) for start in range(0, total, PAGES_PER_TASK)]
+        futures = [workers.submit(_extract_pages, pdf_path, start, stop) for start, stop in ranges]
+
+        texts, done = [], 0
+        # Collect in page order; later chunks keep running while we wait
+        for (start, stop), future in zip(ranges, futures):
+            texts.extend(future.result())
+            done += stop - start
+            db.set_pdf_progress(note_id, done, total)
+
+        db.finish_pdf_ingest(note_id, "\n\n".join(texts))
+    except Exception:
+        db.finish_pdf_ingest(note_id, "", status="failed")
+
+
+def submit(note_id: int, pdf_path: str, pdf_hash: str | None = None):
+    """
+    Queue text extraction for a note saved with pdf_status="processing".
+    Returns a Future that resolves once the text is stored.
+    With the pdf_hash of a file that is being extracted already, nothing new
+    is extracted: finish_pdf_ingest completes every note waiting on the file.
+    """
+    _, jobs = _executors()
+    if pdf_hash is None:
+        return jobs.submit(_ingest, note_id, pdf_path)
+    with _lock:
+        running = _in_flight.get(pdf_hash)
+        started = running is None
+        if started:
+            running = _in_flight[pdf_hash] = jobs.submit(_ingest, note_id, pdf_path)
+        else:
+            _stats["joined"] += 1
+    if started:
+        # Outside the lock: the callback runs right here if the job is already done
+        running.add_done_callback(lambda _: _forget(pdf_hash, running))
+        return running
+    joined = Future()
+    running.add_done_callback(lambda _: _after_shared(note_id, pdf_path, joined))
+    return joined
+
+
+def _forget(pdf_hash: str, job):
+    with _lock:
+        if _in_flight.get(pdf_hash) is job:
+            del _in_flight[pdf_hash]
+
+
+def _after_shared(note_id: int, pdf_path: str, joined: Future):
+    """Resolve a note that waited for another note's extraction of the same file."""
+    try:
+        status = db.get_pdf_status(note_id)
+        # Normally finish_pdf_ingest has completed it; if not, take the cached text or extract after all
+        if status is not None and status[0] == "processing" and not db.use_cached_pdf_text(note_id):
+            _, jobs = _executors()
+            jobs.submit(_ingest, note_id, pdf_path).add_done_callback(lambda _: joined.set_result(None))
+            return
+    except Exception as e:
+        joined.set_exception(e)
+        return
+    joined.set_result(None)
+
+
+def get_stats() -> dict:
+    """Extractions run in this process, and notes that joined one already running for the same file."""
+    with _lock:
+        return dict(_stats)
+
+
+def resume_pending():
+    """Requeue notes left in "processing" by a previous server process (once per process)."""
+    global _resumed
+    with _lock:
+        if _resumed:
+            return
+        _resumed = True
+    for note_id, pdf_path, pdf_hash in db.get_pending_pdf_notes():
+        submit(note_id, pdf_path, pdf_hash)
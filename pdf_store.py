@@ -0,0 +1,60 @@
+import hashlib
+import io
+import os
+import tempfile
+
+# pdf_store.py
+# Content-addressed storage for uploaded PDFs. Files are named after the
+# SHA-256 of their bytes, so the same PDF uploaded by many users (or uploaded
+# twice) is stored once. db.py keeps the reference counts in pdf_blobs, and
+# maintenance.py removes files once no note references them.
+
+
+PDF_DIR = "data/pdfs"
+
+
+def pdf_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def blob_path(digest: str) -> str:
+    """data/pdfs/ab/abcdef....pdf: two-level layout keeps directories small."""
+    return os.path.join(PDF_DIR, digest[:2], f"{digest}.pdf")
+
+
+def put(data: bytes) -> tuple[str, str]:
+    """
+    Store PDF bytes and return (hash, path).
+    Writing is skipped when a file with the same content already exists.
+    """
+    digest = pdf_hash(data)
+    path = blob_path(digest)
+    try:
+        # A fresh mtime keeps the garbage collector off a file about to be re-used
+        os.utime(path)
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file of our own first so readers never see a half-written
+        # PDF, even while another thread stores the same bytes
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    return digest, path
+
+
+def first_page_pdf(path: str) -> bytes:
+    """A one-page PDF holding only the first page, used as a cheap preview."""
+    from PyPDF2 import PdfReader, PdfWriter
+
+    reader = PdfReader(path)
+    writer = PdfWriter()
+    if reader.pages:
+        writer.add_page(reader.pages[0])
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
@@ -0,0 +1,82 @@
+import re
+
+# retrieval.py
+# Picks the parts of a user's notes that are relevant to a chat message, so
+# the chatbot prompt holds a few top-ranked chunks instead of every note.
+# Chunks are stored in an FTS5 table (see db.py) and ranked with its BM25.
+
+
+CHUNK_WORDS = 200        # words per chunk
+CHUNK_OVERLAP = 40       # words shared by neighbouring chunks
+TOP_K = 8                # chunks fetched per question
+CONTEXT_TOKENS = 2000    # budget for the notes part of the prompt
+NOTES_PREFIX_TOKENS = 2000  # a user's notes up to this size are sent whole instead
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+# Common words that would match almost every chunk
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "can", "do", "does",
+    "for", "from", "had", "has", "have", "how", "i", "in", "is", "it", "its",
+    "me", "my", "of", "on", "or", "so", "that", "the", "their", "there", "this",
+    "to", "was", "we", "what", "when", "where", "which", "who", "why", "will",
+    "with", "you", "your", "about", "tell", "please", "notes", "note",
+}
+
+
+def count_tokens(text: str) -> int:
+    """Rough token count (about 4 characters per token for English text)."""
+    return (len(text) + 3) // 4
+
+
+def chunk_text(text: str, words: int = CHUNK_WORDS, overlap: int = CHUNK_OVERLAP) -> list[str]:
+    """Split text into overlapping chunks of roughly `words` words."""
+    tokens = (text or "").split()
+    if not tokens:
+        return []
+    step = max(1, words - overlap)
+    chunks = []
+    for start in range(0, len(tokens), step):
+        chunks.append(" ".join(tokens[start:start + words]))
+        if start + words >= len(tokens):
+            break
+    return chunks
+
+
+def note_chunks(title: str, content: str, pdf_text: str = "") -> list[str]:
+    """Chunks for one note; each starts with the note title so it reads on its own."""
+    chunks = chunk_text(content) + chunk_text(pdf_text)
+    return [f"{title}: {chunk}" for chunk in chunks]
+
+
+def note_entry(title: str, content: str, pdf_text: str = "") -> str:
+    """One note as it is written into the chatbot's notes section."""
+    if pdf_text:
+        content = f"{content}\n\n--- PDF Content ---\n{pdf_text}"
+    return f"**{title}**\n{content}"
+
+
+def fts_query(message: str) -> str:
+    """
+    Turn a chat message into an FTS5 query matching any of its keywords.
+    Returns "" when the message has no useful words.
+    """
+    seen = []
+    for word in _WORD.findall(message.lower()):
+        if len(word) > 1 and word not in _STOPWORDS and word not in seen:
+            seen.append(word)
+    return " OR ".join(f'"{word}"' for word in seen)
+
+
+def build_context(chunks: list[str], budget: int = CONTEXT_TOKENS) -> str:
+    """Join the best chunks (already ranked) until the token budget is used."""
+    picked, used = [], 0
+    for chunk in chunks:
+        cost = count_tokens(chunk)
+        if used + cost > budget:
+            break
+        picked.append(chunk)
+        used += cost
+    if not picked:
+        return ""
+    return "\n\nRelevant excerpts from the user's notes:\n\n" + "\n\n".join(picked)
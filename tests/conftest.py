@@ -0,0 +1,48 @@
+import os
+import sys
+
+import pytest
+
+# The app's modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db          # noqa: E402
+import passwords   # noqa: E402
+
+
+@pytest.fixture
+def fresh_db(tmp_path, monkeypatch):
+    """An empty, migrated database in a temp folder; cheap bcrypt."""
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "test.db"))
+    monkeypatch.setattr(passwords, "BCRYPT_ROUNDS", 4)
+    db.clear_read_cache()
+    db.init_db()
+    return db.DB_PATH
+
+
+class FakeLLM:
+    """Stands in for the OpenAI client: records every request and answers `reply`."""
+
+    def __init__(self, reply: str = "Stub answer."):
+        from types import SimpleNamespace
+
+        self.reply = reply
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **request):
+        from types import SimpleNamespace
+
+        self.requests.append(request)
+        message = SimpleNamespace(content=self.reply)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    """llm_utils talks to a FakeLLM instead of the API."""
+    import llm_utils
+
+    client = FakeLLM()
+    monkeypatch.setattr(llm_utils, "_get_client", lambda: client)
+    return client
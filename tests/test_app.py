@@ -0,0 +1,65 @@
+import os
+from concurrent.futures import Future
+
+from streamlit.testing.v1 import AppTest
+
+import auth_ui
+import db
+import maintenance
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+def _logged_in(user: db.User) -> AppTest:
+    at = AppTest.from_file(APP, default_timeout=30)
+    at.session_state["user"] = {"id": user.id, "email": user.email, "name": user.name, "method": user.method}
+    return at.run()
+
+
+def _save_note(at: AppTest, title: str) -> AppTest:
+    next(w for w in at.text_input if w.label == "Title").set_value(title)
+    next(w for w in at.text_area if w.label == "Content/Description").set_value("Cells.")
+    return next(w for w in at.button if w.label == "Save Note").click().run()
+
+
+def test_saving_a_note_after_the_account_was_deleted_logs_out(fresh_db):
+    user = db.upsert_google_user("ann@example.com", "Ann")
+    at = _logged_in(user)
+    assert db.delete_user(user.id)
+
+    at = _save_note(at, "Too late")
+
+    assert not at.exception
+    assert "user" not in at.session_state
+    assert any("no longer exists" in error.value for error in at.error)
+    with db._conn() as con:
+        assert con.execute("SELECT COUNT(*) FROM notes").fetchone()[0] == 0
+
+
+def test_saving_a_note(fresh_db):
+    user = db.upsert_google_user("ann@example.com", "Ann")
+
+    at = _save_note(_logged_in(user), "Kept")
+
+    assert not at.exception
+    assert [note[1] for note in db.get_user_notes_page(user.id)[0]] == ["Kept"]
+
+
+def test_a_slow_account_deletion_locks_the_app_until_it_is_done(fresh_db, monkeypatch):
+    user = db.upsert_google_user("ann@example.com", "Ann")
+    deletion = Future()
+    monkeypatch.setattr(maintenance, "delete_user", lambda user_id: deletion)
+    monkeypatch.setattr(auth_ui, "DELETE_WAIT_SECONDS", 0.01)
+
+    at = next(w for w in _logged_in(user).button if w.label == "Delete My Account").click().run()
+
+    assert not at.exception
+    assert at.session_state["user"]["id"] == user.id
+    assert any("still being deleted" in info.value for info in at.info)
+    assert not [w for w in at.button if w.label == "Save Note"]
+
+    deletion.set_result(True)
+    at = at.run()
+
+    assert not at.exception
+    assert "user" not in at.session_state
@@ -0,0 +1,83 @@
+import json
+import zipfile
+
+import bulk
+import db
+
+
+def _user(email: str = "ann@example.com") -> int:
+    return db.upsert_google_user(email, "Ann").id
+
+
+def test_imported_notes_are_searchable_and_triggers_still_index(fresh_db):
+    user_id = _user()
+    notes = ({"user_id": user_id, "title": f"Imported {i}", "content": f"mitochondria lecture {i}"} for i in range(25))
+
+    assert db.import_notes(notes, batch_size=10) == 25
+
+    assert len(db.search_notes(user_id, "mitochondria", limit=100)) == 25
+    assert len(db.search_note_chunks(user_id, "mitochondria", limit=100)) == 25
+    # Outside an import the insert triggers index as usual
+    db.create_note(user_id, "Typed", "ribosome")
+    assert [row[2] for row in db.search_notes(user_id, "ribosome")] == ["Typed"]
+    assert db.search_note_chunks(user_id, "ribosome")
+    with db._conn() as con:
+        assert con.execute("SELECT COUNT(*) FROM bulk_import").fetchone()[0] == 0
+        con.execute("INSERT INTO note_chunks_fts(note_chunks_fts) VALUES ('integrity-check')")
+
+
+def test_import_source_extracts_only_its_own_pdfs(fresh_db, tmp_path, monkeypatch):
+    user_id = _user()
+    # A note of the app still waiting for its PDF text
+    waiting = db.create_note(user_id, "Waiting", "x", str(tmp_path / "other.pdf"), pdf_status="processing",
+                             pdf_hash="other", pdf_name="other.pdf", pdf_size=1)
+    submitted = []
+    monkeypatch.setattr(bulk.pdf_ingest, "submit", lambda note_id, path, pdf_hash: submitted.append(note_id) or _Done())
+    monkeypatch.setattr(bulk.pdf_store, "PDF_DIR", str(tmp_path / "pdfs"))
+
+    source = tmp_path / "backup.zip"
+    with zipfile.ZipFile(source, "w") as archive:
+        archive.writestr("notes.jsonl", json.dumps({"title": "Slides", "content": "x", "pdf": "pdfs/a.pdf"}) + "\n")
+        archive.writestr("pdfs/a.pdf", b"%PDF-1.4 not really")
+
+    assert bulk.import_source(str(source), user_id) == 1
+    assert waiting not in submitted
+    assert len(submitted) == 1
+
+
+class _Done:
+    def result(self):
+        return None
+
+
+def test_import_stores_created_at_the_way_the_app_does(fresh_db, tmp_path):
+    user_id = _user()
+    source = tmp_path / "notes.jsonl"
+    source.write_text("".join(json.dumps(record) + "\n" for record in [
+        {"title": "Space", "content": "x", "created_at": "2024-03-01 09:30:00"},
+        {"title": "T", "content": "x", "created_at": "2024-03-02T09:30:00.123456"},
+        {"title": "Zulu", "content": "x", "created_at": "2024-03-03T09:30:00Z"},
+        {"title": "Offset", "content": "x", "created_at": "2024-03-04T11:30:00+02:00"},
+        {"title": "Date", "content": "x", "created_at": "2024-03-05"},
+    ]))
+
+    assert bulk.import_source(str(source), user_id) == 5
+
+    with db._conn() as con:
+        stored = dict(con.execute("SELECT title, created_at FROM notes"))
+    assert stored == {"Space": "2024-03-01 09:30:00", "T": "2024-03-02 09:30:00", "Zulu": "2024-03-03 09:30:00",
+                      "Offset": "2024-03-04 09:30:00", "Date": "2024-03-05 00:00:00"}
+
+
+def test_import_rejects_other_created_at_formats(fresh_db, tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(bulk.pdf_store, "PDF_DIR", bulk.pdf_store.PDF_DIR)  # main() sets it from --pdf-dir
+    _user()
+    source = tmp_path / "notes.jsonl"
+    source.write_text(json.dumps({"email": "ann@example.com", "title": "US", "created_at": "03/01/2024"}) + "\n")
+
+    assert bulk.main(["--db", db.DB_PATH, "--pdf-dir", str(tmp_path / "pdfs"), "import", str(source)]) == 1
+
+    assert "'03/01/2024'" in capsys.readouterr().err
+    assert bulk.pdf_store.PDF_DIR == str(tmp_path / "pdfs")
+    with db._conn() as con:
+        assert con.execute("SELECT COUNT(*) FROM notes").fetchone()[0] == 0
@@ -0,0 +1,61 @@
+import threading
+
+import llm_utils
+
+
+def _long_history(turns: int) -> list[dict]:
+    history = []
+    for i in range(turns):
+        history += [{"role": "user", "content": f"Question {i} about my notes?"},
+                    {"role": "assistant", "content": f"Answer {i}."}]
+    return history
+
+
+def test_chat_reply_summarizes_with_a_single_request_slot(fresh_db, fake_llm, monkeypatch):
+    # Every slot taken by chat_reply itself: the summary call must not need another
+    monkeypatch.setattr(llm_utils, "_request_slots", threading.BoundedSemaphore(1))
+    history = _long_history(llm_utils.RECENT_MESSAGES + llm_utils.SUMMARY_BATCH)
+    memory = {}
+    result = []
+
+    worker = threading.Thread(target=lambda: result.append(llm_utils.chat_reply("And now?", history, memory=memory)),
+                              daemon=True)
+    worker.start()
+    worker.join(timeout=10)
+
+    assert not worker.is_alive(), "chat_reply deadlocked"
+    assert result == ["Stub answer."]
+    assert memory["summarized"] == len(history) - llm_utils.RECENT_MESSAGES
+    assert len(fake_llm.requests) == 2   # the summary, then the reply
+    assert "Summary of the earlier conversation" in fake_llm.requests[-1]["messages"][1]["content"]
+
+
+def test_consecutive_turns_share_the_instructions_and_notes_byte_for_byte(fresh_db, fake_llm):
+    user_id = llm_utils.db.upsert_google_user("ann@example.com", "Ann").id
+    for i in range(3):
+        llm_utils.db.create_note(user_id, f"Note {i}", f"Cells and mitochondria, part {i}.")
+    notes = llm_utils.db.get_notes_context(user_id).text
+    history, memory = [], {}
+
+    for i in range(4):
+        answer = llm_utils.chat_reply(f"Question {i}?", history, notes_context=f"Relevant excerpts:\n\nexcerpt {i}",
+                                      memory=memory, notes=notes)
+        history += [{"role": "user", "content": f"Question {i}?"}, {"role": "assistant", "content": answer}]
+
+    first = [request["messages"][0] for request in fake_llm.requests]
+    assert all(message == first[0] for message in first)
+    assert first[0]["content"] == llm_utils.CHAT_INSTRUCTIONS + llm_utils.notes_block(notes)
+    # Per-turn content comes after the history, right before the message
+    for i, request in enumerate(fake_llm.requests):
+        assert request["messages"][-2]["content"].endswith(f"excerpt {i}")
+
+
+def test_new_note_only_extends_the_notes_block(fresh_db):
+    user_id = llm_utils.db.upsert_google_user("ann@example.com", "Ann").id
+    llm_utils.db.create_note(user_id, "First", "Cells.")
+    before = llm_utils.notes_block(llm_utils.db.get_notes_context(user_id).text)
+
+    llm_utils.db.create_note(user_id, "Second", "Mitochondria.")
+    after = llm_utils.notes_block(llm_utils.db.get_notes_context(user_id).text)
+
+    assert after.startswith(before) and after != before
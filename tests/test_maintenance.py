@@ -0,0 +1,23 @@
+import threading
+
+import db
+import maintenance
+
+
+def test_delete_user_resolves_before_the_cleanup_pass(fresh_db, monkeypatch):
+    user_id = db.upsert_google_user("ann@example.com", "Ann").id
+    db.create_note(user_id, "Note", "Cells.")
+    cleanup_started, release = threading.Event(), threading.Event()
+
+    def slow_pass(*args):
+        cleanup_started.set()
+        release.wait(10)
+
+    monkeypatch.setattr(maintenance, "run_once", slow_pass)
+    try:
+        assert maintenance.delete_user(user_id).result(timeout=5) is True
+        assert db.get_user("ann@example.com") is None
+        assert cleanup_started.wait(5)
+    finally:
+        release.set()
+
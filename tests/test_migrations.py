@@ -0,0 +1,101 @@
+import sqlite3
+
+import pytest
+
+import db
+
+
+@pytest.fixture
+def old_db(tmp_path, monkeypatch):
+    """
+    A database an older version of the app left behind: migrated up to v11
+    only, on a plain connection (no auto-vacuum, no foreign keys). Call it
+    with the rows to add.
+    """
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "old.db"))
+    db.clear_read_cache()
+
+    def create(*statements):
+        con = sqlite3.connect(db.DB_PATH)
+        try:
+            for number, migration in enumerate(db.MIGRATIONS[:11], start=1):
+                migration(con)
+                con.execute(f"PRAGMA user_version = {number}")
+            for statement in statements:
+                con.execute(statement)
+            con.commit()
+        finally:
+            con.close()
+
+    return create
+
+
+def _auto_vacuum() -> int:
+    con = sqlite3.connect(db.DB_PATH)
+    try:
+        return con.execute("PRAGMA auto_vacuum").fetchone()[0]
+    finally:
+        con.close()
+
+
+def test_upgrade_logs_the_orphaned_notes_it_removes(old_db, caplog):
+    old_db(
+        "INSERT INTO users(id, email, name) VALUES (1, 'ann@example.com', 'Ann')",
+        "INSERT INTO notes(user_id, title, content) VALUES (1, 'Kept', 'Cells.')",
+        "INSERT INTO notes(user_id, title, content) VALUES (999, 'Orphan', 'No owner.')",
+    )
+
+    db.init_db()
+
+    assert "1 from notes" in caplog.text
+    with db._conn() as con:
+        assert con.execute("SELECT title FROM notes").fetchall() == [("Kept",)]
+
+
+def test_upgrade_without_orphans_logs_nothing(old_db, caplog):
+    old_db("INSERT INTO users(id, email, name) VALUES (1, 'ann@example.com', 'Ann')")
+
+    db.init_db()
+
+    assert "v12" not in caplog.text
+
+
+def test_upgrade_switches_to_incremental_auto_vacuum(old_db):
+    old_db(
+        "INSERT INTO users(id, email, name) VALUES (1, 'ann@example.com', 'Ann')",
+        *(f"INSERT INTO notes(user_id, title, content) VALUES (1, 'Note {i}', '{'x' * 4000}')" for i in range(200)),
+    )
+    assert _auto_vacuum() == 0
+
+    db.init_db()
+
+    assert _auto_vacuum() == 2
+    assert len(db.get_user_notes(1)) == 200
+    assert db.delete_user(1)
+    assert db.get_free_pages()[0] > 0
+    assert db.incremental_vacuum(100_000) > 0
+    assert db.get_free_pages()[0] == 0
+
+
+def test_failed_switch_to_auto_vacuum_is_logged_and_retried(old_db, caplog):
+    import maintenance
+
+    old_db("INSERT INTO users(id, email, name) VALUES (1, 'ann@example.com', 'Ann')")
+    writer = db._get_pool()._writer
+
+    def no_auto_vacuum(action, name, value, *rest):
+        return sqlite3.SQLITE_DENY if action == sqlite3.SQLITE_PRAGMA and name == "auto_vacuum" and value else sqlite3.SQLITE_OK
+
+    writer.set_authorizer(no_auto_vacuum)
+    try:
+        db.init_db()
+    finally:
+        writer.set_authorizer(None)
+
+    assert "incremental auto-vacuum" in caplog.text
+    assert _auto_vacuum() == 0
+    assert db.get_user("ann@example.com") is not None
+
+    maintenance.reclaim_space()
+
+    assert _auto_vacuum() == 2
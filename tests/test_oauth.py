@@ -0,0 +1,118 @@
+import base64
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import oauth_utils
+
+
+def _id_token(**claims) -> str:
+    def part(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+
+    claims = {"iss": "https://accounts.google.com", "aud": "client", "exp": time.time() + 3600,
+              "email": "ann@example.com", "email_verified": True, "name": "Ann", **claims}
+    return f"{part({'alg': 'RS256'})}.{part(claims)}.signature"
+
+
+@pytest.fixture
+def userinfo(monkeypatch):
+    """A local userinfo endpoint: answers with `stub.status` and `stub.info`, counting requests."""
+
+    class Stub:
+        status = 200
+        info = {"email": "ann@example.com", "verified_email": True, "name": "Ann"}
+        requests = 0
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            Stub.requests += 1
+            payload = json.dumps(Stub.info).encode()
+            self.send_response(Stub.status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(oauth_utils, "USERINFO_URL", f"http://127.0.0.1:{server.server_address[1]}/userinfo")
+    monkeypatch.setattr(oauth_utils, "_userinfo_cache", {})
+    try:
+        yield Stub
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_id_token_claims():
+    claims = oauth_utils.decode_id_token(_id_token(), "client")
+
+    assert claims["email"] == "ann@example.com"
+    assert claims["name"] == "Ann"
+
+
+@pytest.mark.parametrize("token", [
+    _id_token(iss="https://evil.example.com"),
+    _id_token(aud="another client"),
+    _id_token(exp=time.time() - 1),
+    _id_token(email_verified=False),
+    "not a token",
+    "a.!!!.c",
+    "a." + base64.urlsafe_b64encode(b"[1, 2]").decode() + ".c",
+], ids=["issuer", "audience", "expired", "unverified email", "not a JWT", "bad base64", "not an object"])
+def test_id_token_rejections(token):
+    assert oauth_utils.decode_id_token(token, "client") == {}
+
+
+def test_id_token_signs_in_without_a_request(userinfo):
+    info = oauth_utils.google_user_info({"access_token": "t", "id_token": _id_token()}, "client")
+
+    assert info["email"] == "ann@example.com"
+    assert userinfo.requests == 0
+
+
+def test_userinfo_fallback_is_cached_until_the_ttl(userinfo, monkeypatch):
+    assert oauth_utils.google_user_info({"access_token": "t"})["email"] == "ann@example.com"
+    assert oauth_utils.google_user_info({"access_token": "t"})["email"] == "ann@example.com"
+    assert userinfo.requests == 1
+
+    oauth_utils.google_user_info({"access_token": "other"})
+    assert userinfo.requests == 2
+
+    later = time.monotonic() + oauth_utils.USERINFO_TTL_SECONDS + 1
+    monkeypatch.setattr(oauth_utils.time, "monotonic", lambda: later)
+    oauth_utils.google_user_info({"access_token": "t"})
+    assert userinfo.requests == 3
+
+
+def test_rejected_id_token_falls_back_to_userinfo(userinfo):
+    info = oauth_utils.google_user_info({"access_token": "t", "id_token": _id_token(aud="another client")}, "client")
+
+    assert info["email"] == "ann@example.com"
+    assert userinfo.requests == 1
+
+
+def test_userinfo_errors_are_not_cached(userinfo):
+    userinfo.status = 401
+
+    assert oauth_utils.google_user_info({"access_token": "t"}) == {}
+
+    userinfo.status = 200
+    assert oauth_utils.google_user_info({"access_token": "t"})["email"] == "ann@example.com"
+    assert userinfo.requests == 2
+
+
+@pytest.mark.parametrize("key", ["verified_email", "email_verified"])
+def test_unverified_userinfo_email_is_rejected(userinfo, key):
+    userinfo.info = {"email": "ann@example.com", key: False}
+
+    assert oauth_utils.google_user_info({"access_token": "t"}) == {}
+    assert oauth_utils.google_user_info(
+        {"access_token": "t2", "id_token": _id_token(email_verified=False)}, "client") == {}
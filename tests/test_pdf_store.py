@@ -0,0 +1,40 @@
+import os
+import threading
+
+import pdf_store
+
+
+def test_concurrent_puts_of_the_same_new_pdf(tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_store, "PDF_DIR", str(tmp_path / "pdfs"))
+    data = b"%PDF-1.4\n" + os.urandom(8 * 1024 * 1024)
+    start = threading.Barrier(8)
+    results, errors = [], []
+
+    def upload():
+        start.wait()
+        try:
+            results.append(pdf_store.put(data))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=upload) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(set(results)) == 1
+    digest, path = results[0]
+    with open(path, "rb") as f:
+        assert f.read() == data
+    assert os.listdir(os.path.dirname(path)) == [f"{digest}.pdf"]
+
+
+def test_put_of_a_stored_pdf_keeps_the_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_store, "PDF_DIR", str(tmp_path / "pdfs"))
+    digest, path = pdf_store.put(b"%PDF-1.4 same")
+    os.utime(path, (0, 0))
+
+    assert pdf_store.put(b"%PDF-1.4 same") == (digest, path)
+    assert os.path.getmtime(path) > 0
@@ -0,0 +1,61 @@
+import pytest
+
+import db
+
+
+def _last_query(fn, *args) -> str:
+    """The last SQL statement fn(*args) runs (the function itself, past the read cache)."""
+    pool = db._get_pool()
+    with pool.reader():
+        pass  # at least one idle reader, which single-threaded reads check out
+    connections = [pool._writer, *pool._idle]
+    statements = []
+    for con in connections:
+        con.set_trace_callback(statements.append)
+    try:
+        fn.__wrapped__(*args)
+    finally:
+        for con in connections:
+            con.set_trace_callback(None)
+    return statements[-1]
+
+
+def _plan(sql: str) -> list[str]:
+    with db._conn() as con:
+        return [row[3] for row in con.execute(f"EXPLAIN QUERY PLAN {sql}")]
+
+
+@pytest.fixture
+def listing(fresh_db):
+    """A user with a few pages of notes, and the cursors of their second page and of everyone's."""
+    user_id = db.upsert_google_user("ann@example.com", "Ann").id
+    for i in range(3 * db.PAGE_SIZE):
+        db.create_note(user_id, f"Note {i}", "Cells.")
+    user_cursor = db.get_user_notes_page.__wrapped__(user_id)[1]
+    all_cursor = db.get_all_notes_page.__wrapped__()[1]
+    assert user_cursor and all_cursor
+    return user_id, user_cursor, all_cursor
+
+
+LISTINGS = {
+    "get_user_notes": lambda user_id, user_cursor, all_cursor: (db.get_user_notes, user_id),
+    "get_all_notes": lambda user_id, user_cursor, all_cursor: (db.get_all_notes,),
+    "get_user_notes_page": lambda user_id, user_cursor, all_cursor: (db.get_user_notes_page, user_id),
+    "get_user_notes_page, older": lambda user_id, user_cursor, all_cursor: (
+        db.get_user_notes_page, user_id, user_cursor),
+    "get_user_notes_page, newer": lambda user_id, user_cursor, all_cursor: (
+        db.get_user_notes_page, user_id, user_cursor, db.PAGE_SIZE, "newer"),
+    "get_all_notes_page": lambda user_id, user_cursor, all_cursor: (db.get_all_notes_page,),
+    "get_all_notes_page, older": lambda user_id, user_cursor, all_cursor: (db.get_all_notes_page, all_cursor),
+    "get_all_notes_page, newer": lambda user_id, user_cursor, all_cursor: (
+        db.get_all_notes_page, all_cursor, db.PAGE_SIZE, "newer"),
+}
+
+
+@pytest.mark.parametrize("name", LISTINGS)
+def test_listing_uses_an_index_without_sorting(listing, name):
+    fn, *args = LISTINGS[name](*listing)
+
+    plan = _plan(_last_query(fn, *args))
+
+    assert not [step for step in plan if "TEMP B-TREE" in step or step == "SCAN notes"], plan
@@ -0,0 +1,75 @@
+import db
+
+
+def _user(email: str) -> int:
+    return db.upsert_google_user(email, email.split("@")[0]).id
+
+
+def _titles(rows) -> list[str]:
+    return [row[2] for row in rows]
+
+
+def test_search_matches_only_the_last_word_as_a_prefix(fresh_db):
+    user_id = _user("ann@example.com")
+    db.create_note(user_id, "Biology", "The mitochondria of the cell.")
+    db.create_note(user_id, "Physics", "Mitosis is not physics; cellular automata are.")
+
+    assert _titles(db.search_notes(user_id, "mito")) == ["Physics", "Biology"]
+    assert _titles(db.search_notes(user_id, "mitochondria cel")) == ["Biology"]
+    # Only the word being typed is a prefix: "mito" before another word must match whole
+    assert db.search_notes(user_id, "mito cell") == []
+
+
+def test_search_needs_three_characters(fresh_db):
+    user_id = _user("ann@example.com")
+    db.create_note(user_id, "Ox", "An ox is a bovine.")
+
+    assert db.search_notes(user_id, "o") == []
+    assert db.search_notes(user_id, "ox") == []
+    assert _titles(db.search_notes(user_id, "bov")) == ["Ox"]
+    # Short last words still count once the query is long enough, but not as prefixes
+    assert _titles(db.search_notes(user_id, "bovine ox")) == ["Ox"]
+    assert db.search_notes(user_id, "bovine o") == []
+
+
+def test_search_of_one_user_skips_everyone_else(fresh_db):
+    ann, bob = _user("ann@example.com"), _user("bob@example.com")
+    db.create_note(ann, "Ann's cells", "Cells divide.")
+    db.create_note(bob, "Bob's cells", "Cells grow.")
+
+    assert _titles(db.search_notes(ann, "cells")) == ["Ann's cells"]
+    assert sorted(_titles(db.search_notes(None, "cells"))) == ["Ann's cells", "Bob's cells"]
+    # The owner column is not searched as text
+    assert db.search_notes(None, f"u{ann}") == []
+
+
+def test_search_ranks_title_matches_first_then_newest(fresh_db):
+    user_id = _user("ann@example.com")
+    db.create_note(user_id, "Membrane", "Lecture notes.")
+    db.create_note(user_id, "Shopping", "Buy a membrane filter.")
+    db.create_note(user_id, "Lab", "Membrane potential.")
+
+    rows = db.search_notes(user_id, "membrane")
+
+    assert _titles(rows) == ["Membrane", "Lab", "Shopping"]
+    assert "**membrane**" in rows[2][3]
+
+
+def test_search_finds_bulk_imported_and_pdf_text(fresh_db):
+    user_id = _user("ann@example.com")
+    db.import_notes([{"user_id": user_id, "title": "Imported", "content": "ribosome",
+                      "pdf_path": "x.pdf", "pdf_text": "endoplasmic reticulum"}])
+
+    assert _titles(db.search_notes(user_id, "ribosome")) == ["Imported"]
+    assert _titles(db.search_notes(user_id, "reticulum")) == ["Imported"]
+    assert db.search_notes(_user("bob@example.com"), "ribosome") == []
+
+
+def test_search_ranks_only_the_newest_matches(fresh_db, monkeypatch):
+    monkeypatch.setattr(db, "SEARCH_RANK_LIMIT", 3)
+    user_id = _user("ann@example.com")
+    db.create_note(user_id, "Enzyme", "enzyme")
+    for i in range(5):
+        db.create_note(user_id, f"Note {i}", "about an enzyme")
+
+    assert _titles(db.search_notes(user_id, "enzyme")) == ["Note 4", "Note 3", "Note 2"]
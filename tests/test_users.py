@@ -0,0 +1,94 @@
+import dataclasses
+
+import pytest
+
+import db
+import passwords
+
+
+def _stored_password(email: str):
+    with db._conn() as con:
+        return con.execute("SELECT password FROM users WHERE email = ?", (email,)).fetchone()[0]
+
+
+def test_get_user_returns_a_user_record(fresh_db):
+    db.create_user("ann@example.com", "secret")
+
+    user = db.get_user("ann@example.com")
+
+    assert isinstance(user, db.User)
+    assert user.email == "ann@example.com"
+    assert user.method == "manual"
+    assert not hasattr(user, "password")
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        user.email = "other@example.com"
+
+
+def test_get_user_missing(fresh_db):
+    assert db.get_user("nobody@example.com") is None
+
+
+def test_verify_user(fresh_db):
+    db.create_user("ann@example.com", "secret")
+
+    assert db.verify_user("ann@example.com", "secret") == db.get_user("ann@example.com")
+
+
+def test_verify_user_wrong_password(fresh_db):
+    db.create_user("ann@example.com", "secret")
+
+    assert db.verify_user("ann@example.com", "wrong") is None
+
+
+def test_verify_user_missing_user(fresh_db):
+    assert db.verify_user("nobody@example.com", "secret") is None
+
+
+def test_verify_user_google_account_has_no_password(fresh_db):
+    db.create_google_user("gil@example.com", "Gil")
+
+    assert db.verify_user("gil@example.com", "") is None
+
+
+def test_verify_user_rehashes_with_new_cost(fresh_db, monkeypatch):
+    db.create_user("ann@example.com", "secret")
+    monkeypatch.setattr(passwords, "BCRYPT_ROUNDS", 5)
+
+    assert db.verify_user("ann@example.com", "secret") is not None
+    assert not passwords.needs_rehash(_stored_password("ann@example.com"))
+
+
+def test_verify_user_upgrades_plaintext_password(fresh_db):
+    with db._conn(write=True) as con:
+        con.execute("INSERT INTO users (email, password) VALUES (?, ?)", ("old@example.com", "legacy"))
+
+    assert db.verify_user("old@example.com", "legacy") is not None
+    assert isinstance(_stored_password("old@example.com"), bytes)
+    assert db.verify_user("old@example.com", "legacy") is not None
+
+
+def test_upsert_google_user_creates_account(fresh_db):
+    user = db.upsert_google_user("gil@example.com", "Gil")
+
+    assert user == db.get_user("gil@example.com")
+    assert (user.name, user.method) == ("Gil", "google")
+
+
+def test_upsert_google_user_existing_google_account(fresh_db):
+    first = db.upsert_google_user("gil@example.com", "Gil")
+
+    again = db.upsert_google_user("gil@example.com", "Gilbert")
+
+    assert again == first   # same row, name kept
+
+
+def test_upsert_google_user_existing_password_account(fresh_db):
+    db.create_user("ann@example.com", "secret")
+    manual = db.get_user("ann@example.com")
+
+    user = db.upsert_google_user("ann@example.com", "Ann")
+
+    assert user.id == manual.id
+    assert user.method == "manual"   # keeps its login method
+    assert user.name == "Ann"        # fills in the missing name
+    assert db.verify_user("ann@example.com", "secret") is not None